@@ -56,6 +56,9 @@ project_id               = os.environ['GCP_PROJECT']
 raw_bucket_name          = os.environ['ENV_RAW_BUCKET'] 
 processed_bucket_name    = "gs://" + os.environ['ENV_PROCESSED_BUCKET'] 
 pyspark_code             = "gs://" + raw_bucket_name + "/pyspark-code/export_taxi_data_from_bq_to_gcs.py"
+pyspark_py_files         = ["gs://" + raw_bucket_name + "/pyspark-code/hadoop_fs_utils.py",
+                            "gs://" + raw_bucket_name + "/pyspark-code/spark_job_metrics.py",
+                            "gs://" + raw_bucket_name + "/pyspark-code/spark_metrics_report.py"]
 region                   = os.environ['ENV_REGION'] 
 zone                     = os.environ['ENV_ZONE'] 
 dataproc_bucket          = os.environ['ENV_DATAPROC_BUCKET'] 
@@ -114,6 +117,7 @@ with airflow.DAG('sample-export-taxi-trips-from-bq-to-gcs-cluster',
         cluster_name='process-taxi-trips-export-{{ ts_nodash.lower() }}',
         dataproc_jars=[jar_file],
         main=pyspark_code,
+        pyfiles=pyspark_py_files,
         arguments=[project_id, taxi_dataset_id, dataproc_bucket, processed_bucket_name])
 
     # Delete Cloud Dataproc cluster
@@ -56,6 +56,9 @@ region                   = "us-central1"
 raw_bucket_name          = os.environ['ENV_RAW_BUCKET'] 
 processed_bucket_name    = "gs://" + os.environ['ENV_PROCESSED_BUCKET'] 
 pyspark_code             = "gs://" + raw_bucket_name + "/pyspark-code/export_taxi_data_from_bq_to_gcs.py"
+pyspark_py_files         = ["gs://" + raw_bucket_name + "/pyspark-code/hadoop_fs_utils.py",
+                            "gs://" + raw_bucket_name + "/pyspark-code/spark_job_metrics.py",
+                            "gs://" + raw_bucket_name + "/pyspark-code/spark_metrics_report.py"]
 jar_file                 = "gs://" + raw_bucket_name + "/pyspark-code/spark-bigquery-with-dependencies_2.12-0.26.0.jar"
 # hardcoded the subnet name
 dataproc_subnet          = "bigspark-subnet"
@@ -85,6 +88,7 @@ BATCH_CONFIG = {
         {
             'main_python_file_uri': pyspark_code,
             'jar_file_uris': [ jar_file ],
+            'python_file_uris': pyspark_py_files,
             'args': [project_id, taxi_dataset_id, bigspark_bucket, processed_bucket_name ]
         },
     'environment_config':
@@ -50,6 +50,11 @@ raw_bucket_name             = os.environ['ENV_RAW_BUCKET']
 processed_bucket_name       = os.environ['ENV_PROCESSED_BUCKET'] 
 pyspark_code_create_tables  = "gs://" + raw_bucket_name + "/pyspark-code/convert_taxi_to_iceberg_create_tables.py"
 pyspark_code_update_data    = "gs://" + raw_bucket_name + "/pyspark-code/convert_taxi_to_iceberg_data_updates.py"
+pyspark_py_files            = ["gs://" + raw_bucket_name + "/pyspark-code/hadoop_fs_utils.py",
+                               "gs://" + raw_bucket_name + "/pyspark-code/output_file_sizing.py",
+                               "gs://" + raw_bucket_name + "/pyspark-code/spark_job_metrics.py",
+                               "gs://" + raw_bucket_name + "/pyspark-code/spark_metrics_report.py"]
+target_file_size_mb         = "256"
 region                      = os.environ['ENV_REGION'] 
 zone                        = os.environ['ENV_ZONE'] 
 yellow_source               = "gs://" + raw_bucket_name + "/raw/taxi-data/yellow/*/*.parquet"
@@ -112,7 +117,8 @@ with airflow.DAG('sample-iceberg-create-tables-update-data',
         cluster_name='process-taxi-data-iceberg-{{ ts_nodash.lower() }}',
         dataproc_jars=[icebergJARFile],
         main=pyspark_code_create_tables,
-        arguments=[yellow_source, green_source, icebergWarehouse])
+        pyfiles=pyspark_py_files,
+        arguments=[yellow_source, green_source, icebergWarehouse, "--target-file-size-mb", target_file_size_mb])
 
     # Perform data updates to the Iceberg data
     perform_iceberg_data_updates = dataproc_operator.DataProcPySparkOperator(
@@ -123,6 +129,7 @@ with airflow.DAG('sample-iceberg-create-tables-update-data',
         cluster_name='process-taxi-data-iceberg-{{ ts_nodash.lower() }}',
         dataproc_jars=[icebergJARFile],
         main=pyspark_code_update_data,
+        pyfiles=pyspark_py_files,
         arguments=[icebergWarehouse])
 
     # Delete Cloud Dataproc cluster
@@ -50,6 +50,17 @@ project_id               = os.environ['GCP_PROJECT']
 raw_bucket_name          = os.environ['ENV_RAW_BUCKET'] 
 processed_bucket_name    = os.environ['ENV_PROCESSED_BUCKET'] 
 pyspark_code             = "gs://" + raw_bucket_name + "/pyspark-code/convert_taxi_to_parquet.py"
+pyspark_py_files         = ["gs://" + raw_bucket_name + "/pyspark-code/hadoop_fs_utils.py",
+                            "gs://" + raw_bucket_name + "/pyspark-code/spark_job_metrics.py",
+                            "gs://" + raw_bucket_name + "/pyspark-code/output_file_sizing.py",
+                            "gs://" + raw_bucket_name + "/pyspark-code/taxi_schema_registry.py",
+                            "gs://" + raw_bucket_name + "/pyspark-code/raw_file_manifest.py",
+                            "gs://" + raw_bucket_name + "/pyspark-code/parquet_layout.py",
+                            "gs://" + raw_bucket_name + "/pyspark-code/parquet_writer_profiles.py",
+                            "gs://" + raw_bucket_name + "/pyspark-code/arrow_taxi_engine.py",
+                            "gs://" + raw_bucket_name + "/pyspark-code/parquet_file_index.py",
+                            "gs://" + raw_bucket_name + "/pyspark-code/spark_metrics_report.py",
+                            "gs://" + raw_bucket_name + "/pyspark-code/resumable_units.py"]
 region                   = os.environ['ENV_REGION'] 
 zone                     = os.environ['ENV_ZONE'] 
 yellow_source            = "gs://" + raw_bucket_name + "/raw/taxi-data/yellow/*/*.parquet"
@@ -59,6 +70,12 @@ dataproc_bucket          = os.environ['ENV_DATAPROC_BUCKET']
 dataproc_subnet          = os.environ['ENV_DATAPROC_SUBNET'] 
 dataproc_service_account = os.environ['ENV_DATAPROC_SERVICE_ACCOUNT'] 
 
+# Optional arguments of convert_taxi_to_parquet.py, appended to the job arguments below (the defaults keep the original output):
+#   "--target-file-size-mb", "256"       Size the files of each year/month from its row count instead of up to 5 files
+#   "--layout", "sort"                   Sort the rows for row group skipping, also writes the timestamps as TIMESTAMP_MICROS instead of INT96
+#   "--execution-mode", "concurrent"     Run the yellow, green and lookup pipelines at the same time in FAIR scheduler pools
+#   "--incremental"                      Only rewrite the partitions of the new, changed or deleted raw files
+
 # For small test run
 # yellow_source   = "gs://big-query-demo-09/test-taxi/yellow/*.parquet"
 # green_source    = "gs://big-query-demo-09/test-taxi/green/*.parquet"
@@ -111,6 +128,7 @@ with airflow.DAG('step-02-taxi-data-processing',
         region=region,
         cluster_name='process-taxi-data-{{ ts_nodash.lower() }}',
         main=pyspark_code,
+        pyfiles=pyspark_py_files,
         arguments=[yellow_source, green_source, destination])
 
 
@@ -0,0 +1,345 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Single node (no Spark) conversion of the raw taxi files with pyarrow, for small inputs such as one new month.
+#          The raw files are streamed as record batches, renamed/cast with the rules of taxi_schema_registry.py and
+#          written as year=/month= partitioned Parquet, CSV and JSON with the same schema as the Spark job.
+#          The files are written the way the Spark job writes them with its defaults in a UTC session (Dataproc):
+#          Parquet timestamps as INT96, CSV/JSON timestamps as yyyy-MM-dd'T'HH:mm:ss.SSSXXX (2021-01-01T00:15:56.000Z),
+#          doubles as the JVM prints them (10.0, 1.0E-4), CSV values quoted only when needed and JSON without spaces.
+#          benchmarks/verify_arrow_engine_parity.py compares the rows and the Parquet physical schemas of both engines.
+#          Only the year=/month= partitions present in the input are replaced (like a dynamic partition overwrite).
+#          Paths can be local or gs:// (pyarrow GcsFileSystem).
+#          Ship this file with the job: --py-files gs://${rawBucket}/pyspark-code/arrow_taxi_engine.py
+
+import decimal
+import fnmatch
+import json
+import math
+import re
+import time
+import uuid
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset
+import pyarrow.fs
+import pyarrow.parquet
+
+from taxi_schema_registry import GetTripsTableColumns, TRIPS_TABLE_YEARS, LOOKUP_TABLES
+from parquet_file_index import FILE_INDEX_COLUMNS, FILE_INDEX_NAME, FileIndexToJson, FormatIndexValue, MergeFileIndex, ReadFileIndex
+
+# Spark SQL type names (taxi_schema_registry.py) to Arrow types.
+# Spark reads Parquet timestamps that are adjusted to UTC as TIMESTAMP (BigQuery as well).
+ARROW_TYPES = {
+    "bigint":    pa.int64(),
+    "int":       pa.int32(),
+    "double":    pa.float64(),
+    "string":    pa.string(),
+    "timestamp": pa.timestamp("us", tz="UTC")
+}
+
+PARTITION_COLUMNS = ["year", "month"]
+
+# Rows per record batch read from the raw files (bounds the memory used)
+BATCH_SIZE = 128 * 1024
+
+# Values the Spark CSV writer quotes (the quotes in them are escaped with a backslash)
+CSV_QUOTED_VALUE_PATTERN = r'[,"\r\n]'
+
+
+def ListSourceFiles(source):
+    """Returns (filesystem, { path: size }) for the files matching a glob (e.g. gs://bucket/raw/yellow/*/*.parquet).
+       Like a Hadoop glob, * does not match a /.  A folder returns all the files under it."""
+    staticPrefix = re.split(r"[*?\[{]", source, 1)[0]
+    baseUri = staticPrefix if staticPrefix == source else staticPrefix.rsplit("/", 1)[0]
+    fs, basePath = pyarrow.fs.FileSystem.from_uri(baseUri)
+    pattern = basePath + source[len(baseUri):]
+
+    baseInfo = fs.get_file_info(basePath)
+    if baseInfo.type == pyarrow.fs.FileType.File:
+        return fs, {basePath: baseInfo.size}
+    if baseInfo.type == pyarrow.fs.FileType.NotFound:
+        return fs, {}
+
+    files = {}
+    for fileInfo in fs.get_file_info(pyarrow.fs.FileSelector(basePath, recursive=True)):
+        if fileInfo.type != pyarrow.fs.FileType.File:
+            continue
+        if pattern != basePath and \
+           (fileInfo.path.count("/") != pattern.count("/") or not fnmatch.fnmatchcase(fileInfo.path, pattern)):
+            continue
+        files[fileInfo.path] = fileInfo.size
+    return fs, files
+
+
+def GetSourceBytes(source):
+    fs, files = ListSourceFiles(source)
+    return sum(files.values())
+
+
+def GetOutputSchema(color):
+    return pa.schema([(outputColumn, ARROW_TYPES[typeName]) for outputColumn, rawColumn, typeName in GetTripsTableColumns(color)])
+
+
+def ConvertBatch(batch, color):
+    """Renames/casts a raw record batch to the trips table columns, adds year/month and keeps TRIPS_TABLE_YEARS.
+       Columns missing from a raw file are null.  Float to int casts truncate like Spark."""
+    columns = []
+    for outputColumn, rawColumn, typeName in GetTripsTableColumns(color):
+        arrowType = ARROW_TYPES[typeName]
+        if rawColumn in batch.schema.names:
+            columns.append(pc.cast(batch.column(rawColumn), arrowType, safe=False))
+        else:
+            columns.append(pa.nulls(batch.num_rows, arrowType))
+    table = pa.Table.from_arrays(columns, schema=GetOutputSchema(color))
+
+    pickupDateTime = table.column("Pickup_DateTime")
+    table = table \
+        .append_column("year", pc.cast(pc.year(pickupDateTime), pa.int32())) \
+        .append_column("month", pc.cast(pc.month(pickupDateTime), pa.int32()))
+    return table.filter(pc.is_in(table.column("year"), value_set=pa.array(TRIPS_TABLE_YEARS, pa.int32())))
+
+
+def ReadRawBatches(fs, paths, color):
+    """Streams the raw files one record batch at a time.  Each file is its own dataset since the
+       column types drift between years (e.g. airport_fee), the batches are cast to one schema."""
+    rawColumns = [rawColumn for outputColumn, rawColumn, typeName in GetTripsTableColumns(color)]
+    for path in sorted(paths):
+        dataset = pyarrow.dataset.dataset(path, filesystem=fs, format="parquet")
+        for batch in dataset.to_batches(columns=[rawColumn for rawColumn in rawColumns if rawColumn in dataset.schema.names],
+                                        batch_size=BATCH_SIZE):
+            if batch.num_rows > 0:
+                yield ConvertBatch(batch, color)
+
+
+################################################################################################
+# CSV and JSON values, as the Spark writers format them
+################################################################################################
+def FormatTimestamps(array):
+    """yyyy-MM-dd'T'HH:mm:ss.SSSXXX in UTC: 2021-01-01T00:15:56.000Z (the %S of a millisecond timestamp has the
+       3 fractional digits, the microseconds are truncated like Spark does)"""
+    milliseconds = pc.cast(array, pa.timestamp("ms", tz="UTC"), safe=False)
+    return pc.binary_join_element_wise(pc.strftime(milliseconds, format="%Y-%m-%dT%H:%M:%S"), "Z", "")
+
+
+def FormatDouble(value):
+    """Double.toString of the JVM: 10.0, 0.5, 1.0E-4, 1.2345678E7, NaN, -Infinity"""
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    if value == 0 or 1e-3 <= abs(value) < 1e7:
+        return repr(value)
+    # Shortest digits of the value, as d.dddE<exponent>
+    sign, digits, exponent = decimal.Decimal(repr(value)).as_tuple()
+    scientificExponent = len(digits) + exponent - 1
+    digits = "".join(str(digit) for digit in digits).rstrip("0")
+    return ("-" if sign else "") + digits[0] + "." + (digits[1:] or "0") + "E" + str(scientificExponent)
+
+
+def FormatDoubles(array):
+    """FormatDouble of a double column.  Arrow prints the same shortest digits, without the .0 of a whole
+       number and without an exponent in the range where the JVM does not use one either."""
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    text = pc.cast(array, pa.string())
+    text = pc.if_else(pc.match_substring(text, "."), text, pc.binary_join_element_wise(text, ".0", ""))
+    magnitude = pc.abs(array)
+    scientific = pc.fill_null(pc.or_(pc.is_nan(array), pc.or_(
+        pc.greater_equal(magnitude, 1e7), pc.and_(pc.less(magnitude, 1e-3), pc.not_equal(magnitude, 0)))), False)
+    if pc.any(scientific).as_py():
+        values = [FormatDouble(value) for value in pc.filter(array, scientific).to_pylist()]
+        text = pc.replace_with_mask(text, scientific, pa.array(values, pa.string()))
+    return text
+
+
+def FormatCsvColumn(array):
+    """Values of a CSV column: nulls empty, empty strings "", strings trimmed and quoted when needed"""
+    if pa.types.is_timestamp(array.type):
+        text = FormatTimestamps(array)
+    elif pa.types.is_floating(array.type):
+        text = FormatDoubles(array)
+    elif pa.types.is_string(array.type):
+        text = pc.utf8_trim_whitespace(array)
+        quoted = pc.binary_join_element_wise('"', pc.replace_substring(text, '"', '\\"'), '"', "")
+        text = pc.if_else(pc.match_substring_regex(text, CSV_QUOTED_VALUE_PATTERN), quoted, text)
+        text = pc.if_else(pc.equal(text, ""), '""', text)
+    else:
+        text = pc.cast(array, pa.string())
+    return pc.fill_null(text, "")
+
+
+def ToCsvLines(table):
+    lines = pc.binary_join_element_wise(*[FormatCsvColumn(column) for column in table.columns], ",")
+    return "".join(line + "\n" for line in lines.to_pylist())
+
+
+def ToJsonLines(table):
+    """JSON lines: no spaces, null fields left out, NaN and Infinity quoted (they are not JSON numbers)"""
+    fragments = []
+    for field, column in zip(table.schema, table.columns):
+        prefix = json.dumps(field.name) + ":"
+        if pa.types.is_timestamp(field.type):
+            values = [None if value is None else json.dumps(value) for value in FormatTimestamps(column).to_pylist()]
+        elif pa.types.is_floating(field.type):
+            text = FormatDoubles(column)
+            values = pc.if_else(pc.is_finite(column), text, pc.binary_join_element_wise('"', text, '"', "")).to_pylist()
+        else:
+            values = [None if value is None else json.dumps(value, ensure_ascii=False) for value in column.to_pylist()]
+        fragments.append([None if value is None else prefix + value for value in values])
+    return "".join("{" + ",".join(fragment for fragment in row if fragment is not None) + "}\n" for row in zip(*fragments))
+
+
+class PartitionedWriter:
+    """Writes tables to <tablePath>/year=Y/month=M/part-00000-<run id>.<format>, one open file per partition.
+       The existing files of a partition are deleted the first time the partition is written."""
+
+    def __init__(self, fs, tablePath, outputFormat, schema):
+        self.fs = fs
+        self.tablePath = tablePath.rstrip("/")
+        self.outputFormat = outputFormat
+        self.schema = schema
+        self.runId = str(uuid.uuid4())
+        self.streams = {}
+        self.writers = {}
+        self.filePaths = {}
+        self.statistics = {}
+
+    def Open(self, partitionValues):
+        partitionPath = self.tablePath + "/" + "/".join(
+            partitionColumn + "=" + str(partitionValue) for partitionColumn, partitionValue in zip(PARTITION_COLUMNS, partitionValues))
+        if self.fs.get_file_info(partitionPath).type != pyarrow.fs.FileType.NotFound:
+            self.fs.delete_dir_contents(partitionPath)
+        self.fs.create_dir(partitionPath)
+
+        filePath = partitionPath + "/part-00000-" + self.runId + "." + self.outputFormat
+        stream = self.fs.open_output_stream(filePath)
+        self.filePaths[partitionValues] = filePath
+        self.statistics[partitionValues] = {"rows": 0, "min": {}, "max": {}}
+        self.streams[partitionValues] = stream
+        if self.outputFormat == "parquet":
+            # INT96 timestamps, the default of spark.sql.parquet.outputTimestampType
+            self.writers[partitionValues] = pyarrow.parquet.ParquetWriter(stream, self.schema, compression="snappy",
+                                                                          use_deprecated_int96_timestamps=True)
+        elif self.outputFormat == "csv":
+            stream.write((",".join(self.schema.names) + "\n").encode("utf-8"))
+
+    def Write(self, table):
+        partitionKeys = pc.add(pc.multiply(pc.cast(table.column("year"), pa.int64()), 100), table.column("month"))
+        for partitionKey in pc.unique(partitionKeys).to_pylist():
+            partitionValues = (partitionKey // 100, partitionKey % 100)
+            if partitionValues not in self.streams:
+                self.Open(partitionValues)
+            partitionTable = table.filter(pc.equal(partitionKeys, partitionKey)).drop(PARTITION_COLUMNS)
+            self.UpdateStatistics(partitionValues, partitionTable)
+
+            if self.outputFormat == "parquet":
+                self.writers[partitionValues].write_table(partitionTable)
+            elif self.outputFormat == "csv":
+                self.streams[partitionValues].write(ToCsvLines(partitionTable).encode("utf-8"))
+            else:
+                self.streams[partitionValues].write(ToJsonLines(partitionTable).encode("utf-8"))
+
+    def UpdateStatistics(self, partitionValues, partitionTable):
+        """Row count and min/max of the file index columns (parquet_file_index.py) of a partition file"""
+        statistics = self.statistics[partitionValues]
+        statistics["rows"] += partitionTable.num_rows
+        for columnName in FILE_INDEX_COLUMNS:
+            if columnName not in partitionTable.schema.names:
+                continue
+            minMax = pc.min_max(partitionTable.column(columnName)).as_py()
+            for bound, value, better in [("min", minMax["min"], lambda new, old: new < old),
+                                         ("max", minMax["max"], lambda new, old: new > old)]:
+                oldValue = statistics[bound].get(columnName)
+                if value is not None and (oldValue is None or better(value, oldValue)):
+                    statistics[bound][columnName] = value
+
+    def GetFileIndexEntries(self):
+        """Returns the parquet_file_index.py entries of the files written (call after Close)"""
+        entries = []
+        for partitionValues, filePath in sorted(self.filePaths.items()):
+            statistics = self.statistics[partitionValues]
+            entries.append({
+                "path":  filePath[len(self.tablePath) + 1:],
+                "rows":  statistics["rows"],
+                "bytes": self.fs.get_file_info(filePath).size,
+                "min":   {columnName: FormatIndexValue(statistics["min"].get(columnName)) for columnName in FILE_INDEX_COLUMNS},
+                "max":   {columnName: FormatIndexValue(statistics["max"].get(columnName)) for columnName in FILE_INDEX_COLUMNS}
+            })
+        return entries
+
+    def Close(self):
+        for writer in self.writers.values():
+            writer.close()
+        for stream in self.streams.values():
+            if not stream.closed:
+                stream.close()
+        return len(self.streams)
+
+
+def ConvertTripsTableArrow(color, source, destination):
+    """Converts the raw files of one color to <destination><color>/trips_table/parquet, /csv and /json.
+       Returns the number of rows written."""
+    sourceFs, files = ListSourceFiles(source)
+    if len(files) == 0:
+        print("ConvertTaxiDataArrow: " + color + " no files found for " + source)
+        return 0
+
+    destinationFs, tablePath = pyarrow.fs.FileSystem.from_uri(destination.rstrip("/") + "/" + color + "/trips_table")
+    schema = GetOutputSchema(color)
+    writers = [PartitionedWriter(destinationFs, tablePath + "/" + outputFormat, outputFormat, schema)
+               for outputFormat in ["parquet", "csv", "json"]]
+
+    rowCount = 0
+    try:
+        for table in ReadRawBatches(sourceFs, files, color):
+            rowCount += table.num_rows
+            for writer in writers:
+                writer.Write(table)
+    finally:
+        partitionCount = max(writer.Close() for writer in writers)
+
+    # Only the partitions written were replaced, keep the index entries of the others
+    parquetWriter = writers[0]
+    tableUri = destination.rstrip("/") + "/" + color + "/trips_table/parquet"
+    entries = MergeFileIndex(ReadFileIndex(tableUri) or [], parquetWriter.GetFileIndexEntries(), list(parquetWriter.filePaths))
+    with destinationFs.open_output_stream(parquetWriter.tablePath + "/" + FILE_INDEX_NAME) as indexStream:
+        indexStream.write(FileIndexToJson(entries).encode("utf-8"))
+
+    print("ConvertTaxiDataArrow: " + color + " raw files: ", len(files), " bytes: ", sum(files.values()),
+          " rows: ", rowCount, " partitions: ", partitionCount)
+    return rowCount
+
+
+def WriteLookupTablesArrow(destination):
+    destinationFs, basePath = pyarrow.fs.FileSystem.from_uri(destination.rstrip("/"))
+    for tableName, (columns, rows) in LOOKUP_TABLES.items():
+        table = pa.Table.from_pylist([dict(zip(columns, row)) for row in rows],
+                                     schema=pa.schema([(columns[0], pa.int64()), (columns[1], pa.string())]))
+        tablePath = basePath + "/" + tableName
+        if destinationFs.get_file_info(tablePath).type != pyarrow.fs.FileType.NotFound:
+            destinationFs.delete_dir_contents(tablePath)
+        destinationFs.create_dir(tablePath)
+        pyarrow.parquet.write_table(table, tablePath + "/part-00000-" + str(uuid.uuid4()) + ".parquet", filesystem=destinationFs)
+
+
+def ConvertTaxiDataArrow(sourceYellow, sourceGreen, destination):
+    startTime = time.time()
+    for color, source in [("yellow", sourceYellow), ("green", sourceGreen)]:
+        ConvertTripsTableArrow(color, source, destination)
+    WriteLookupTablesArrow(destination)
+    print("ConvertTaxiDataArrow: total wall seconds: ", round(time.time() - startTime, 2))
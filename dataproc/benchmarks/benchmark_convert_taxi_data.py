@@ -0,0 +1,121 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Runs ConvertTaxiData on raw files laid out like the TLC downloads (e.g. the synthetic files of
+#          generate_synthetic_taxi_data.py, which it can generate first with --generate-rows) once per write mode /
+#          execution mode, and prints for each run: rows/sec and raw MB/sec, the bytes written per format and the
+#          peak executor memory.  The numbers come from the metrics report of the run (spark_metrics_report.py).
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pyspark.sql import SparkSession
+from convert_taxi_to_parquet import ConvertTaxiData, WRITE_MODES, EXECUTION_MODES
+from hadoop_fs_utils import GetPathSizeBytes
+from generate_synthetic_taxi_data import GenerateSyntheticTaxiData, DEFAULT_GREEN_SHARE, DEFAULT_SEED
+from taxi_schema_registry import TRIPS_TABLE_YEARS
+
+# Format of a trips table write: <destination><color>/trips_table/<format>, resumable: <destination>_staging/<color>/<format>/year=...
+TRIPS_TABLE_FORMAT_PATTERN = re.compile(r"(?:/trips_table|_staging/\w+)/(parquet|csv|json)(?:/|$)")
+
+# Executor memory of the report that is printed
+PRINTED_MEMORY_METRICS = ["JVMHeapMemory", "OnHeapExecutionMemory", "OnHeapStorageMemory"]
+
+
+def GetRawSource(dataDir, color):
+    return dataDir + "/" + color + "/*/*.parquet"
+
+
+def SummarizeReport(report):
+    """Returns (rows written to the Parquet trips tables, { format: bytes written to the trips tables })"""
+    parquetRows = 0
+    bytesByFormat = {"parquet": 0, "csv": 0, "json": 0}
+    for write in report["writes"]:
+        match = None if write["outputPath"] is None else TRIPS_TABLE_FORMAT_PATTERN.search(write["outputPath"])
+        if match is None:
+            # Lookup tables
+            continue
+        bytesByFormat[match.group(1)] += write["outputBytes"]
+        if match.group(1) == "parquet":
+            parquetRows += write["outputRecords"]
+    return parquetRows, bytesByFormat
+
+
+def BenchmarkConvertTaxiData(dataDir, workDir, writeModes, executionModes, targetFileSizeMB, parquetProfile):
+    dataDir = dataDir.rstrip("/")
+    workDir = workDir.rstrip("/")
+
+    spark = SparkSession.builder.appName("BenchmarkConvertTaxiData").getOrCreate()
+    rawBytes = GetPathSizeBytes(spark, GetRawSource(dataDir, "yellow")) + GetPathSizeBytes(spark, GetRawSource(dataDir, "green"))
+    spark.stop()
+    print("BenchmarkConvertTaxiData: raw bytes: ", rawBytes)
+
+    results = []
+    for writeMode in writeModes:
+        for executionMode in executionModes:
+            runName = writeMode + "-" + executionMode
+            # The session ConvertTaxiData gets: executor memory sampled every second and sent every 2 seconds,
+            # so the peaks of short runs are seen (ConvertTaxiData stops it)
+            SparkSession.builder \
+                .appName("ConvertTaxiData") \
+                .config("spark.executor.metrics.pollingInterval", "1s") \
+                .config("spark.executor.heartbeatInterval", "2s") \
+                .getOrCreate()
+
+            startTime = time.time()
+            report = ConvertTaxiData(GetRawSource(dataDir, "yellow"), GetRawSource(dataDir, "green"),
+                                     workDir + "/" + runName + "/", writeMode=writeMode, targetFileSizeMB=targetFileSizeMB,
+                                     parquetProfile=parquetProfile, executionMode=executionMode,
+                                     metricsPath=workDir + "/" + runName + "_metrics.json")
+            seconds = time.time() - startTime
+            parquetRows, bytesByFormat = SummarizeReport(report)
+            results.append((runName, seconds, parquetRows, bytesByFormat, report["peakExecutorMemory"]))
+
+    for runName, seconds, parquetRows, bytesByFormat, peakMemory in results:
+        print("BenchmarkConvertTaxiData: {:22s} seconds: {:8.1f}  rows: {:11d}  rows/sec: {:9.0f}  raw MB/sec: {:7.1f}".format(
+            runName, seconds, parquetRows, parquetRows / seconds, rawBytes / seconds / 1024 / 1024))
+        print("BenchmarkConvertTaxiData: {:22s} bytes written: {}".format(
+            runName, "  ".join("{}: {}".format(outputFormat, outputBytes) for outputFormat, outputBytes in bytesByFormat.items())))
+        print("BenchmarkConvertTaxiData: {:22s} peak executor memory MB: {}".format(
+            runName, "  ".join("{}: {:.0f}".format(metricName, peakMemory.get(metricName, 0) / 1024 / 1024) for metricName in PRINTED_MEMORY_METRICS)))
+
+
+# python benchmark_convert_taxi_data.py /tmp/synthetic-taxi-data /tmp/convert-benchmark --generate-rows 10000000
+# python benchmark_convert_taxi_data.py "gs://${rawBucket}/raw/taxi-data" /tmp/convert-benchmark --write-modes derive,persist --execution-modes sequential,concurrent
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="benchmark_convert_taxi_data")
+    parser.add_argument("dataDir", help="Folder of the <color>/<year>/<color>_tripdata_<year>-<month>.parquet raw files")
+    parser.add_argument("workDir", help="Where the output and the metrics report of each run are written")
+    parser.add_argument("--generate-rows", dest="generateRows", type=int, default=None,
+                        help="Generate this many rows of synthetic raw files in dataDir first (generate_synthetic_taxi_data.py)")
+    parser.add_argument("--years", type=lambda value: [int(dataYear) for dataYear in value.split(",")], default=TRIPS_TABLE_YEARS,
+                        help="Comma separated years of the generated files (default: the years of the trips tables)")
+    parser.add_argument("--write-modes", dest="writeModes", type=lambda value: value.split(","), default=["derive"],
+                        help="Comma separated write modes of ConvertTaxiData, one run each: " + ",".join(WRITE_MODES) + " (default: derive)")
+    parser.add_argument("--execution-modes", dest="executionModes", type=lambda value: value.split(","), default=["sequential"],
+                        help="Comma separated execution modes of ConvertTaxiData, one run each: " + ",".join(EXECUTION_MODES) + " (default: sequential)")
+    parser.add_argument("--target-file-size-mb", dest="targetFileSizeMB", type=int, default=None)
+    parser.add_argument("--parquet-profile", dest="parquetProfile", default="default")
+    args = parser.parse_args()
+
+    if args.generateRows is not None:
+        GenerateSyntheticTaxiData(args.dataDir, args.generateRows, args.years, DEFAULT_GREEN_SHARE, DEFAULT_SEED, None)
+    BenchmarkConvertTaxiData(args.dataDir, args.workDir, args.writeModes, args.executionModes, args.targetFileSizeMB, args.parquetProfile)
@@ -0,0 +1,131 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Writes the yellow trips table normalized and denormalized (--denormalize of convert_taxi_to_parquet.py)
+#          and runs the aggregations of sql-scripts/azure_omni_biglake/sp_demo_azure_omni_queries.sql both ways:
+#          a scan of the trips joined with the lookup tables, and a scan of the pre-joined trips.
+#          Prints the size of both tables and of the description columns, then the fastest time of each query
+#          and the bytes it read.  Requires pyarrow (footer reads) and the Spark UI (input bytes).
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import col, expr
+from convert_taxi_to_parquet import ReadYellowTaxiData, WriteTripsTableParquet, WriteLookupTables, AddLookupDescriptions
+from hadoop_fs_utils import GetPathSizeBytes
+from spark_job_metrics import GetInputBytesForJobGroup
+from taxi_schema_registry import LOOKUP_TABLES, LOOKUP_TABLE_TRIP_COLUMNS
+from benchmark_parquet_writer_profiles import GetCompressedBytesByColumn
+
+# Lookup tables of each query: SELECT <descriptions>, SUM(Total_Amount) ... GROUP BY <descriptions>
+QUERIES = {
+    "vendor, rate code":               ["vendor_table", "rate_code_table"],
+    "vendor, rate code, payment type": ["vendor_table", "rate_code_table", "payment_type_table"]
+}
+
+
+def GetDescriptionColumn(tableName):
+    return LOOKUP_TABLES[tableName][0][1]
+
+
+def QueryWithJoins(spark, workDir, tableNames):
+    """The query as written today: the trips joined back to the lookup tables (INNER JOIN)"""
+    df = spark.read.parquet(workDir + "/normalized/parquet")
+    for tableName in tableNames:
+        keyColumn = LOOKUP_TABLES[tableName][0][0]
+        df_lookup = spark.read.parquet(workDir + "/" + tableName).withColumnRenamed(keyColumn, "_lookup_key")
+        df = df.join(df_lookup, col(LOOKUP_TABLE_TRIP_COLUMNS[tableName]) == col("_lookup_key")).drop("_lookup_key")
+    descriptionColumns = [GetDescriptionColumn(tableName) for tableName in tableNames]
+    return df.groupBy(*descriptionColumns).agg(expr("sum(Total_Amount)").alias("GrandTotal"))
+
+
+def QueryDenormalized(spark, workDir, tableNames):
+    """The same query on the pre-joined trips (a null description is a trip the INNER JOIN drops)"""
+    descriptionColumns = [GetDescriptionColumn(tableName) for tableName in tableNames]
+    df = spark.read.parquet(workDir + "/denormalized/parquet")
+    for descriptionColumn in descriptionColumns:
+        df = df.filter(col(descriptionColumn).isNotNull())
+    return df.groupBy(*descriptionColumns).agg(expr("sum(Total_Amount)").alias("GrandTotal"))
+
+
+def NormalizeRows(rows):
+    """Sorted groups with rounded totals (the sums are not added in the same order)"""
+    return sorted((tuple(row[:-1]), round(row[-1], 2)) for row in rows)
+
+
+def TimeQuery(spark, buildQuery, jobGroup, iterations):
+    """Returns the rows, the fastest time and the bytes read by one iteration"""
+    timings = []
+    spark.sparkContext.setJobGroup(jobGroup, jobGroup)
+    for iteration in range(iterations):
+        startTime = time.time()
+        rows = buildQuery().collect()
+        timings.append(time.time() - startTime)
+    spark.sparkContext.setLocalProperty("spark.jobGroup.id", None)
+
+    inputBytes = GetInputBytesForJobGroup(spark, jobGroup)
+    return rows, min(timings), None if inputBytes is None else inputBytes // iterations
+
+
+def BenchmarkDenormalizedReads(sourceYellow, workDir, iterations):
+    spark = SparkSession \
+        .builder \
+        .appName("BenchmarkDenormalizedReads") \
+        .getOrCreate()
+
+    workDir = workDir.rstrip("/")
+    df_with_partition_cols = ReadYellowTaxiData(spark, sourceYellow)
+    WriteLookupTables(spark, workDir + "/")
+
+    for tableName, df_trips in [("normalized", df_with_partition_cols),
+                                ("denormalized", AddLookupDescriptions(spark, df_with_partition_cols))]:
+        startTime = time.time()
+        WriteTripsTableParquet(spark, df_trips, workDir + "/" + tableName, None)
+        print("BenchmarkDenormalizedReads: {:12s} write seconds: {:7.2f}  bytes: {}".format(
+            tableName, time.time() - startTime, GetPathSizeBytes(spark, workDir + "/" + tableName + "/parquet")))
+
+    columnBytes = GetCompressedBytesByColumn(workDir + "/denormalized/parquet")
+    for tableName in LOOKUP_TABLES:
+        descriptionColumn = GetDescriptionColumn(tableName)
+        if descriptionColumn in columnBytes:
+            print("BenchmarkDenormalizedReads: {:24s} bytes: {}".format(descriptionColumn, columnBytes[descriptionColumn]))
+
+    for queryName, tableNames in QUERIES.items():
+        joinRows, joinSeconds, joinBytes = TimeQuery(
+            spark, lambda: QueryWithJoins(spark, workDir, tableNames), "join-" + queryName, iterations)
+        denormalizedRows, denormalizedSeconds, denormalizedBytes = TimeQuery(
+            spark, lambda: QueryDenormalized(spark, workDir, tableNames), "denormalized-" + queryName, iterations)
+
+        print("BenchmarkDenormalizedReads: {:32s} scan+join seconds: {:7.2f} bytes read: {}  pre-joined seconds: {:7.2f} bytes read: {}  same result: {}".format(
+            queryName, joinSeconds, joinBytes, denormalizedSeconds, denormalizedBytes, NormalizeRows(joinRows) == NormalizeRows(denormalizedRows)))
+
+    spark.stop()
+
+
+# python benchmark_denormalized_reads.py "gs://${rawBucket}/raw/taxi-data/yellow/2021/*.parquet" /tmp/denormalized-reads
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="benchmark_denormalized_reads")
+    parser.add_argument("sourceYellow")
+    parser.add_argument("workDir", help="Where the normalized and denormalized trips tables and the lookup tables are written")
+    parser.add_argument("--iterations", type=int, default=3)
+    args = parser.parse_args()
+
+    BenchmarkDenormalizedReads(args.sourceYellow, args.workDir, args.iterations)
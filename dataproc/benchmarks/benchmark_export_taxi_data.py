@@ -0,0 +1,152 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Runs ExportTaxiData without BigQuery: a Parquet stand-in of taxi_trips (ParquetSource, partitioned by
+#          PartitionDate like the BigQuery table) is built from the yellow/green trips tables of ConvertTaxiData
+#          (e.g. on the synthetic data of generate_synthetic_taxi_data.py) at each --scales, then exported once per
+#          read mode / partition granularity / write mode / concurrency.  Prints for each run: the files per month,
+#          the bytes per file and rows/sec, which is the cost of the write side (partitioning and small files).
+#          Write modes: direct (each task writes a file in every folder it has rows of) or shuffle (--shuffle-by-partition,
+#          at most one file per folder up to --max-file-size-mb).  Adaptive is always shuffled.
+
+import argparse
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import col, lit, trunc
+from compaction_planner import ListTableFiles
+from export_taxi_data_from_bq_to_gcs import ExportTaxiData, GetPartitionLayout, GetTablePath, ParquetSource, EXPORT_YEARS, \
+    GRANULARITY_MODES, READ_MODES, TAXI_TRIPS_COLUMNS, DEFAULT_MAX_FILE_SIZE_MB, DEFAULT_MIN_FILE_SIZE_MB
+
+# direct: the original write, shuffle: --shuffle-by-partition
+WRITE_MODES = ["direct", "shuffle"]
+
+# INTEGER columns of taxi_trips (the others are FLOAT64, STRING or TIMESTAMP, read with the same Spark types)
+TAXI_TRIPS_INTEGER_COLUMNS = ["Vendor_Id", "Rate_Code_Id", "PULocationID", "DOLocationID", "Passenger_Count", "Payment_Type_Id", "Trip_Type"]
+
+
+def BuildTaxiTripsTable(spark, tripsTablesDir, path, scale):
+    """Writes taxi_trips (the columns and types of the BigQuery table) from the trips tables, partitioned by PartitionDate.
+       A scale below 1 samples the rows, above 1 repeats them."""
+    tables = []
+    for color, taxiCompany in [("yellow", "Yellow"), ("green", "Green")]:
+        df = spark.read.parquet(tripsTablesDir.rstrip("/") + "/" + color + "/trips_table/parquet") \
+            .where(col("year").isin(EXPORT_YEARS)) \
+            .withColumn("TaxiCompany", lit(taxiCompany)) \
+            .withColumn("PartitionDate", trunc(col("Pickup_DateTime"), "month"))
+        columns = []
+        for column in TAXI_TRIPS_COLUMNS:
+            # Trip_Type and Ehail_Fee are green only
+            value = col(column) if column in df.columns else lit(None)
+            if column in TAXI_TRIPS_INTEGER_COLUMNS:
+                value = value.cast("bigint")
+            elif column not in df.columns:
+                value = value.cast("double")
+            columns.append(value.alias(column))
+        tables.append(df.select(*columns))
+    df_taxi_trips = tables[0].unionByName(tables[1])
+
+    copies = [df_taxi_trips] * int(scale)
+    if scale % 1 > 0:
+        copies.append(df_taxi_trips.sample(fraction=scale % 1, seed=42))
+    df_scaled = copies[0]
+    for df_copy in copies[1:]:
+        df_scaled = df_scaled.unionByName(df_copy)
+
+    df_scaled \
+        .write \
+        .mode("overwrite") \
+        .partitionBy("PartitionDate") \
+        .parquet(path)
+    return spark.read.parquet(path).count()
+
+
+def SummarizeExport(spark, tablePath):
+    """Returns { "2021-01": [bytes of each file] } of an exported table"""
+    tableRoot, filesByFolder = ListTableFiles(spark, tablePath)
+    filesByMonth = {}
+    for folder, files in filesByFolder.items():
+        yearFolder, monthFolder = folder.split("/")[:2]
+        monthName = yearFolder.split("=")[1] + "-" + monthFolder.split("=")[1].zfill(2)
+        filesByMonth.setdefault(monthName, []).extend(fileBytes for path, fileBytes in files)
+    return filesByMonth
+
+
+def BenchmarkExportTaxiData(tripsTablesDir, workDir, scales, readModes, granularities, writeModes, concurrencies, minFileSizeMB, maxFileSizeMB):
+    workDir = workDir.rstrip("/")
+
+    results = []
+    for scale in scales:
+        sourcePath = workDir + "/taxi_trips-x" + str(scale)
+        spark = SparkSession.builder.appName("BenchmarkExportTaxiData").getOrCreate()
+        sourceRows = BuildTaxiTripsTable(spark, tripsTablesDir, sourcePath, scale)
+        spark.stop()
+        print("BenchmarkExportTaxiData: scale {} taxi_trips rows: {}".format(scale, sourceRows))
+
+        for readMode in readModes:
+            for granularity in granularities:
+                for writeMode in (writeModes if granularity != "adaptive" else ["shuffle"]):
+                    # The table read is a single write, it has no months to run concurrently
+                    for maxConcurrentExports in (concurrencies if readMode == "query" else [1]):
+                        runName = "x{}-{}-{}-{}-c{}".format(scale, readMode, granularity, writeMode, maxConcurrentExports)
+                        destination = workDir + "/" + runName
+                        partitionLayout = GetPartitionLayout(granularity, minFileSizeMB, shuffleByPartition=(writeMode == "shuffle"),
+                                                             maxFileSizeMB=maxFileSizeMB)
+                        report = ExportTaxiData(None, None, None, destination, destination + "_metrics.json", maxConcurrentExports, readMode, None,
+                                                partitionLayout, True, ParquetSource(sourcePath))
+                        results.append((runName, sourceRows, report["parameters"]["totalSeconds"], destination))
+
+    spark = SparkSession.builder.appName("BenchmarkExportTaxiData").getOrCreate()
+    for runName, sourceRows, seconds, destination in results:
+        filesByMonth = SummarizeExport(spark, GetTablePath(destination))
+        fileBytes = [size for sizes in filesByMonth.values() for size in sizes]
+        print("BenchmarkExportTaxiData: {:40s} seconds: {:8.1f}  rows: {:11d}  rows/sec: {:9.0f}  files: {:7d}  files per month: {:7.0f}  "
+              "bytes per file: mean {:10.0f} median {:10.0f}".format(
+                  runName, seconds, sourceRows, sourceRows / seconds, len(fileBytes), len(fileBytes) / float(max(1, len(filesByMonth))),
+                  statistics.mean(fileBytes) if fileBytes else 0, statistics.median(fileBytes) if fileBytes else 0))
+        for monthName in sorted(filesByMonth):
+            print("BenchmarkExportTaxiData: {:40s}   {} files: {:6d}  bytes per file: {:10.0f}".format(
+                runName, monthName, len(filesByMonth[monthName]), statistics.mean(filesByMonth[monthName])))
+    spark.stop()
+
+
+# python benchmark_export_taxi_data.py /tmp/convert-benchmark/derive-sequential /tmp/export-benchmark
+# python benchmark_export_taxi_data.py /tmp/convert-benchmark/derive-sequential /tmp/export-benchmark --scales 1,4 --granularities minute,hour,adaptive --max-concurrent-exports 1,4
+# python benchmark_export_taxi_data.py /tmp/convert-benchmark/derive-sequential /tmp/export-benchmark --granularities minute --write-modes direct,shuffle --max-file-size-mb 64
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="benchmark_export_taxi_data")
+    parser.add_argument("tripsTablesDir", help="Destination of ConvertTaxiData: <color>/trips_table/parquet/year=/month=")
+    parser.add_argument("workDir", help="Where taxi_trips and the output and the metrics report of each run are written")
+    parser.add_argument("--scales", type=lambda value: [float(scale) for scale in value.split(",")], default=[1.0],
+                        help="Comma separated sizes of taxi_trips compared to the trips tables (default: 1)")
+    parser.add_argument("--read-modes", dest="readModes", type=lambda value: value.split(","), default=["query"],
+                        help="Comma separated read modes of ExportTaxiData, one run each: " + ",".join(READ_MODES) + " (default: query)")
+    parser.add_argument("--granularities", type=lambda value: value.split(","), default=["minute", "adaptive"],
+                        help="Comma separated partition granularities, one run each: " + ",".join(GRANULARITY_MODES) + " (default: minute,adaptive)")
+    parser.add_argument("--write-modes", dest="writeModes", type=lambda value: value.split(","), default=["direct", "shuffle"],
+                        help="Comma separated write modes, one run each: " + ",".join(WRITE_MODES) + " (default: direct,shuffle)")
+    parser.add_argument("--max-concurrent-exports", dest="concurrencies", type=lambda value: [int(concurrency) for concurrency in value.split(",")],
+                        default=[1], help="Comma separated months exported at the same time, one run each (default: 1)")
+    parser.add_argument("--min-file-size-mb", dest="minFileSizeMB", type=float, default=DEFAULT_MIN_FILE_SIZE_MB)
+    parser.add_argument("--max-file-size-mb", dest="maxFileSizeMB", type=float, default=DEFAULT_MAX_FILE_SIZE_MB)
+    args = parser.parse_args()
+
+    BenchmarkExportTaxiData(args.tripsTablesDir, args.workDir, args.scales, args.readModes, args.granularities, args.writeModes,
+                            args.concurrencies, args.minFileSizeMB, args.maxFileSizeMB)
@@ -0,0 +1,127 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Writes the yellow trips table with each Parquet writer profile (parquet_writer_profiles.py) and prints
+#          the compressed size of every column (from the Parquet footers) plus the time and bytes read by
+#          point lookups on the ID columns, to pick the cheapest profile for storage and scan cost.
+#          Requires pyarrow (footer reads) and the Spark UI (input bytes, see spark_job_metrics.py).
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pyarrow.fs
+import pyarrow.parquet
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import expr
+from convert_taxi_to_parquet import ReadYellowTaxiData, WriteTripsTableParquet
+from parquet_layout import LAYOUTS, ConfigureParquetLayout, GetParquetLayout
+from parquet_writer_profiles import PROFILES
+from spark_job_metrics import GetInputBytesForJobGroup
+
+# Filters like the ones of sp_demo_bigquery_queries.sql, PULocationID = 1 (EWR) is a rare zone
+POINT_LOOKUPS = {
+    "common pickup zone": "PULocationID = 132",
+    "rare pickup zone":   "PULocationID = 1",
+    "dropoff zone":       "DOLocationID = 236",
+    "vendor":             "Vendor_Id = 2",
+    "payment type":       "Payment_Type_Id = 3"
+}
+
+
+def GetCompressedBytesByColumn(tablePath):
+    """Returns { column: compressed bytes } summed over all the row groups of the files under a path"""
+    fs, basePath = pyarrow.fs.FileSystem.from_uri(tablePath)
+    columnBytes = {}
+    for fileInfo in fs.get_file_info(pyarrow.fs.FileSelector(basePath, recursive=True)):
+        if fileInfo.type != pyarrow.fs.FileType.File or not fileInfo.base_name.endswith(".parquet"):
+            continue
+        with fs.open_input_file(fileInfo.path) as inputFile:
+            metadata = pyarrow.parquet.ParquetFile(inputFile).metadata
+        for rowGroupIndex in range(metadata.num_row_groups):
+            rowGroup = metadata.row_group(rowGroupIndex)
+            for columnIndex in range(rowGroup.num_columns):
+                columnChunk = rowGroup.column(columnIndex)
+                columnBytes[columnChunk.path_in_schema] = \
+                    columnBytes.get(columnChunk.path_in_schema, 0) + columnChunk.total_compressed_size
+    return columnBytes
+
+
+def TimePointLookup(spark, tablePath, condition, jobGroup, iterations):
+    """Returns the fastest time of a filtered count and the bytes read by all the iterations / iterations"""
+    timings = []
+    spark.sparkContext.setJobGroup(jobGroup, "Point lookup " + condition)
+    for iteration in range(iterations):
+        startTime = time.time()
+        spark.read.parquet(tablePath).filter(expr(condition)).count()
+        timings.append(time.time() - startTime)
+    spark.sparkContext.setLocalProperty("spark.jobGroup.id", None)
+
+    inputBytes = GetInputBytesForJobGroup(spark, jobGroup)
+    return min(timings), None if inputBytes is None else inputBytes // iterations
+
+
+def BenchmarkParquetWriterProfiles(sourceYellow, workDir, layout, iterations):
+    spark = SparkSession \
+        .builder \
+        .appName("BenchmarkParquetWriterProfiles") \
+        .getOrCreate()
+
+    parquetLayout = GetParquetLayout(layout)
+    ConfigureParquetLayout(spark, parquetLayout)
+    df_with_partition_cols = ReadYellowTaxiData(spark, sourceYellow)
+
+    columnBytesByProfile = {}
+    for profileName in PROFILES:
+        tablePath = workDir.rstrip("/") + "/" + profileName
+        startTime = time.time()
+        WriteTripsTableParquet(spark, df_with_partition_cols, tablePath, None, parquetLayout, profileName)
+        print("BenchmarkParquetWriterProfiles: {:12s} write seconds: {:7.2f}".format(profileName, time.time() - startTime))
+        columnBytesByProfile[profileName] = GetCompressedBytesByColumn(tablePath + "/parquet")
+
+    # Compressed bytes of each column (rows) for each profile (columns)
+    profileNames = list(PROFILES)
+    print("BenchmarkParquetWriterProfiles: {:24s}".format("column") + "".join("{:>14s}".format(profileName) for profileName in profileNames))
+    for columnName in columnBytesByProfile[profileNames[0]]:
+        print("BenchmarkParquetWriterProfiles: {:24s}".format(columnName) +
+              "".join("{:14d}".format(columnBytesByProfile[profileName].get(columnName, 0)) for profileName in profileNames))
+    print("BenchmarkParquetWriterProfiles: {:24s}".format("total") +
+          "".join("{:14d}".format(sum(columnBytesByProfile[profileName].values())) for profileName in profileNames))
+
+    for lookupName, condition in POINT_LOOKUPS.items():
+        for profileName in profileNames:
+            tablePath = workDir.rstrip("/") + "/" + profileName + "/parquet"
+            seconds, inputBytes = TimePointLookup(spark, tablePath, condition, profileName + "-" + lookupName, iterations)
+            print("BenchmarkParquetWriterProfiles: {:20s} {:12s} seconds: {:7.2f}  bytes read: {}".format(
+                lookupName, profileName, seconds, inputBytes))
+
+    spark.stop()
+
+
+# python benchmark_parquet_writer_profiles.py "gs://${rawBucket}/raw/taxi-data/yellow/2021/*.parquet" /tmp/parquet-writer-profiles --layout sort
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="benchmark_parquet_writer_profiles")
+    parser.add_argument("sourceYellow")
+    parser.add_argument("workDir", help="Where the trips table is written with each profile")
+    parser.add_argument("--layout", choices=LAYOUTS, default="none",
+                        help="Row order of the files (see parquet_layout.py), bloom filters and page indexes skip more with a layout")
+    parser.add_argument("--iterations", type=int, default=3)
+    args = parser.parse_args()
+
+    BenchmarkParquetWriterProfiles(args.sourceYellow, args.workDir, args.layout, args.iterations)
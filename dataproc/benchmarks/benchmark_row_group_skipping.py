@@ -0,0 +1,130 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Writes the yellow trips table with each Parquet layout (parquet_layout.py) and counts, from the
+#          Parquet footers, the row groups a reader can skip with min/max statistics for typical filters.
+#          Only the row groups of one year/month are counted (partition pruning is the same for every layout).
+#          Requires pyarrow (footer reads).
+
+import argparse
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pyarrow.fs
+import pyarrow.parquet
+from pyspark.sql import SparkSession
+from convert_taxi_to_parquet import ReadYellowTaxiData, WriteTripsTableParquet
+from parquet_layout import LAYOUTS, GetParquetLayout
+
+
+def GetFilters(filterYear, filterMonth):
+    """Returns { filter name: { column: (low, high) } } with inclusive bounds"""
+    day = datetime.datetime(filterYear, filterMonth, 15)
+    return {
+        "1 hour of pickups":       {"Pickup_DateTime": (day.replace(hour=8), day.replace(hour=8, minute=59, second=59))},
+        "pickup zone":             {"PULocationID": (132, 132)},
+        "dropoff zone":            {"DOLocationID": (236, 236)},
+        "pickup and dropoff zone": {"PULocationID": (132, 132), "DOLocationID": (236, 236)},
+        "pickup zone and day":     {"PULocationID": (132, 132),
+                                    "Pickup_DateTime": (day, day.replace(hour=23, minute=59, second=59))}
+    }
+
+
+def NormalizeStatistic(value):
+    # Timestamps written as TIMESTAMP_MICROS are UTC adjusted, the session time zone is UTC
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def ReadRowGroupStatistics(partitionPath):
+    """Returns [(row count, { column: (min, max) })] for every row group of the files under a path"""
+    fs, basePath = pyarrow.fs.FileSystem.from_uri(partitionPath)
+    rowGroups = []
+    for fileInfo in fs.get_file_info(pyarrow.fs.FileSelector(basePath, recursive=True)):
+        if fileInfo.type != pyarrow.fs.FileType.File or not fileInfo.base_name.endswith(".parquet"):
+            continue
+        with fs.open_input_file(fileInfo.path) as inputFile:
+            metadata = pyarrow.parquet.ParquetFile(inputFile).metadata
+        for rowGroupIndex in range(metadata.num_row_groups):
+            rowGroup = metadata.row_group(rowGroupIndex)
+            columnStatistics = {}
+            for columnIndex in range(rowGroup.num_columns):
+                columnChunk = rowGroup.column(columnIndex)
+                statistics = columnChunk.statistics
+                if statistics is not None and statistics.has_min_max:
+                    columnStatistics[columnChunk.path_in_schema] = (NormalizeStatistic(statistics.min),
+                                                                    NormalizeStatistic(statistics.max))
+            rowGroups.append((rowGroup.num_rows, columnStatistics))
+    return rowGroups
+
+
+def CanSkipRowGroup(columnStatistics, rowGroupFilter):
+    for column, (low, high) in rowGroupFilter.items():
+        if column not in columnStatistics:
+            continue
+        minValue, maxValue = columnStatistics[column]
+        if maxValue < low or minValue > high:
+            return True
+    return False
+
+
+def BenchmarkRowGroupSkipping(sourceYellow, workDir, rowGroupSizeMB, filterYear, filterMonth):
+    spark = SparkSession \
+        .builder \
+        .appName("BenchmarkRowGroupSkipping") \
+        .config("spark.sql.session.timeZone", "UTC") \
+        .getOrCreate()
+
+    # Same timestamp type for every layout, INT96 (the Spark default) has no statistics
+    spark.conf.set("spark.sql.parquet.outputTimestampType", "TIMESTAMP_MICROS")
+
+    filters = GetFilters(filterYear, filterMonth)
+    df_with_partition_cols = ReadYellowTaxiData(spark, sourceYellow)
+
+    for layout in LAYOUTS:
+        tablePath = workDir.rstrip("/") + "/" + layout
+        WriteTripsTableParquet(spark, df_with_partition_cols, tablePath, None,
+                               GetParquetLayout(layout, None, rowGroupSizeMB))
+
+        rowGroups = ReadRowGroupStatistics(tablePath + "/parquet/year=" + str(filterYear) + "/month=" + str(filterMonth))
+        totalRows = sum(rowCount for rowCount, columnStatistics in rowGroups)
+        print("BenchmarkRowGroupSkipping: {:7s} row groups: {}  rows: {}".format(layout, len(rowGroups), totalRows))
+
+        for filterName, rowGroupFilter in filters.items():
+            skipped = [rowCount for rowCount, columnStatistics in rowGroups if CanSkipRowGroup(columnStatistics, rowGroupFilter)]
+            print("BenchmarkRowGroupSkipping: {:7s} {:24s} row groups skipped: {:5d} of {:5d} ({:5.1f}%)  rows skipped: {:5.1f}%".format(
+                layout, filterName, len(skipped), len(rowGroups),
+                100.0 * len(skipped) / max(1, len(rowGroups)), 100.0 * sum(skipped) / max(1, totalRows)))
+
+    spark.stop()
+
+
+# python benchmark_row_group_skipping.py "gs://${rawBucket}/raw/taxi-data/yellow/2021/*.parquet" /tmp/row-group-skipping --row-group-size-mb 4
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="benchmark_row_group_skipping")
+    parser.add_argument("sourceYellow")
+    parser.add_argument("workDir", help="Where the trips table is written with each layout")
+    parser.add_argument("--row-group-size-mb", dest="rowGroupSizeMB", type=float, default=4,
+                        help="Row group size, use a small size for small local data sets (default: 4)")
+    parser.add_argument("--year", dest="filterYear", type=int, default=2021)
+    parser.add_argument("--month", dest="filterMonth", type=int, default=1)
+    args = parser.parse_args()
+
+    BenchmarkRowGroupSkipping(args.sourceYellow, args.workDir, args.rowGroupSizeMB, args.filterYear, args.filterMonth)
@@ -0,0 +1,110 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Compares the row group stitching of compact_parquet_files.py --mode binpack --stitch
+#          (parquet_row_group_stitcher.py) with a Spark rewrite of the same groups of files.
+#          Both are measured the same way, one group after the other with nothing else running: the wall time
+#          and the CPU time of the JVM and Python processes.  Spark runs in local mode, so the executors that
+#          rewrite the groups run in the same JVM as the stitching (driver) and the CPU of both is counted.
+#          The groups are the ones of the binpack plan that can be stitched (same schema, row groups of at least
+#          --min-row-group-size-mb).  Nothing is written to the table, the output goes to workDir.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pyspark.sql import SparkSession
+from compact_parquet_files import RewriteGroup
+from compaction_planner import ListTableFiles, PlanCompaction, DEFAULT_TARGET_FILE_SIZE_MB
+from hadoop_fs_utils import DeletePath
+from parquet_row_group_stitcher import CanStitch, StitchParquetFiles, DEFAULT_MIN_STITCH_ROW_GROUP_MB
+
+METHODS = ["stitch", "rewrite"]
+
+
+def GetProcessCpuSeconds(spark):
+    """CPU time of the JVM process (driver and, in local mode, the executors) and of this Python process (py4j calls)"""
+    totalCpuDuration = spark.sparkContext._jvm.java.lang.ProcessHandle.current().info().totalCpuDuration()
+    return totalCpuDuration.get().toNanos() / 1000000000.0 + time.process_time()
+
+
+def CompactGroups(spark, groups, method, outputRoot):
+    """Stitches or rewrites each group into one file, one group at a time, returns (wall seconds, CPU seconds)"""
+    startTime = time.time()
+    startCpuSeconds = GetProcessCpuSeconds(spark)
+    for index, group in enumerate(groups):
+        stagingPath = outputRoot + "/group-" + str(index)
+        if method == "stitch":
+            StitchParquetFiles(spark, [path for path, fileBytes in group["files"]], stagingPath)
+        else:
+            RewriteGroup(spark, group, stagingPath, "benchmark-")
+    return time.time() - startTime, GetProcessCpuSeconds(spark) - startCpuSeconds
+
+
+def BenchmarkRowGroupStitching(source, workDir, targetFileSizeMB, minRowGroupSizeMB, iterations):
+    spark = SparkSession \
+        .builder \
+        .master("local[*]") \
+        .appName("BenchmarkRowGroupStitching") \
+        .getOrCreate()
+
+    tableRoot, filesByFolder = ListTableFiles(spark, source)
+    groups, keptFiles = PlanCompaction(filesByFolder, targetFileSizeMB * 1024 * 1024)
+    groups = [group for group in groups
+              if CanStitch(spark, [path for path, fileBytes in group["files"]], minRowGroupSizeMB * 1024 * 1024)[0]]
+    if len(groups) == 0:
+        print("BenchmarkRowGroupStitching: no group of the compaction plan can be stitched (try a lower --min-row-group-size-mb)")
+        spark.stop()
+        return
+    groupBytes = sum(group["bytes"] for group in groups)
+    print("BenchmarkRowGroupStitching: {} groups, {} files, {} bytes".format(
+        len(groups), sum(len(group["files"]) for group in groups), groupBytes))
+
+    timings = {method: [] for method in METHODS}
+    for iteration in range(iterations):
+        # Alternate the order so neither method always runs on a warm JVM / object store cache
+        for method in METHODS if iteration % 2 == 0 else list(reversed(METHODS)):
+            outputRoot = workDir.rstrip("/") + "/" + method + "-" + str(iteration)
+            timings[method].append(CompactGroups(spark, groups, method, outputRoot))
+            DeletePath(spark, outputRoot)
+
+    for method in METHODS:
+        wallSeconds = min(seconds for seconds, cpuSeconds in timings[method])
+        cpuSeconds = min(cpuSeconds for seconds, cpuSeconds in timings[method])
+        print("BenchmarkRowGroupStitching: {:8s} wall seconds: {:8.2f}  CPU seconds: {:8.2f}  MB/s: {:8.1f}".format(
+            method, wallSeconds, cpuSeconds, groupBytes / 1024.0 / 1024 / max(wallSeconds, 0.001)))
+    stitchCpuSeconds = min(cpuSeconds for seconds, cpuSeconds in timings["stitch"])
+    rewriteCpuSeconds = min(cpuSeconds for seconds, cpuSeconds in timings["rewrite"])
+    print("BenchmarkRowGroupStitching: CPU seconds saved by stitching: {:.2f} ({:.1f}x less)".format(
+        rewriteCpuSeconds - stitchCpuSeconds, rewriteCpuSeconds / max(stitchCpuSeconds, 0.001)))
+
+    spark.stop()
+
+
+# python benchmark_row_group_stitching.py gs://${processedBucket}/processed/taxi-data/green/trips_table/parquet /tmp/stitching
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="benchmark_row_group_stitching")
+    parser.add_argument("source", help="Folder of the Parquet table (the table is only read)")
+    parser.add_argument("workDir", help="Folder of the stitched and rewritten files, deleted after each method")
+    parser.add_argument("--target-file-size-mb", dest="targetFileSizeMB", type=int, default=DEFAULT_TARGET_FILE_SIZE_MB)
+    parser.add_argument("--min-row-group-size-mb", dest="minRowGroupSizeMB", type=float, default=DEFAULT_MIN_STITCH_ROW_GROUP_MB)
+    parser.add_argument("--iterations", type=int, default=3)
+    args = parser.parse_args()
+
+    BenchmarkRowGroupStitching(args.source, args.workDir, args.targetFileSizeMB, args.minRowGroupSizeMB, args.iterations)
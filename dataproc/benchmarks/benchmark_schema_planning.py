@@ -0,0 +1,69 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Compares the job planning time of ConvertTaxiData with the declared raw schemas
+#          (taxi_schema_registry.py) against Spark schema inference.
+#          Planning = listing the files + getting the schema + building the physical plan, no data is read.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pyspark.sql import SparkSession
+from convert_taxi_to_parquet import ReadYellowTaxiData, ReadGreenTaxiData, SCHEMA_MODES
+
+
+def TimePlanning(spark, readTaxiData, source, schemaMode):
+    startTime = time.time()
+    df_with_partition_cols = readTaxiData(spark, source, schemaMode)
+    df_with_partition_cols._jdf.queryExecution().executedPlan()
+    return time.time() - startTime
+
+
+def BenchmarkSchemaPlanning(sourceYellow, sourceGreen, iterations):
+    spark = SparkSession \
+        .builder \
+        .appName("BenchmarkSchemaPlanning") \
+        .getOrCreate()
+
+    for color, source, readTaxiData in [("yellow", sourceYellow, ReadYellowTaxiData),
+                                        ("green",  sourceGreen,  ReadGreenTaxiData)]:
+        timings = {schemaMode: [] for schemaMode in SCHEMA_MODES}
+        for iteration in range(iterations):
+            # Alternate the order so neither mode always runs on a warm JVM / object store cache
+            schemaModes = SCHEMA_MODES if iteration % 2 == 0 else list(reversed(SCHEMA_MODES))
+            for schemaMode in schemaModes:
+                timings[schemaMode].append(TimePlanning(spark, readTaxiData, source, schemaMode))
+
+        for schemaMode in SCHEMA_MODES:
+            print("BenchmarkSchemaPlanning: {:6s} {:8s} planning seconds  min: {:7.2f}  avg: {:7.2f}".format(
+                color, schemaMode, min(timings[schemaMode]), sum(timings[schemaMode]) / iterations))
+
+    spark.stop()
+
+
+# python benchmark_schema_planning.py "gs://${rawBucket}/raw/taxi-data/yellow/*/*.parquet" "gs://${rawBucket}/raw/taxi-data/green/*/*.parquet"
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="benchmark_schema_planning")
+    parser.add_argument("sourceYellow")
+    parser.add_argument("sourceGreen")
+    parser.add_argument("--iterations", type=int, default=3)
+    args = parser.parse_args()
+
+    BenchmarkSchemaPlanning(args.sourceYellow, args.sourceGreen, args.iterations)
@@ -0,0 +1,267 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Generates raw yellow/green taxi files that look like the TLC downloads, at any scale (1M to 500M+ rows),
+#          so ConvertTaxiData can be benchmarked without downloading the real data:
+#            <destination>/<color>/<year>/<color>_tripdata_<year>-<month>.parquet    (one file per month)
+#          The columns, their order and their types are the declared raw schemas of taxi_schema_registry.py, including
+#          the quirks of the real files: airport_fee is an INT column (all nulls) in the 2019 yellow files, a few
+#          percent of the 2020+ trips have no passenger_count/RatecodeID (payment_type 0), and some trips of a file
+#          were picked up before its month.  The values follow the shape of the real data: trips by month
+#          (the 2020 drop), by hour of the day, skewed pickup/dropoff zones, log-normal distances and fares,
+#          durations and totals consistent with the distances and fares.
+#          Each month is generated by one task (no shuffle), the months run in parallel.  Same seed, same files.
+
+import argparse
+import calendar
+import datetime
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import col, expr, lit, when, rand, randn, floor, least, greatest, round as round_
+from hadoop_fs_utils import DeletePath, GetFileSystem, GetPathSizeBytes, RenamePath
+from taxi_schema_registry import GetRawSchema, TRIPS_TABLE_YEARS
+
+# Trips of each month relative to a 2019 month (yellow): the 2020 drop and the slow recovery
+MONTH_WEIGHTS = {
+    2019: [1.00, 0.99, 1.11, 1.00, 1.03, 0.92, 0.83, 0.80, 0.87, 0.98, 0.92, 0.92],
+    2020: [0.85, 0.84, 0.40, 0.03, 0.05, 0.07, 0.11, 0.13, 0.17, 0.20, 0.19, 0.19],
+    2021: [0.18, 0.18, 0.26, 0.28, 0.32, 0.35, 0.37, 0.36, 0.37, 0.45, 0.45, 0.44],
+    2022: [0.33, 0.40, 0.48, 0.48, 0.50, 0.49, 0.43, 0.43, 0.46, 0.53, 0.49, 0.50]
+}
+DEFAULT_MONTH_WEIGHT = 0.5
+
+# Share of the trips picked up in each hour of the day (rush hours, quiet nights)
+HOUR_WEIGHTS = [3.0, 2.2, 1.6, 1.1, 0.9, 1.0, 2.0, 3.4, 4.2, 4.3, 4.3, 4.5,
+                4.7, 4.8, 5.0, 5.1, 5.0, 5.7, 6.4, 6.3, 5.6, 5.3, 5.0, 4.2]
+
+# Zones with most of the pickups and dropoffs (Midtown / Upper East Side / airports for yellow, outer boroughs for green)
+HOT_ZONES = {
+    "yellow": [237, 161, 236, 162, 186, 230, 142, 48, 170, 234, 132, 138, 163, 68, 79, 107, 239, 141, 140, 263],
+    "green":  [74, 75, 41, 7, 82, 166, 42, 97, 95, 244, 129, 65, 260, 116, 181]
+}
+HOT_ZONE_SHARE = 0.6
+ZONE_COUNT = 265
+AIRPORT_ZONES = [132, 138]
+
+# (value, weight) of the categorical columns
+VENDOR_IDS = {
+    "yellow": [(1, 0.35), (2, 0.65)],
+    "green":  [(1, 0.15), (2, 0.85)]
+}
+PASSENGER_COUNTS = [(1, 0.71), (2, 0.14), (3, 0.04), (4, 0.02), (5, 0.05), (6, 0.03), (0, 0.01)]
+RATE_CODE_IDS = [(1, 0.968), (2, 0.018), (5, 0.007), (3, 0.003), (4, 0.002), (6, 0.0002), (99, 0.0018)]
+PAYMENT_TYPES = [(1, 0.72), (2, 0.26), (3, 0.01), (4, 0.01)]
+TRIP_TYPES = [(1, 0.97), (2, 0.03)]
+
+# Share of the rows in the green files (about the share of the real data)
+DEFAULT_GREEN_SHARE = 0.06
+DEFAULT_SEED = 42
+
+# 2020+: trips sent without the passenger/rate code fields (payment_type 0, nulls)
+MISSING_FIELDS_SHARE = 0.03
+# Trips of a file picked up before the month of the file
+PREVIOUS_MONTH_SHARE = 0.0005
+
+# One seed per random column, offsets of the seed of the run (the seed of a month is the run seed + year * 100 + month)
+RANDOM_COLUMNS = ["day", "hour", "second", "distance", "speed", "vendor", "passengers", "rateCode", "payment",
+                  "pickupHot", "pickupZone", "dropoffHot", "dropoffZone", "tip", "tolls", "congestion",
+                  "storeAndForward", "missing", "previousMonth", "tripType"]
+
+
+def GetMonthWeight(dataYear, dataMonth):
+    return MONTH_WEIGHTS.get(dataYear, [DEFAULT_MONTH_WEIGHT] * 12)[dataMonth - 1]
+
+
+def GetRowsByMonth(rows, years):
+    """Splits the rows of a color over the months of the years by MONTH_WEIGHTS: { (year, month): rows }"""
+    months = [(dataYear, dataMonth) for dataYear in years for dataMonth in range(1, 13)]
+    totalWeight = sum(GetMonthWeight(dataYear, dataMonth) for dataYear, dataMonth in months)
+    rowsByMonth = {}
+    for dataYear, dataMonth in months:
+        rowsByMonth[(dataYear, dataMonth)] = max(1, int(rows * GetMonthWeight(dataYear, dataMonth) / totalWeight))
+    return rowsByMonth
+
+
+def WeightedChoice(randomColumn, choices):
+    """CASE expression that picks a value with the given weights from a uniform [0, 1) column"""
+    totalWeight = float(sum(weight for value, weight in choices))
+    choice = None
+    threshold = 0.0
+    for value, weight in choices[:-1]:
+        threshold += weight / totalWeight
+        choice = when(randomColumn < threshold, lit(value)) if choice is None else choice.when(randomColumn < threshold, lit(value))
+    return lit(choices[-1][0]) if choice is None else choice.otherwise(lit(choices[-1][0]))
+
+
+def Zone(color, hotColumn, zoneColumn):
+    """A hot zone for HOT_ZONE_SHARE of the trips, any zone otherwise"""
+    hotZones = HOT_ZONES[color]
+    hotZone = expr("element_at(array({0}), cast({1} * {2} as int) + 1)".format(
+        ", ".join(str(zone) for zone in hotZones), zoneColumn, len(hotZones)))
+    return when(col(hotColumn) < HOT_ZONE_SHARE, hotZone).otherwise(floor(col(zoneColumn) * ZONE_COUNT) + 1)
+
+
+def GenerateMonth(spark, color, dataYear, dataMonth, rows, seed):
+    """DataFrame of the trips of one month with the raw schema of the year (one partition)"""
+    monthSeed = seed + dataYear * 100 + dataMonth
+    df = spark.range(0, rows, 1, 1)
+    for index, randomColumn in enumerate(RANDOM_COLUMNS):
+        df = df.withColumn(randomColumn, rand(monthSeed * 100 + index))
+    df = df.withColumn("distanceNormal", randn(monthSeed * 100 + len(RANDOM_COLUMNS)))
+
+    monthStart = datetime.datetime(dataYear, dataMonth, 1)
+    monthDays = ((monthStart + datetime.timedelta(days=32)).replace(day=1) - monthStart).days
+    hourChoices = list(enumerate(HOUR_WEIGHTS))
+    isJFK = col("rate_code") == 2
+    hasMissingFields = (col("missing") < MISSING_FIELDS_SHARE) if dataYear >= 2020 else lit(False)
+
+    df = df \
+        .withColumn("pickup_hour", WeightedChoice(col("hour"), hourChoices)) \
+        .withColumn("pickup_seconds", floor(col("day") * monthDays) * 86400 + col("pickup_hour") * 3600 + floor(col("second") * 3600)) \
+        .withColumn("pickup_seconds", when(col("previousMonth") < PREVIOUS_MONTH_SHARE, col("pickup_seconds") - monthDays * 86400)
+                                      .otherwise(col("pickup_seconds"))) \
+        .withColumn("pickup", expr("timestamp_seconds({0} + pickup_seconds)".format(calendar.timegm(monthStart.timetuple())))) \
+        .withColumn("rate_code", WeightedChoice(col("rateCode"), RATE_CODE_IDS)) \
+        .withColumn("distance", when(isJFK, 17.0 + 3.0 * col("distanceNormal"))
+                                .otherwise(expr("exp(0.55 + 0.85 * distanceNormal)"))) \
+        .withColumn("distance", round_(least(greatest(col("distance"), lit(0.0)), lit(80.0)), 2)) \
+        .withColumn("duration_seconds", floor(col("distance") / (6.0 + 12.0 * col("speed")) * 3600) + 60) \
+        .withColumn("fare", when(isJFK, lit(52.0))
+                            .otherwise(round_(2.5 + 2.5 * col("distance") + 0.5 * col("duration_seconds") / 60.0, 1))) \
+        .withColumn("extra", when(col("pickup_hour").between(16, 19), lit(1.0))
+                             .when((col("pickup_hour") >= 20) | (col("pickup_hour") < 6), lit(0.5))
+                             .otherwise(lit(0.0))) \
+        .withColumn("payment_type_id", WeightedChoice(col("payment"), PAYMENT_TYPES)) \
+        .withColumn("tip", when(col("payment_type_id") == 1, round_(col("fare") * (0.1 + 0.2 * col("tip")), 2)).otherwise(lit(0.0))) \
+        .withColumn("tolls", when(col("tolls") < 0.05, lit(6.12)).otherwise(lit(0.0))) \
+        .withColumn("PU", Zone(color, "pickupHot", "pickupZone")) \
+        .withColumn("DO", Zone(color, "dropoffHot", "dropoffZone")) \
+        .withColumn("congestion", when(col("congestion") < (0.92 if color == "yellow" else 0.1), lit(2.5)).otherwise(lit(0.0))) \
+        .withColumn("airport", when(col("PU").isin(AIRPORT_ZONES), lit(1.25)).otherwise(lit(0.0)) if dataYear >= 2021 else lit(None))
+
+    total = col("fare") + col("extra") + 0.5 + col("tip") + col("tolls") + 0.3 + col("congestion") + \
+        (col("airport") if dataYear >= 2021 else lit(0.0))
+    pickupPrefix = "tpep" if color == "yellow" else "lpep"
+
+    # Raw column: value (missing fields: null passenger/rate code/flag/surcharges and payment_type 0, like the TLC files)
+    values = {
+        "VendorID":               WeightedChoice(col("vendor"), VENDOR_IDS[color]),
+        pickupPrefix + "_pickup_datetime":  col("pickup"),
+        pickupPrefix + "_dropoff_datetime": expr("timestamp_seconds({0} + pickup_seconds + duration_seconds)".format(calendar.timegm(monthStart.timetuple()))),
+        "passenger_count":        when(~hasMissingFields, WeightedChoice(col("passengers"), PASSENGER_COUNTS)),
+        "trip_distance":          col("distance"),
+        "RatecodeID":             when(~hasMissingFields, col("rate_code")),
+        "store_and_fwd_flag":     when(~hasMissingFields, when(col("storeAndForward") < 0.005, lit("Y")).otherwise(lit("N"))),
+        "PULocationID":           col("PU"),
+        "DOLocationID":           col("DO"),
+        "payment_type":           when(hasMissingFields, lit(0)).otherwise(col("payment_type_id")),
+        "fare_amount":            col("fare"),
+        "extra":                  col("extra"),
+        "mta_tax":                lit(0.5),
+        "tip_amount":             col("tip"),
+        "tolls_amount":           col("tolls"),
+        "ehail_fee":              lit(None),
+        "improvement_surcharge":  lit(0.3),
+        "total_amount":           round_(total, 2),
+        "congestion_surcharge":   when(~hasMissingFields, col("congestion")),
+        # 2019 yellow: INT column of nulls (GetRawSchema), 2020: no airport fee yet
+        "airport_fee":            when(~hasMissingFields, col("airport")),
+        "trip_type":              WeightedChoice(col("tripType"), TRIP_TYPES)
+    }
+    rawSchema = GetRawSchema(color, dataYear)
+    return df.select(*[values[field.name].cast(field.dataType).alias(field.name) for field in rawSchema.fields])
+
+
+def WriteMonthFile(spark, df_month, destination, color, dataYear, dataMonth):
+    """Writes the month as one Parquet file named like the TLC download"""
+    fileName = "{0}_tripdata_{1}-{2:02d}.parquet".format(color, dataYear, dataMonth)
+    tempPath = destination + "/_generate/" + fileName
+    filePath = destination + "/" + color + "/" + str(dataYear) + "/" + fileName
+
+    spark.sparkContext.setJobGroup("generate-" + fileName, "generate-" + fileName)
+    df_month.write.mode("overwrite").parquet(tempPath)
+    spark.sparkContext.setLocalProperty("spark.jobGroup.id", None)
+
+    fs, hadoopPath = GetFileSystem(spark, tempPath + "/part-*.parquet")
+    partFiles = [status.getPath().toString() for status in (fs.globStatus(hadoopPath) or [])]
+    if len(partFiles) != 1:
+        raise RuntimeError("WriteMonthFile: expected one part file in " + tempPath + ", found " + str(len(partFiles)))
+    DeletePath(spark, filePath)
+    RenamePath(spark, partFiles[0], filePath)
+    DeletePath(spark, tempPath)
+    return filePath
+
+
+def GenerateSyntheticTaxiData(destination, rows, years, greenShare, seed, parallelMonths):
+    spark = SparkSession \
+        .builder \
+        .appName("GenerateSyntheticTaxiData") \
+        .config("spark.sql.parquet.outputTimestampType", "TIMESTAMP_MICROS") \
+        .getOrCreate()
+
+    # The TLC timestamps are New York times stored without a time zone: generate them in UTC so they are written as is
+    spark.conf.set("spark.sql.session.timeZone", "UTC")
+    destination = destination.rstrip("/")
+    if parallelMonths is None:
+        parallelMonths = spark.sparkContext.defaultParallelism
+
+    months = []
+    for color, colorRows in [("yellow", int(rows * (1 - greenShare))), ("green", int(rows * greenShare))]:
+        for (dataYear, dataMonth), monthRows in sorted(GetRowsByMonth(colorRows, years).items()):
+            months.append((color, dataYear, dataMonth, monthRows))
+
+    def GenerateMonthFile(month):
+        color, dataYear, dataMonth, monthRows = month
+        return WriteMonthFile(spark, GenerateMonth(spark, color, dataYear, dataMonth, monthRows, seed), destination, color, dataYear, dataMonth)
+
+    startTime = time.time()
+    # Largest months first, so a large month does not start last
+    with ThreadPoolExecutor(max_workers=parallelMonths) as executor:
+        filePaths = list(executor.map(GenerateMonthFile, sorted(months, key=lambda month: -month[3])))
+    DeletePath(spark, destination + "/_generate")
+
+    for color in ["yellow", "green"]:
+        colorRows = sum(month[3] for month in months if month[0] == color)
+        print("GenerateSyntheticTaxiData: {:6s} files: {:3d} rows: {:12d} bytes: {}".format(
+            color, len([month for month in months if month[0] == color]), colorRows,
+            GetPathSizeBytes(spark, destination + "/" + color + "/*/*.parquet")))
+    print("GenerateSyntheticTaxiData: {} files in {:.1f} seconds".format(len(filePaths), time.time() - startTime))
+
+    spark.stop()
+
+
+# python generate_synthetic_taxi_data.py /tmp/synthetic-taxi-data --rows 10000000
+# python generate_synthetic_taxi_data.py gs://${rawBucket}/synthetic/taxi-data --rows 500000000 --years 2019,2020,2021,2022
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="generate_synthetic_taxi_data")
+    parser.add_argument("destination", help="Folder of the <color>/<year>/<color>_tripdata_<year>-<month>.parquet files")
+    parser.add_argument("--rows", type=int, default=1000000, help="Rows of all the files, yellow and green (default: 1000000)")
+    parser.add_argument("--years", type=lambda value: [int(dataYear) for dataYear in value.split(",")], default=TRIPS_TABLE_YEARS,
+                        help="Comma separated years, 12 files per year and color (default: the years of the trips tables)")
+    parser.add_argument("--green-share", dest="greenShare", type=float, default=DEFAULT_GREEN_SHARE,
+                        help="Share of the rows in the green files (default: 0.06, about the share of the real data)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--parallel-months", dest="parallelMonths", type=int, default=None,
+                        help="Months generated at the same time, one task each (default: the default parallelism)")
+    args = parser.parse_args()
+
+    GenerateSyntheticTaxiData(args.destination, args.rows, args.years, args.greenShare, args.seed, args.parallelMonths)
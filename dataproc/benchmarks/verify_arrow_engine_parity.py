@@ -0,0 +1,158 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Converts the same raw files with the Spark engine and the Arrow engine (arrow_taxi_engine.py) and checks
+#          that every table has:
+#          - the same schema read by Spark (JSON of the Spark schema) and the same row counts per year/month
+#          - the same rows: Parquet rows compared as rows, CSV/JSON lines compared as text (formats of the
+#            timestamps and doubles included), in each year/month, as multisets (sorted, duplicates kept)
+#          - Parquet: the same physical schema in every file (physical, logical and converted types, repetition),
+#            read from the footers with pyarrow
+#          Both engines run in UTC (TZ of the JVM), the time zone of a Dataproc cluster.  Prints the wall time of each
+#          engine.  Exits with 1 when the outputs differ.  Requires pyarrow.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pyarrow.parquet
+
+from pyspark.sql import SparkSession
+from convert_taxi_to_parquet import ConvertTaxiData
+from arrow_taxi_engine import ConvertTaxiDataArrow, ListSourceFiles
+from taxi_schema_registry import LOOKUP_TABLES
+
+
+def ReadTable(spark, tablePath, outputFormat):
+    if outputFormat == "csv":
+        return spark.read.option("header", True).csv(tablePath)
+    return spark.read.format(outputFormat).load(tablePath)
+
+
+def GetRowCountsByPartition(df):
+    return {(row["year"], row["month"]): row["count"] for row in df.groupBy("year", "month").count().collect()}
+
+
+def ReadLines(spark, tablePath):
+    """The lines of the CSV/JSON files (with the year/month of their folder), without the CSV headers (every file
+       starts with the same header line)"""
+    df = spark.read.text(tablePath)
+    return df.filter(df["value"] != df.select("value").first()["value"]) if tablePath.endswith("csv") else df
+
+
+def GetParquetPhysicalSchemas(tablePath, partitioned):
+    """Returns the set of the physical schemas of the Parquet files: (column, physical type, logical type,
+       converted type, max definition level) of each column"""
+    fs, files = ListSourceFiles(tablePath.rstrip("/") + ("/*/*/*.parquet" if partitioned else "/*.parquet"))
+    schemas = set()
+    for path in files:
+        schema = pyarrow.parquet.read_metadata(path, filesystem=fs).schema
+        schemas.add(tuple((column.path, column.physical_type, str(column.logical_type), column.converted_type,
+                           column.max_definition_level) for column in (schema.column(index) for index in range(len(schema)))))
+    return schemas
+
+
+def CompareRows(df_spark, df_arrow, description):
+    """Same rows, not only the same counts (exceptAll keeps duplicates): a multiset, order independent comparison"""
+    sparkOnly = df_spark.exceptAll(df_arrow)
+    arrowOnly = df_arrow.exceptAll(df_spark)
+    if sparkOnly.count() == 0 and arrowOnly.count() == 0:
+        return []
+    return [description + " differ, e.g. spark: " + str(sparkOnly.limit(2).collect()) + " arrow: " + str(arrowOnly.limit(2).collect())]
+
+
+def CompareTable(spark, sparkPath, arrowPath, outputFormat, partitioned):
+    """Returns a list of differences (empty when the tables match)"""
+    df_spark = ReadTable(spark, sparkPath, outputFormat)
+    df_arrow = ReadTable(spark, arrowPath, outputFormat)
+    differences = []
+
+    if df_spark.schema.json() != df_arrow.schema.json():
+        differences.append("schema: spark " + df_spark.schema.simpleString() + " arrow " + df_arrow.schema.simpleString())
+    elif outputFormat == "parquet":
+        differences.extend(CompareRows(df_spark, df_arrow, "rows"))
+    if outputFormat == "parquet":
+        sparkSchemas = GetParquetPhysicalSchemas(sparkPath, partitioned)
+        arrowSchemas = GetParquetPhysicalSchemas(arrowPath, partitioned)
+        if sparkSchemas != arrowSchemas:
+            differences.append("parquet physical schemas: spark " + str(sorted(sparkSchemas)) + " arrow " + str(sorted(arrowSchemas)))
+    else:
+        # As text: the same values written in another format would compare equal once parsed
+        differences.extend(CompareRows(ReadLines(spark, sparkPath), ReadLines(spark, arrowPath), "lines"))
+
+    if partitioned:
+        sparkCounts = GetRowCountsByPartition(df_spark)
+        arrowCounts = GetRowCountsByPartition(df_arrow)
+        if sparkCounts != arrowCounts:
+            differences.append("row counts: spark " + str(sorted(sparkCounts.items())) + " arrow " + str(sorted(arrowCounts.items())))
+    elif df_spark.count() != df_arrow.count():
+        differences.append("row counts: spark " + str(df_spark.count()) + " arrow " + str(df_arrow.count()))
+
+    return differences
+
+
+def VerifyArrowEngineParity(sourceYellow, sourceGreen, workDir):
+    # Before the JVM starts: Spark writes the CSV/JSON timestamps in the session time zone, the Arrow engine in UTC
+    os.environ["TZ"] = "UTC"
+    sparkDestination = workDir.rstrip("/") + "/spark/"
+    arrowDestination = workDir.rstrip("/") + "/arrow/"
+
+    startTime = time.time()
+    ConvertTaxiData(sourceYellow, sourceGreen, sparkDestination, engine="spark")
+    sparkSeconds = time.time() - startTime
+
+    startTime = time.time()
+    ConvertTaxiDataArrow(sourceYellow, sourceGreen, arrowDestination)
+    arrowSeconds = time.time() - startTime
+
+    spark = SparkSession \
+        .builder \
+        .appName("VerifyArrowEngineParity") \
+        .getOrCreate()
+
+    tables = []
+    for color in ["yellow", "green"]:
+        for outputFormat in ["parquet", "csv", "json"]:
+            tables.append((color + "/trips_table/" + outputFormat, outputFormat, True))
+    for tableName in LOOKUP_TABLES:
+        tables.append((tableName, "parquet", False))
+
+    failures = 0
+    for tablePath, outputFormat, partitioned in tables:
+        differences = CompareTable(spark, sparkDestination + tablePath, arrowDestination + tablePath, outputFormat, partitioned)
+        print("VerifyArrowEngineParity: {:30s} {}".format(tablePath, "OK" if len(differences) == 0 else "DIFFERENT"))
+        for difference in differences:
+            print("VerifyArrowEngineParity:     " + difference)
+        failures += len(differences) > 0
+
+    print("VerifyArrowEngineParity: spark engine seconds: {:7.2f}  arrow engine seconds: {:7.2f}".format(sparkSeconds, arrowSeconds))
+    spark.stop()
+    return failures == 0
+
+
+# python verify_arrow_engine_parity.py "gs://${rawBucket}/raw/taxi-data/yellow/2021/yellow_tripdata_2021-01.parquet" "gs://${rawBucket}/raw/taxi-data/green/2021/green_tripdata_2021-01.parquet" /tmp/arrow-parity
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="verify_arrow_engine_parity")
+    parser.add_argument("sourceYellow")
+    parser.add_argument("sourceGreen")
+    parser.add_argument("workDir", help="Where the outputs of both engines are written")
+    args = parser.parse_args()
+
+    if not VerifyArrowEngineParity(args.sourceYellow, args.sourceGreen, args.workDir):
+        sys.exit(1)
@@ -16,51 +16,370 @@
 
 # Author:  Adam Paternostro
 # Summary: Compact parquet files to 10000 (upper BigQuery external table URI limit)
+#          --mode repartition (default): reads everything and writes numberOfPartitions files (a full shuffle,
+#            the year=/month= folders of a partitioned source are not kept).  numberOfPartitions auto: the input
+#            bytes / --target-file-size-mb, at most 10000, with a coalesce (no shuffle) when it only reduces the
+#            number of partitions read.
+#          --mode binpack: keeps the folders of the table and only rewrites the small files of each folder,
+#            bin-packed into files of about --target-file-size-mb (see compaction_planner.py).  The destination can
+#            be the table itself (in place: the files that are not rewritten are not touched) or another folder
+#            (they are copied).  A rewritten file keeps the timestamp type (INT96 or TIMESTAMP_MICROS) and codec of
+#            the files it replaces, a group whose files mix them is refused.
+#            --stitch: the groups of files with the same schema and row groups of at least --min-row-group-size-mb
+#            are merged by copying their row groups (no decode/encode, see parquet_row_group_stitcher.py), the
+#            others are rewritten by Spark (benchmarks/benchmark_row_group_stitching.py compares the two).
+#          --layout sort|zorder (see parquet_layout.py): the rewritten rows are range partitioned and sorted on
+#            --layout-columns (or their Z-order) for tighter row group min/max statistics, the row group overlap of
+#            each folder is printed before and after.  The stitched files cannot be sorted (--stitch excluded).
+#          Both modes write to a staging folder next to the table, check the row counts and then publish folder by
+#            folder (compaction_commit.py): the new files are moved in, then the files they replace are deleted.
+#            The table stays at its root, in its year=/month= folders: the external tables, Spark and the
+#            conversion jobs read and write it as before.  The _file_index.json of a table is updated by
+#            --mode binpack (the repartitioned files are not in year=/month= folders, --mode repartition deletes it).
+#          --dry-run: no Spark, prints the files, sizes and row groups of each folder (Parquet footers read with
+#            pyarrow) and the file count after a binpack compaction, in seconds for a large table.
 
 from pyspark.sql.dataframe import DataFrame
 from pyspark.sql import SparkSession
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import argparse
+import math
+import re
 import time
 import sys
 
+from compaction_planner import DryRunCompaction, GetTableRoot, ListTableFiles, PlanCompaction, PrintCompactionPlan, \
+    BIGQUERY_EXTERNAL_TABLE_MAX_URIS, DEFAULT_TARGET_FILE_SIZE_MB
+from compaction_commit import BeginCompaction, CommitCompaction, GetRowCountsByFile, GetStagingRoot, NewFolderChange, NewRunId, \
+    RecoverCompactions, ValidateRowCounts
+from hadoop_fs_utils import GetFileSystem, PathExists
+from parquet_file_index import FILE_INDEX_NAME, GetPartition, GetRelativePath, WriteFileIndex
+from parquet_layout import LAYOUTS, ConfigureParquetLayout, GetFooterWriterSettings, GetOverlapMetrics, GetParquetLayout, GetParquetWriterOptions, \
+    GetRowGroupRanges, RangePartitionByLayout
+from parquet_row_group_stitcher import CanStitch, ReadFooter, StitchParquetFiles, DEFAULT_MIN_STITCH_ROW_GROUP_MB
+from spark_metrics_report import WriteMetricsReport
 
-def CompactParquetFiles(source, destination, numberOfPartitions):
+COMPACTION_MODES = ["repartition", "binpack"]
+
+
+def PlanAutoPartitions(inputBytes, inputPartitions, targetFileSizeBytes):
+    """Returns (number of output files, "coalesce" or "repartition", rationale) for numberOfPartitions auto"""
+    wantedFiles = max(1, int(math.ceil(inputBytes / float(targetFileSizeBytes))))
+    numberOfPartitions = min(wantedFiles, BIGQUERY_EXTERNAL_TABLE_MAX_URIS)
+    rationale = "{} input bytes / {} MB target = {} files".format(inputBytes, targetFileSizeBytes // (1024 * 1024), wantedFiles)
+    if numberOfPartitions < wantedFiles:
+        rationale += ", clamped to the {} URIs of a BigQuery external table".format(BIGQUERY_EXTERNAL_TABLE_MAX_URIS)
+
+    # Fewer files than read partitions: coalesce merges the read partitions without a shuffle
+    if numberOfPartitions <= inputPartitions:
+        return numberOfPartitions, "coalesce", rationale + "; {} <= {} read partitions: coalesce (no shuffle)".format(numberOfPartitions, inputPartitions)
+    return numberOfPartitions, "repartition", rationale + "; {} > {} read partitions: repartition (shuffle)".format(numberOfPartitions, inputPartitions)
+
+
+def CompactRepartition(spark, source, destinationRoot, runId, numberOfPartitions, targetFileSizeBytes, parquetLayout=None):
+    """Writes the files to the staging folder, then replaces all the files of the destination with them"""
+    df = spark.read.parquet(source)
+
+    method = "repartition"
+    if numberOfPartitions == "auto":
+        # The table files only (not the _ folders such as _metrics)
+        tableRoot, filesByFolder = ListTableFiles(spark, source)
+        inputBytes = sum(fileBytes for files in filesByFolder.values() for path, fileBytes in files)
+        numberOfPartitions, method, rationale = PlanAutoPartitions(inputBytes, df.rdd.getNumPartitions(), targetFileSizeBytes)
+        print("CompactRepartition: auto: {} files with {}: {}".format(numberOfPartitions, method, rationale))
+
+    if parquetLayout is not None and parquetLayout[0] != "none":
+        # Shuffled anyway: range partitioned on the layout columns and sorted, the files do not overlap
+        df = RangePartitionByLayout(df, numberOfPartitions, parquetLayout)
+    elif method == "coalesce":
+        df = df.coalesce(numberOfPartitions)
+    else:
+        df = df \
+            .repartition(numberOfPartitions) \
+            .coalesce(numberOfPartitions)
+
+    # Write as Parquet
+    stagedTable = GetStagingRoot(destinationRoot, runId) + "/table"
+    df \
+        .write \
+        .mode("overwrite") \
+        .options(**GetParquetWriterOptions(parquetLayout)) \
+        .parquet(stagedTable)
+
+    ValidateRowCounts(spark, spark.read.parquet(source).count(), spark.read.parquet(stagedTable).count(), "table")
+    stagedRoot, stagedFilesByFolder = ListTableFiles(spark, stagedTable)
+    stagedFiles = [path for files in stagedFilesByFolder.values() for path, fileBytes in files]
+    if parquetLayout is not None and parquetLayout[0] != "none":
+        # The output is not partitioned: one overlap for the whole table
+        tableRoot, filesByFolder = ListTableFiles(spark, source)
+        PrintOverlapMetrics(spark, {"": [path for files in filesByFolder.values() for path, fileBytes in files]},
+                            {"": stagedFiles}, parquetLayout[1])
+
+    # The files land at the root of the destination, the files of all its folders are replaced (and the index of
+    # the year=/month= files, the new files are not partitioned)
+    _, destinationFilesByFolder = ListTableFiles(spark, destinationRoot)
+    replacedFiles = sorted(path for files in destinationFilesByFolder.values() for path, fileBytes in files)
+    if PathExists(spark, destinationRoot + "/" + FILE_INDEX_NAME):
+        replacedFiles.append(destinationRoot + "/" + FILE_INDEX_NAME)
+    CommitCompaction(spark, destinationRoot, runId, [NewFolderChange(
+        "", moves=[(path, destinationRoot + "/" + path.rsplit("/", 1)[-1]) for path in stagedFiles], replaced=replacedFiles)])
+
+
+def JoinFolder(tableRoot, folder):
+    return tableRoot if folder == "" else tableRoot + "/" + folder
+
+
+def GetGroupWriterSettings(spark, group):
+    """Returns the (timestamp type, codec) the files of a group were written with (see parquet_layout.GetFooterWriterSettings).
+       Raises a ValueError when they differ: the rewritten file would not match some of them."""
+    settings = set(GetFooterWriterSettings(ReadFooter(spark, path)) for path, fileBytes in group["files"])
+    timestampTypes = set(timestampType for timestampType, codec in settings if timestampType is not None)
+    codecs = set(codec for timestampType, codec in settings if codec is not None)
+    if len(timestampTypes) > 1 or len(codecs) > 1:
+        raise ValueError("GetGroupWriterSettings: the files of {} mix timestamp types {} or codecs {}, rewrite the table with --mode repartition".format(
+            group["folder"] or "(root)", sorted(timestampTypes), sorted(codecs)))
+    return (timestampTypes.pop() if timestampTypes else None), (codecs.pop() if codecs else None)
+
+
+def RewriteGroup(spark, group, stagingPath, jobGroupPrefix="compact-", parquetLayout=None):
+    """Writes the files of a group as one Parquet file in the staging folder, returns its path.
+       The file keeps the timestamp type (INT96 or TIMESTAMP_MICROS) and codec of the files it replaces, so a folder
+       does not mix them (a layout would otherwise write TIMESTAMP_MICROS next to INT96 files and the writer
+       defaults next to ZSTD files).  With a layout the rows of the file are sorted on the layout columns (or their Z-order)."""
+    jobGroup = jobGroupPrefix + (group["folder"] or "root") + "-" + stagingPath.rsplit("/", 1)[-1]
+    spark.sparkContext.setJobGroup(jobGroup, jobGroup)
+    timestampType, codec = GetGroupWriterSettings(spark, group)
+    # The timestamp type is a SQL conf, not a write option: a session of its own for the groups written concurrently
+    groupSpark = spark.newSession()
+    if timestampType is not None:
+        groupSpark.conf.set("spark.sql.parquet.outputTimestampType", timestampType)
+    writerOptions = dict(GetParquetWriterOptions(parquetLayout))
+    if codec is not None:
+        writerOptions["compression"] = codec
+    # File paths: the partition columns of the folder are not read back as columns
+    df = groupSpark.read.parquet(*[path for path, fileBytes in group["files"]])
+    if parquetLayout is not None and parquetLayout[0] != "none":
+        # A shuffle into one sorted partition: the files are still read in parallel
+        df = RangePartitionByLayout(df, 1, parquetLayout)
+    else:
+        df = df.coalesce(1)
+    df \
+        .write \
+        .mode("overwrite") \
+        .options(**writerOptions) \
+        .parquet(stagingPath)
+    spark.sparkContext.setLocalProperty("spark.jobGroup.id", None)
+
+    fs, hadoopPath = GetFileSystem(spark, stagingPath + "/part-*.parquet")
+    partFiles = [status.getPath().toString() for status in (fs.globStatus(hadoopPath) or [])]
+    if len(partFiles) != 1:
+        raise RuntimeError("RewriteGroup: expected one part file in " + stagingPath + ", found " + str(len(partFiles)))
+    return partFiles[0]
+
+
+def CompactGroup(spark, group, stagingPath, stitch, minRowGroupBytes, parquetLayout=None):
+    """Stitches or rewrites the files of a group into one file of the staging folder.
+       Returns (path of the file, True when stitched)."""
+    if stitch:
+        paths = [path for path, fileBytes in group["files"]]
+        canStitch, reason = CanStitch(spark, paths, minRowGroupBytes)
+        if canStitch:
+            return StitchParquetFiles(spark, paths, stagingPath), True
+        print("CompactGroup: {} {}: rewritten, {}".format(group["folder"] or "(root)", stagingPath.rsplit("/", 1)[-1], reason))
+    return RewriteGroup(spark, group, stagingPath, parquetLayout=parquetLayout), False
+
+
+def PrintOverlapMetrics(spark, pathsBefore, pathsAfter, columns):
+    """Prints, for each folder and layout column, how much the min/max ranges of the row groups overlap in the
+       replaced files and in the files that replace them ({ folder: [paths] } each, footers read in the driver)"""
+    for folder in sorted(pathsBefore):
+        rangesBefore = GetRowGroupRanges([ReadFooter(spark, path) for path in pathsBefore[folder]], columns)
+        rangesAfter = GetRowGroupRanges([ReadFooter(spark, path) for path in pathsAfter.get(folder, [])], columns)
+        for column in columns:
+            metrics = []
+            for ranges in [rangesBefore[column], rangesAfter[column]]:
+                rowGroups, overlappingPairs, averageOverlaps = GetOverlapMetrics(ranges)
+                metrics.append("row groups: {:5d}  overlapping pairs: {:5.1f}%  overlaps per row group: {:7.1f}".format(
+                    rowGroups, 100.0 * overlappingPairs, averageOverlaps) if rowGroups > 0 else "no statistics")
+            print("PrintOverlapMetrics: {:24s} {:18s} before: {}  after: {}".format(folder or "(table)", column, metrics[0], metrics[1]))
+
+
+def NormalizePath(path):
+    """Path without its scheme (input_file_name returns file:///tmp/..., a listing file:/tmp/...)"""
+    return re.sub(r"^[a-z]+:/*", "", path)
+
+
+def ValidateGroups(spark, groups, compactedFiles):
+    """Checks that each compacted file has the rows of the files of its group"""
+    sourceRows = {NormalizePath(path): rows for path, rows in
+                  GetRowCountsByFile(spark, [path for group in groups for path, fileBytes in group["files"]]).items()}
+    compactedRows = {NormalizePath(path): rows for path, rows in GetRowCountsByFile(spark, compactedFiles).items()}
+    for group, compactedFile in zip(groups, compactedFiles):
+        groupRows = sum(sourceRows.get(NormalizePath(path), 0) for path, fileBytes in group["files"])
+        if groupRows != compactedRows.get(NormalizePath(compactedFile), 0):
+            ValidateRowCounts(spark, groupRows, compactedRows.get(NormalizePath(compactedFile), 0), compactedFile)
+    ValidateRowCounts(spark, sum(sourceRows.values()), sum(compactedRows.values()), "{} compacted files".format(len(compactedFiles)))
+
+
+def CompactBinPack(spark, source, destinationRoot, runId, targetFileSizeBytes, stitch=False, minRowGroupBytes=None,
+                   parquetLayout=None):
+    """Rewrites (or stitches) the groups of the compaction plan, each one into one file of its folder (sorted with a layout).
+       In place, each compacted file replaces the files of its group: the other files are not read, copied or
+       moved, the work is proportional to the small files.  Otherwise the files of the destination are replaced with the compacted files and a copy of the kept files."""
+    tableRoot, filesByFolder = ListTableFiles(spark, source)
+    if len(filesByFolder) == 0:
+        raise FileNotFoundError("CompactBinPack: no Parquet files found for " + source)
+    groups, keptFiles = PlanCompaction(filesByFolder, targetFileSizeBytes)
+    PrintCompactionPlan(filesByFolder, groups, keptFiles)
+
+    # Next to the table, not in it: the readers of the table do not see the files being written
+    stagingRoot = GetStagingRoot(destinationRoot, runId)
+    with ThreadPoolExecutor(max_workers=spark.sparkContext.defaultParallelism) as executor:
+        results = list(executor.map(lambda indexedGroup: CompactGroup(spark, indexedGroup[1], stagingRoot + "/group-" + str(indexedGroup[0]),
+                                                                      stitch, minRowGroupBytes, parquetLayout),
+                                    enumerate(groups)))
+
+    compactedFiles = [compactedFile for compactedFile, stitched in results]
+    if len(groups) > 0:
+        ValidateGroups(spark, groups, compactedFiles)
+    if parquetLayout is not None and parquetLayout[0] != "none":
+        pathsBefore = {}
+        pathsAfter = {}
+        for group, compactedFile in zip(groups, compactedFiles):
+            pathsBefore.setdefault(group["folder"], []).extend(path for path, fileBytes in group["files"])
+            pathsAfter.setdefault(group["folder"], []).append(compactedFile)
+        PrintOverlapMetrics(spark, pathsBefore, pathsAfter, parquetLayout[1])
+
+    folderChanges = {}
+    for group, compactedFile in zip(groups, compactedFiles):
+        folderChange = folderChanges.setdefault(group["folder"], NewFolderChange(group["folder"]))
+        folderChange["moves"].append((compactedFile, JoinFolder(destinationRoot, group["folder"]) + "/" + compactedFile.rsplit("/", 1)[-1]))
+    inPlace = destinationRoot == tableRoot
+    if inPlace:
+        for group in groups:
+            folderChanges[group["folder"]]["replaced"].extend(path for path, fileBytes in group["files"])
+    else:
+        # The kept files are copied when their folder is published, the files of the destination are replaced
+        for folder, path, fileBytes in keptFiles:
+            folderChange = folderChanges.setdefault(folder, NewFolderChange(folder))
+            folderChange["copies"].append((path, JoinFolder(destinationRoot, folder) + "/" + path.rsplit("/", 1)[-1]))
+        _, destinationFilesByFolder = ListTableFiles(spark, destinationRoot)
+        for folder, files in destinationFilesByFolder.items():
+            folderChange = folderChanges.setdefault(folder, NewFolderChange(folder))
+            newFiles = set(path for sourcePath, path in folderChange["moves"] + folderChange["copies"])
+            folderChange["replaced"].extend(path for path, fileBytes in files if path not in newFiles)
+    publishedChanges = CommitCompaction(spark, destinationRoot, runId, [folderChanges[folder] for folder in sorted(folderChanges)])
+
+    if inPlace and PathExists(spark, tableRoot + "/" + FILE_INDEX_NAME):
+        # Only the entries of the year=/month= folders published are recomputed (parquet_file_index.py)
+        partitions = sorted(set(GetPartition(path) for change in publishedChanges for stagedPath, path in change["moves"]
+                                if GetRelativePath(path) is not None))
+        if len(partitions) > 0:
+            WriteFileIndex(spark, destinationRoot, partitions)
+    elif not inPlace and (PathExists(spark, tableRoot + "/" + FILE_INDEX_NAME) or PathExists(spark, destinationRoot + "/" + FILE_INDEX_NAME)):
+        # Every file of the destination is new
+        WriteFileIndex(spark, destinationRoot)
+    print("CompactBinPack: compacted {} groups ({} stitched), {} files kept as they are, {} folders published".format(
+        len(groups), len([result for result in results if result[1]]), len(keptFiles), len(publishedChanges)))
+
+
+def CompactParquetFiles(source, destination, numberOfPartitions, metricsPath=None, mode="repartition", targetFileSizeMB=DEFAULT_TARGET_FILE_SIZE_MB,
+                        dryRun=False, stitch=False, minRowGroupSizeMB=DEFAULT_MIN_STITCH_ROW_GROUP_MB,
+                        layout="none", layoutColumns=None, rowGroupSizeMB=None):
     print("CompactParquetFiles: source:             ",source)
     print("CompactParquetFiles: destination:        ",destination)
     print("CompactParquetFiles: numberOfPartitions: ",str(numberOfPartitions))
+    print("CompactParquetFiles: metricsPath:        ",metricsPath)
+    print("CompactParquetFiles: mode:               ",mode)
+    print("CompactParquetFiles: targetFileSizeMB:   ",targetFileSizeMB)
+    print("CompactParquetFiles: dryRun:             ",dryRun)
+    print("CompactParquetFiles: stitch:             ",stitch, minRowGroupSizeMB)
+    print("CompactParquetFiles: layout:             ",layout, layoutColumns, rowGroupSizeMB)
+
+    if dryRun:
+        DryRunCompaction(source, targetFileSizeMB * 1024 * 1024)
+        return
+
+    if mode == "repartition" and numberOfPartitions is None:
+        raise ValueError("CompactParquetFiles: numberOfPartitions is required by --mode repartition")
+    if stitch and mode != "binpack":
+        raise ValueError("CompactParquetFiles: --stitch is only supported by --mode binpack")
+    if stitch and layout != "none":
+        raise ValueError("CompactParquetFiles: --stitch copies the row groups as they are, it cannot be combined with --layout " + layout)
 
     spark = SparkSession \
         .builder \
         .appName("CompactParquetFiles") \
         .getOrCreate()
 
-    df = spark.read.parquet(source)
+    parquetLayout = GetParquetLayout(layout, layoutColumns, rowGroupSizeMB)
+    ConfigureParquetLayout(spark, parquetLayout)
 
-    # Write as Parquet
-    df \
-        .repartition(numberOfPartitions) \
-        .coalesce(numberOfPartitions) \
-        .write \
-        .mode("overwrite") \
-        .parquet(destination)
+    fs, hadoopDestinationPath = GetFileSystem(spark, destination.rstrip("/"))
+    destinationRoot = fs.makeQualified(hadoopDestinationPath).toString()
+    _, hadoopSourceRootPath = GetFileSystem(spark, GetTableRoot(source))
+    sourceRoot = fs.makeQualified(hadoopSourceRootPath).toString()
+    if destinationRoot != sourceRoot and (destinationRoot.startswith(sourceRoot + "/") or sourceRoot.startswith(destinationRoot + "/")):
+        raise ValueError("CompactParquetFiles: the destination cannot be inside the source table or contain it: " + destinationRoot)
+
+    RecoverCompactions(spark, destinationRoot)
+    runId = NewRunId()
+    BeginCompaction(spark, destinationRoot, runId)
+
+    if mode == "binpack":
+        CompactBinPack(spark, source, destinationRoot, runId, targetFileSizeMB * 1024 * 1024, stitch, minRowGroupSizeMB * 1024 * 1024,
+                       parquetLayout)
+    else:
+        CompactRepartition(spark, source, destinationRoot, runId, numberOfPartitions, targetFileSizeMB * 1024 * 1024, parquetLayout)
+
+    if metricsPath is not None:
+        WriteMetricsReport(spark, metricsPath, "CompactParquetFiles", {
+            "source": source, "destination": destination, "numberOfPartitions": numberOfPartitions, "mode": mode,
+            "targetFileSizeMB": targetFileSizeMB, "stitch": stitch, "minRowGroupSizeMB": minRowGroupSizeMB,
+            "runId": runId, "layout": layout, "layoutColumns": layoutColumns,
+            "rowGroupSizeMB": rowGroupSizeMB})
 
     spark.stop()
 
 
 # Main entry point
-# compact_parquet_files gs://big-query-demo-09/test-taxi/source/*.parquet gs://big-query-demo-09/test-taxi/dest/ 10000
+# compact_parquet_files gs://big-query-demo-09/test-taxi/source/*.parquet gs://big-query-demo-09/test-taxi/dest/ 10000 [metricsPath]
+# compact_parquet_files gs://big-query-demo-09/test-taxi/source/*.parquet gs://big-query-demo-09/test-taxi/dest/ auto --target-file-size-mb 512
+# compact_parquet_files gs://big-query-demo-09/processed/taxi-data/green/trips_table/parquet gs://big-query-demo-09/processed/taxi-data/green/trips_table/parquet --mode binpack
+# compact_parquet_files gs://big-query-demo-09/processed/taxi-data/green/trips_table/parquet gs://big-query-demo-09/processed/taxi-data/green/trips_table/parquet --mode binpack --stitch
+# compact_parquet_files gs://big-query-demo-09/processed/taxi-data/green/trips_table/parquet gs://big-query-demo-09/processed/taxi-data/green/trips_table/parquet --mode binpack --layout zorder --layout-columns PULocationID,DOLocationID
+# compact_parquet_files gs://big-query-demo-09/processed/taxi-data/green/trips_table/parquet/*/*/*.parquet - --dry-run
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: compact_parquet_files source destination numberOfPartitions")
-        sys.exit(-1)
-
-    source = sys.argv[1]
-    destination  = sys.argv[2]
-    numberOfPartitions = int(sys.argv[3])
+    parser = argparse.ArgumentParser(prog="compact_parquet_files")
+    parser.add_argument("source", help="Folder or glob of the Parquet files")
+    parser.add_argument("destination")
+    parser.add_argument("numberOfPartitions", type=lambda value: value if value == "auto" else int(value), nargs="?", default=None,
+                        help="Number of output files of --mode repartition, or auto (input bytes / --target-file-size-mb)")
+    parser.add_argument("metricsPath", nargs="?", default=None,
+                        help="Folder (or .json file) of the metrics report of the run, read from the Spark REST API at the end (default: no report)")
+    parser.add_argument("--mode", choices=COMPACTION_MODES, default="repartition",
+                        help="Repartition everything into numberOfPartitions files, or bin-pack the small files of each folder (default: repartition)")
+    parser.add_argument("--target-file-size-mb", dest="targetFileSizeMB", type=int, default=DEFAULT_TARGET_FILE_SIZE_MB,
+                        help="Size of the files written by --mode binpack (files of at least half this size are not rewritten) and by numberOfPartitions auto (default: 256)")
+    parser.add_argument("--dry-run", dest="dryRun", action="store_true",
+                        help="Only report the files of each folder and the files after a binpack compaction (pyarrow, no Spark)")
+    parser.add_argument("--stitch", action="store_true",
+                        help="--mode binpack: merge the row groups of files with the same schema without decoding them, when they are large enough")
+    parser.add_argument("--min-row-group-size-mb", dest="minRowGroupSizeMB", type=int, default=DEFAULT_MIN_STITCH_ROW_GROUP_MB,
+                        help="Average row group size of the files of a group below which --stitch rewrites the group with Spark (default: 16)")
+    parser.add_argument("--layout", choices=LAYOUTS, default="none",
+                        help="Row order of the rewritten files: range partitioned and sorted on --layout-columns or their Z-order, "
+                             "the row group overlap before/after is printed (default: none)")
+    parser.add_argument("--layout-columns", dest="layoutColumns", default=None, type=lambda value: value.split(","),
+                        help="Comma separated sort or Z-order columns (default: Pickup_DateTime,PULocationID for sort, PULocationID,DOLocationID for zorder)")
+    parser.add_argument("--row-group-size-mb", dest="rowGroupSizeMB", type=int, default=None,
+                        help="Parquet row group size of the rewritten files (default: 32 with a layout, otherwise the Parquet default of 128)")
+    args = parser.parse_args()
 
     print ("BEGIN: Main")
-    numberOfPartitions = int(sys.argv[3])
-    CompactParquetFiles(source, destination, numberOfPartitions)
+    CompactParquetFiles(args.source, args.destination, args.numberOfPartitions, args.metricsPath, args.mode, args.targetFileSizeMB, args.dryRun,
+                        args.stitch, args.minRowGroupSizeMB, args.layout, args.layoutColumns, args.rowGroupSizeMB)
     print ("END: Main")
 
 """
@@ -84,6 +403,7 @@ gcloud dataproc jobs submit pyspark  \
    --project="big-query-demo-09" \
    --cluster="compactcluster" \
    --region="us-west2" \
+   --py-files gs://big-query-demo-09/pyspark-code/hadoop_fs_utils.py,gs://big-query-demo-09/pyspark-code/spark_job_metrics.py,gs://big-query-demo-09/pyspark-code/spark_metrics_report.py,gs://big-query-demo-09/pyspark-code/compaction_planner.py,gs://big-query-demo-09/pyspark-code/parquet_row_group_stitcher.py,gs://big-query-demo-09/pyspark-code/compaction_commit.py,gs://big-query-demo-09/pyspark-code/parquet_layout.py,gs://big-query-demo-09/pyspark-code/parquet_file_index.py \
    gs://big-query-demo-09/pyspark-code/compact_parquet_files.py \
    -- gs://big-query-demo-09/test-taxi/source/*.parquet \
       gs://big-query-demo-09/test-taxi/dest/ \
@@ -94,10 +414,23 @@ gcloud dataproc jobs submit pyspark  \
    --project="big-query-demo-09" \
    --cluster="compactcluster" \
    --region="us-west2" \
+   --py-files gs://big-query-demo-09/pyspark-code/hadoop_fs_utils.py,gs://big-query-demo-09/pyspark-code/spark_job_metrics.py,gs://big-query-demo-09/pyspark-code/spark_metrics_report.py,gs://big-query-demo-09/pyspark-code/compaction_planner.py,gs://big-query-demo-09/pyspark-code/parquet_row_group_stitcher.py,gs://big-query-demo-09/pyspark-code/compaction_commit.py,gs://big-query-demo-09/pyspark-code/parquet_layout.py,gs://big-query-demo-09/pyspark-code/parquet_file_index.py \
    gs://big-query-demo-09/pyspark-code/compact_parquet_files.py \
    -- gs://big-query-demo-09/processed/taxi-data/green/trips_table/parquet/*/*/*.parquet \
       gs://big-query-demo-09/compacted/dest/ \
-      50
+      auto
+
+# Sample run (partitioned table, in place: only the small files of each year=/month= folder are rewritten)
+gcloud dataproc jobs submit pyspark  \
+   --project="big-query-demo-09" \
+   --cluster="compactcluster" \
+   --region="us-west2" \
+   --py-files gs://big-query-demo-09/pyspark-code/hadoop_fs_utils.py,gs://big-query-demo-09/pyspark-code/spark_job_metrics.py,gs://big-query-demo-09/pyspark-code/spark_metrics_report.py,gs://big-query-demo-09/pyspark-code/compaction_planner.py,gs://big-query-demo-09/pyspark-code/parquet_row_group_stitcher.py,gs://big-query-demo-09/pyspark-code/compaction_commit.py,gs://big-query-demo-09/pyspark-code/parquet_layout.py,gs://big-query-demo-09/pyspark-code/parquet_file_index.py \
+   gs://big-query-demo-09/pyspark-code/compact_parquet_files.py \
+   -- gs://big-query-demo-09/processed/taxi-data/green/trips_table/parquet \
+      gs://big-query-demo-09/processed/taxi-data/green/trips_table/parquet \
+      --mode binpack \
+      --target-file-size-mb 256
 
 
 # Delete the cluster (clean up)
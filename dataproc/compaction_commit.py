@@ -0,0 +1,172 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Staged, journaled commit of a compaction that keeps the table at its root (the year=/month= folders read
+#          by the external tables, Spark and the conversion jobs stay where they are):
+#          1. the compacted files are written to <destination>_compaction_staging/<run id>/ (not in the table)
+#          2. their row counts are checked against the files they replace, a mismatch fails the run
+#          3. the changes of each folder are written to a journal, <destination>_compaction_commits/<run id>.json,
+#             then published folder by folder: the new files are moved in (a rename of one file, each file appears
+#             complete), then the files they replace are deleted (in parallel).  Only the rewritten files are
+#             touched, the other files of a folder stay where they are.
+#          A folder whose replaced files are gone (rewritten by another job during the compaction) is skipped.
+#          On GCS a folder is not swapped atomically: a reader listing a folder while it is published can see the
+#          new and the replaced files together, for the time of the deletes of that folder.
+#          A run that stops while publishing is finished (rolled forward) by the next run.  The recovery only acts
+#          on the runs of the journals: the staging folder of a run that did not publish within STALE_RUN_HOURS is
+#          deleted, the folders of runs still going are not touched.
+#          Ship this file with the job: --py-files gs://${rawBucket}/pyspark-code/compaction_commit.py
+
+import datetime
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from pyspark.sql.functions import input_file_name
+
+from hadoop_fs_utils import CopyFile, DeletePath, GetFileSystem, PathExists, ReadTextFile, RenamePath, WriteTextFile
+
+COMMIT_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# A run that has not published this long after it started has failed, its staging folder is deleted
+STALE_RUN_HOURS = 24
+
+# Deletes of the replaced files of a folder done at the same time
+DELETE_THREADS = 16
+
+
+def NewRunId():
+    # Sorts by start time, the suffix keeps the runs started in the same second apart
+    return datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+
+def GetStagingRoot(destinationRoot, runId):
+    return destinationRoot + "_compaction_staging/" + runId
+
+
+def GetCommitsRoot(destinationRoot):
+    return destinationRoot + "_compaction_commits"
+
+
+################################################################################################
+# Validation
+################################################################################################
+def GetRowCountsByFile(spark, paths):
+    """Returns { path: rows } (one Spark job that reads no column)"""
+    rows = spark.read.parquet(*paths).groupBy(input_file_name().alias("path")).count().collect()
+    return {row["path"]: row["count"] for row in rows}
+
+
+def ValidateRowCounts(spark, sourceRows, stagedRows, description):
+    """Raises when the staged files do not have the rows of the files they replace"""
+    if sourceRows != stagedRows:
+        raise RuntimeError("ValidateRowCounts: {}: {} rows in the source, {} rows staged, nothing published".format(
+            description, sourceRows, stagedRows))
+    print("ValidateRowCounts: {}: {} rows".format(description, stagedRows))
+
+
+################################################################################################
+# Journal and publishing
+################################################################################################
+def NewFolderChange(folder, moves=None, copies=None, replaced=None):
+    """The changes of one folder: moves [(staged file, file)] and copies [(source file, file)] in, replaced files out"""
+    return {"folder": folder, "moves": moves or [], "copies": copies or [], "replaced": replaced or []}
+
+
+def GetJournalPath(destinationRoot, runId):
+    return GetCommitsRoot(destinationRoot) + "/" + runId + ".json"
+
+
+def WriteJournal(spark, destinationRoot, journal):
+    WriteTextFile(spark, GetJournalPath(destinationRoot, journal["runId"]), json.dumps(journal, indent=1))
+
+
+def ReadJournals(spark, destinationRoot):
+    fs, hadoopPath = GetFileSystem(spark, GetCommitsRoot(destinationRoot) + "/*.json")
+    journals = []
+    for status in (fs.globStatus(hadoopPath) or []):
+        journals.append(json.loads(ReadTextFile(spark, status.getPath().toString())))
+    return sorted(journals, key=lambda journal: journal["runId"])
+
+
+def BeginCompaction(spark, destinationRoot, runId):
+    """Journals the start of a run (its staging folder is deleted by the recovery if it never publishes)"""
+    WriteJournal(spark, destinationRoot, {
+        "runId": runId, "state": "staging", "started": datetime.datetime.utcnow().strftime(COMMIT_TIME_FORMAT),
+        "folders": [], "published": None})
+
+
+def PublishFolder(spark, folderChange):
+    """Moves and copies the new files of a folder in, then deletes the files they replace.  A move already done
+       (staged file gone, file present) is skipped, so an interrupted publish can be run again."""
+    for sourcePath, destinationPath in folderChange["copies"]:
+        CopyFile(spark, sourcePath, destinationPath)
+    for sourcePath, destinationPath in folderChange["moves"]:
+        if PathExists(spark, sourcePath):
+            RenamePath(spark, sourcePath, destinationPath)
+        elif not PathExists(spark, destinationPath):
+            raise IOError("PublishFolder: neither " + sourcePath + " nor " + destinationPath + " exists")
+    with ThreadPoolExecutor(max_workers=DELETE_THREADS) as executor:
+        list(executor.map(lambda path: DeletePath(spark, path), folderChange["replaced"]))
+
+
+def CommitCompaction(spark, destinationRoot, runId, folderChanges):
+    """Journals and publishes the folder changes of a run, then removes its staging folder.  The folders whose
+       replaced files no longer all exist are skipped (their staged files are deleted with the staging folder)."""
+    publishedChanges = []
+    for folderChange in folderChanges:
+        if all(PathExists(spark, path) for path in folderChange["replaced"]):
+            publishedChanges.append(folderChange)
+        else:
+            print("CommitCompaction: {}: files changed by another job during the compaction, not published".format(
+                folderChange["folder"] or "(root)"))
+
+    journal = json.loads(ReadTextFile(spark, GetJournalPath(destinationRoot, runId)))
+    journal["state"] = "publishing"
+    journal["folders"] = publishedChanges
+    WriteJournal(spark, destinationRoot, journal)
+    for folderChange in publishedChanges:
+        PublishFolder(spark, folderChange)
+    journal["state"] = "published"
+    journal["published"] = datetime.datetime.utcnow().strftime(COMMIT_TIME_FORMAT)
+    WriteJournal(spark, destinationRoot, journal)
+    DeletePath(spark, GetStagingRoot(destinationRoot, runId))
+    print("CommitCompaction: run {} published: {} folders, {} new files, {} files replaced".format(
+        runId, len(publishedChanges), sum(len(change["moves"]) + len(change["copies"]) for change in publishedChanges),
+        sum(len(change["replaced"]) for change in publishedChanges)))
+    return publishedChanges
+
+
+def RecoverCompactions(spark, destinationRoot):
+    """Finishes the publishing of the runs that stopped while publishing and deletes the staging folder of the runs
+       that did not publish within STALE_RUN_HOURS.  Runs still staging are not touched."""
+    now = datetime.datetime.utcnow()
+    for journal in ReadJournals(spark, destinationRoot):
+        if journal["state"] == "publishing":
+            # Publishing again is harmless: the moves done are skipped, the deletes of missing files do nothing
+            print("RecoverCompactions: finishing the publishing of run " + journal["runId"])
+            for folderChange in journal["folders"]:
+                PublishFolder(spark, folderChange)
+            journal["state"] = "published"
+            journal["published"] = now.strftime(COMMIT_TIME_FORMAT)
+            WriteJournal(spark, destinationRoot, journal)
+            DeletePath(spark, GetStagingRoot(destinationRoot, journal["runId"]))
+        elif journal["state"] == "staging" and \
+                now - datetime.datetime.strptime(journal["started"], COMMIT_TIME_FORMAT) >= datetime.timedelta(hours=STALE_RUN_HOURS):
+            DeletePath(spark, GetStagingRoot(destinationRoot, journal["runId"]))
+            journal["state"] = "abandoned"
+            WriteJournal(spark, destinationRoot, journal)
+            print("RecoverCompactions: deleted the staging folder of run {} (not published)".format(journal["runId"]))
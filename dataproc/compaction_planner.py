@@ -0,0 +1,233 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Plans the compaction of a Parquet table without changing its folder layout (e.g. year=/month=).
+#          The files of each folder are listed with their sizes and the small ones are bin-packed (first fit
+#          decreasing) into groups of about the target file size.  Each group becomes one file in the same folder,
+#          the files that are already large enough are not rewritten.  A listing only, no Parquet footers are read.
+#            { "folder": "year=2021/month=1", "files": [ (path, bytes), ... ], "bytes": 251658240 }
+#          DryRunCompaction reports the plan without Spark: the files are listed and their footers read with pyarrow
+#          (thread pool), for the file count, size histogram and row groups of each folder and the file count after
+#          the compaction, with a warning when the table is over the URI limit of a BigQuery external table.
+#          Ship this file with the job: --py-files gs://${rawBucket}/pyspark-code/compaction_planner.py
+
+import fnmatch
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hadoop_fs_utils import GetFileSystem
+
+DEFAULT_TARGET_FILE_SIZE_MB = 256
+
+# Upper limit of the source URIs of a BigQuery external table (a URI per file once the wildcards are expanded)
+BIGQUERY_EXTERNAL_TABLE_MAX_URIS = 10000
+
+# Footers read at the same time by the dry run (each read is a small ranged read, mostly waiting on the storage)
+FOOTER_READ_THREADS = 32
+
+# Buckets of the file size histogram of the dry run: (label, upper bound in MB)
+FILE_SIZE_BUCKETS = [("<1MB", 1), ("1-16MB", 16), ("16-64MB", 64), ("64-128MB", 128), ("128-256MB", 256),
+                     ("256MB-1GB", 1024), (">=1GB", None)]
+
+# Files of at least this share of the target size are left as they are
+WELL_SIZED_RATIO = 0.5
+
+GLOB_CHARACTERS = re.compile(r"[*?\[{]")
+
+
+def GetTableRoot(source):
+    """Folder of the table for a folder or a glob (gs://bucket/table/*/*/*.parquet: gs://bucket/table)"""
+    segments = source.rstrip("/").split("/")
+    for index, segment in enumerate(segments):
+        if GLOB_CHARACTERS.search(segment):
+            return "/".join(segments[:index])
+    return "/".join(segments)
+
+
+def GetRelativeFolder(tableRoot, path):
+    """Folder of a file relative to the table root ("" for a file at the root), None for the files that are not
+       table data (_SUCCESS, _file_index.json, files of _ or . folders such as _metrics)"""
+    relativePath = path[len(tableRoot):].strip("/")
+    segments = relativePath.split("/")
+    if not segments[-1].endswith(".parquet") or any(segment.startswith(("_", ".")) for segment in segments):
+        return None
+    return "/".join(segments[:-1])
+
+
+def ListTableFiles(spark, source):
+    """Lists the Parquet files of a table folder (recursively) or of a glob.
+       Returns (table root, { relative folder: [(path, bytes)] }), the paths are fully qualified."""
+    fs, hadoopPath = GetFileSystem(spark, source.rstrip("/"))
+    _, hadoopRootPath = GetFileSystem(spark, GetTableRoot(source))
+    tableRoot = fs.makeQualified(hadoopRootPath).toString()
+
+    statuses = []
+    if GLOB_CHARACTERS.search(source):
+        statuses = [status for status in (fs.globStatus(hadoopPath) or []) if status.isFile()]
+    elif fs.exists(hadoopPath):
+        iterator = fs.listFiles(hadoopPath, True)
+        while iterator.hasNext():
+            statuses.append(iterator.next())
+
+    filesByFolder = {}
+    for status in statuses:
+        path = status.getPath().toString()
+        folder = GetRelativeFolder(tableRoot, path)
+        if folder is not None:
+            filesByFolder.setdefault(folder, []).append((path, status.getLen()))
+    return tableRoot, filesByFolder
+
+
+def PackFiles(files, targetFileSizeBytes):
+    """First fit decreasing: [(path, bytes)] into bins of at most targetFileSizeBytes (a larger file is a bin by itself)"""
+    bins = []
+    for path, fileBytes in sorted(files, key=lambda file: (-file[1], file[0])):
+        for fileBin in bins:
+            if fileBin["bytes"] + fileBytes <= targetFileSizeBytes:
+                fileBin["files"].append((path, fileBytes))
+                fileBin["bytes"] += fileBytes
+                break
+        else:
+            bins.append({"files": [(path, fileBytes)], "bytes": fileBytes})
+    return bins
+
+
+def PlanCompaction(filesByFolder, targetFileSizeBytes):
+    """Returns (groups to rewrite, [(folder, path, bytes)] of the files kept as they are).
+       A bin with a single small file is kept: rewriting it alone does not reduce the file count."""
+    groups = []
+    keptFiles = []
+    for folder, files in sorted(filesByFolder.items()):
+        smallFiles = [(path, fileBytes) for path, fileBytes in files if fileBytes < targetFileSizeBytes * WELL_SIZED_RATIO]
+        keptFiles.extend((folder, path, fileBytes) for path, fileBytes in files if fileBytes >= targetFileSizeBytes * WELL_SIZED_RATIO)
+        for fileBin in PackFiles(smallFiles, targetFileSizeBytes):
+            if len(fileBin["files"]) == 1:
+                path, fileBytes = fileBin["files"][0]
+                keptFiles.append((folder, path, fileBytes))
+            else:
+                groups.append({"folder": folder, "files": fileBin["files"], "bytes": fileBin["bytes"]})
+    return groups, keptFiles
+
+
+def PrintCompactionPlan(filesByFolder, groups, keptFiles):
+    inputFiles = sum(len(files) for files in filesByFolder.values())
+    rewrittenFiles = sum(len(group["files"]) for group in groups)
+    print("PrintCompactionPlan: folders: {}  files: {}  rewritten files: {} ({} bytes) into {} files  kept files: {}  files after: {}".format(
+        len(filesByFolder), inputFiles, rewrittenFiles, sum(group["bytes"] for group in groups), len(groups),
+        len(keptFiles), len(keptFiles) + len(groups)))
+    for folder in sorted(set(group["folder"] for group in groups)):
+        folderGroups = [group for group in groups if group["folder"] == folder]
+        print("PrintCompactionPlan: {:24s} files: {:6d}  rewritten: {:6d} into {:4d}".format(
+            folder or "(root)", len(filesByFolder[folder]), sum(len(group["files"]) for group in folderGroups), len(folderGroups)))
+
+
+################################################################################################
+# Dry run (pyarrow, no Spark)
+################################################################################################
+def MatchesGlob(relativePath, relativePattern):
+    """Glob match by path segment (a * does not match a /)"""
+    pathSegments = relativePath.split("/")
+    patternSegments = relativePattern.split("/")
+    return len(pathSegments) == len(patternSegments) and \
+        all(fnmatch.fnmatchcase(pathSegment, patternSegment) for pathSegment, patternSegment in zip(pathSegments, patternSegments))
+
+
+def ListTableFilesArrow(source):
+    """ListTableFiles with pyarrow: returns (pyarrow file system, { relative folder: [(path, bytes)] })"""
+    import pyarrow.fs
+    tableRoot = GetTableRoot(source)
+    fs, rootPath = pyarrow.fs.FileSystem.from_uri(tableRoot)
+    rootPath = rootPath.rstrip("/")
+    relativePattern = source.rstrip("/")[len(tableRoot):].strip("/")
+
+    filesByFolder = {}
+    if fs.get_file_info(rootPath).type == pyarrow.fs.FileType.NotFound:
+        return fs, filesByFolder
+    for fileInfo in fs.get_file_info(pyarrow.fs.FileSelector(rootPath, recursive=True)):
+        if fileInfo.type != pyarrow.fs.FileType.File:
+            continue
+        if relativePattern != "" and not MatchesGlob(fileInfo.path[len(rootPath):].strip("/"), relativePattern):
+            continue
+        folder = GetRelativeFolder(rootPath, fileInfo.path)
+        if folder is not None:
+            filesByFolder.setdefault(folder, []).append((fileInfo.path, fileInfo.size))
+    return fs, filesByFolder
+
+
+def ReadFooters(fs, paths, threads=FOOTER_READ_THREADS):
+    """Returns { path: (rows, row groups) } from the Parquet footers"""
+    import pyarrow.parquet
+
+    def ReadFooter(path):
+        metadata = pyarrow.parquet.read_metadata(path, filesystem=fs)
+        return path, (metadata.num_rows, metadata.num_row_groups)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return dict(executor.map(ReadFooter, paths))
+
+
+def GetFileSizeHistogram(files):
+    histogram = {label: 0 for label, upperBoundMB in FILE_SIZE_BUCKETS}
+    for path, fileBytes in files:
+        for label, upperBoundMB in FILE_SIZE_BUCKETS:
+            if upperBoundMB is None or fileBytes < upperBoundMB * 1024 * 1024:
+                histogram[label] += 1
+                break
+    return histogram
+
+
+def DryRunCompaction(source, targetFileSizeBytes):
+    """Prints, for each folder and for the table, what a binpack compaction would do.  Returns the report."""
+    startTime = time.time()
+    fs, filesByFolder = ListTableFilesArrow(source)
+    if len(filesByFolder) == 0:
+        raise FileNotFoundError("DryRunCompaction: no Parquet files found for " + source)
+    footers = ReadFooters(fs, [path for files in filesByFolder.values() for path, fileBytes in files])
+    groups, keptFiles = PlanCompaction(filesByFolder, targetFileSizeBytes)
+
+    folders = []
+    for folder, files in sorted(filesByFolder.items()):
+        folders.append({
+            "folder":     folder,
+            "files":      len(files),
+            "bytes":      sum(fileBytes for path, fileBytes in files),
+            "rows":       sum(footers[path][0] for path, fileBytes in files),
+            "rowGroups":  sum(footers[path][1] for path, fileBytes in files),
+            "histogram":  GetFileSizeHistogram(files),
+            "filesAfter": len([group for group in groups if group["folder"] == folder]) +
+                          len([keptFile for keptFile in keptFiles if keptFile[0] == folder])
+        })
+    report = {
+        "folders":    folders,
+        "files":      sum(folder["files"] for folder in folders),
+        "bytes":      sum(folder["bytes"] for folder in folders),
+        "rows":       sum(folder["rows"] for folder in folders),
+        "rowGroups":  sum(folder["rowGroups"] for folder in folders),
+        "histogram":  GetFileSizeHistogram([file for files in filesByFolder.values() for file in files]),
+        "filesAfter": len(groups) + len(keptFiles)
+    }
+
+    for folder in folders + [dict(report, folder="(table)")]:
+        print("DryRunCompaction: {:24s} files: {:7d}  bytes: {:14d}  rows: {:12d}  row groups: {:7d}  files after: {:7d}  sizes: {}".format(
+            folder["folder"] or "(root)", folder["files"], folder["bytes"], folder["rows"], folder["rowGroups"], folder["filesAfter"],
+            "  ".join("{}: {}".format(label, count) for label, count in folder["histogram"].items() if count > 0)))
+    for when, fileCount in [("now", report["files"]), ("after the compaction", report["filesAfter"])]:
+        if fileCount > BIGQUERY_EXTERNAL_TABLE_MAX_URIS:
+            print("DryRunCompaction: WARNING: {} files {}, over the {} URIs of a BigQuery external table".format(
+                fileCount, when, BIGQUERY_EXTERNAL_TABLE_MAX_URIS))
+    print("DryRunCompaction: listed and read {} footers in {:.1f} seconds".format(report["files"], time.time() - startTime))
+    return report
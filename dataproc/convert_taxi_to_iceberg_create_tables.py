@@ -23,14 +23,46 @@ from pyspark.sql import SparkSession
 from pyspark.sql.functions import col, year, month
 from pyspark.sql.types import StructType, StructField, StringType, IntegerType, DoubleType, TimestampType
 from datetime import datetime
+import argparse
 import time
 import sys
 
+from hadoop_fs_utils import GetPathSizeBytes
+from output_file_sizing import GetRowCountsByPartition, RepartitionByTargetFileSize
+from spark_metrics_report import WriteMetricsReport
 
-def ConvertTaxiData(sourceYellow, sourceGreen, icebergWarehouse):
+
+def SizeOutputFiles(spark, df_with_partition_cols, source, targetFileSizeBytes):
+    if targetFileSizeBytes is None:
+        # At most 5 files per year/month
+        return df_with_partition_cols \
+            .repartition(5) \
+            .coalesce(5)
+
+    # The row counts only read Pickup_DateTime from the raw files
+    rowCounts = GetRowCountsByPartition(df_with_partition_cols, ["year","month"])
+    bytesPerRow = GetPathSizeBytes(spark, source) / max(1, sum(rowCounts.values()))
+    return RepartitionByTargetFileSize(spark, df_with_partition_cols, ["year","month"],
+                                       rowCounts, bytesPerRow, targetFileSizeBytes)
+
+
+def GetTableProperties(targetFileSizeBytes):
+    if targetFileSizeBytes is None:
+        return ""
+    # Iceberg also rolls over to a new file at this size
+    return "\n            TBLPROPERTIES ('write.target-file-size-bytes'='" + str(targetFileSizeBytes) + "')"
+
+
+def ConvertTaxiData(sourceYellow, sourceGreen, icebergWarehouse, targetFileSizeMB=None, metricsPath=None):
     print("ConvertTaxiData: sourceYellow: ",sourceYellow)
     print("ConvertTaxiData: sourceGreen:  ",sourceGreen)
     print("ConvertTaxiData: icebergWarehouse:  ",icebergWarehouse)
+    print("ConvertTaxiData: targetFileSizeMB:  ",targetFileSizeMB)
+    print("ConvertTaxiData: metricsPath:  ",metricsPath)
+
+    targetFileSizeBytes = None
+    if targetFileSizeMB is not None:
+        targetFileSizeBytes = targetFileSizeMB * 1024 * 1024
 
     # ICEBERG SPECIFIC!
     # We need the ".config" options set for the default Iceberg catalog
@@ -146,16 +178,14 @@ def ConvertTaxiData(sourceYellow, sourceGreen, icebergWarehouse):
                 year INT,
                 month INT)
             USING iceberg
-            PARTITIONED BY (year, month)"""
+            PARTITIONED BY (year, month)""" + GetTableProperties(targetFileSizeBytes)
 
     spark.sql(create_green_taxi_trips)
 
     # Partition names are case sensative
     # The data must be sorted or you get the error:
     # java.lang.IllegalStateException: Incoming records violate the writer assumption that records are clustered by spec and by partition within each spec. Either cluster the incoming records or switch to fanout writers.
-    df_with_partition_cols \
-        .repartition(5) \
-        .coalesce(5) \
+    SizeOutputFiles(spark, df_with_partition_cols, sourceGreen, targetFileSizeBytes) \
         .sortWithinPartitions("year", "month") \
         .write \
         .format("iceberg") \
@@ -248,13 +278,11 @@ def ConvertTaxiData(sourceYellow, sourceGreen, icebergWarehouse):
                 year INTEGER,
                 month INTEGER)
             USING iceberg
-            PARTITIONED BY (year, month)"""
+            PARTITIONED BY (year, month)""" + GetTableProperties(targetFileSizeBytes)
 
     spark.sql(create_yellow_taxi_trips)
 
-    df_with_partition_cols \
-        .repartition(5) \
-        .coalesce(5) \
+    SizeOutputFiles(spark, df_with_partition_cols, sourceYellow, targetFileSizeBytes) \
         .sortWithinPartitions("year", "month") \
         .write \
         .format("iceberg") \
@@ -262,22 +290,30 @@ def ConvertTaxiData(sourceYellow, sourceGreen, icebergWarehouse):
         .partitionBy("year","month") \
         .save("local.default.yellow_taxi_trips")
 
+    # Not in the warehouse, a folder in the warehouse would be listed as a namespace by the hadoop catalog
+    if metricsPath is not None:
+        WriteMetricsReport(spark, metricsPath, "ConvertTaxiDataIceberg", {
+            "sourceYellow": sourceYellow, "sourceGreen": sourceGreen, "icebergWarehouse": icebergWarehouse,
+            "targetFileSizeMB": targetFileSizeMB})
+
     spark.stop()
 
 
 # Main entry point
-# convert_taxi_to_iceberg_create_tables gs://${rawBucket}/raw/taxi-data/yellow/*/*.parquet gs://${rawBucket}/raw/taxi-data/green/*/*.parquet gs://${processedBucket}/iceberg-warehouse
+# convert_taxi_to_iceberg_create_tables gs://${rawBucket}/raw/taxi-data/yellow/*/*.parquet gs://${rawBucket}/raw/taxi-data/green/*/*.parquet gs://${processedBucket}/iceberg-warehouse [--target-file-size-mb 256] [--metrics-path gs://${processedBucket}/job-metrics/]
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: convert_taxi_to_iceberg_create_tables sourceYellow sourceGreen icebergWarehouse")
-        sys.exit(-1)
-
-    sourceYellow     = sys.argv[1]
-    sourceGreen      = sys.argv[2]
-    icebergWarehouse = sys.argv[3]
+    parser = argparse.ArgumentParser(prog="convert_taxi_to_iceberg_create_tables")
+    parser.add_argument("sourceYellow")
+    parser.add_argument("sourceGreen")
+    parser.add_argument("icebergWarehouse")
+    parser.add_argument("--target-file-size-mb", dest="targetFileSizeMB", type=int, default=None,
+                        help="Size the files of each year/month to this size (default: up to 5 files per year/month)")
+    parser.add_argument("--metrics-path", dest="metricsPath", default=None,
+                        help="Folder (or .json file) of the metrics report of the run, read from the Spark REST API at the end (default: no report)")
+    args = parser.parse_args()
 
     print ("BEGIN: Main")
-    ConvertTaxiData(sourceYellow, sourceGreen, icebergWarehouse)
+    ConvertTaxiData(args.sourceYellow, args.sourceGreen, args.icebergWarehouse, args.targetFileSizeMB, args.metricsPath)
     print ("END: Main")
 
 
@@ -315,10 +351,12 @@ gcloud dataproc jobs submit pyspark  \
    --region="us-west2" \
    --project="${project}" \
    --jars ./dataproc/iceberg-spark-runtime-3.1_2.12-0.14.0.jar \
+   --py-files gs://${rawBucket}/pyspark-code/hadoop_fs_utils.py,gs://${rawBucket}/pyspark-code/output_file_sizing.py,gs://${rawBucket}/pyspark-code/spark_job_metrics.py,gs://${rawBucket}/pyspark-code/spark_metrics_report.py \
    gs://${rawBucket}/pyspark-code/convert_taxi_to_iceberg_create_tables.py \
    -- gs://${rawBucket}/raw/taxi-data/yellow/*/*.parquet \
       gs://${rawBucket}/raw/taxi-data/green/*/*.parquet \
-      gs://${processedBucket}/iceberg-warehouse
+      gs://${processedBucket}/iceberg-warehouse \
+      --target-file-size-mb 256
 
 gcloud dataproc clusters delete iceberg-cluster --region us-west2 --project="${project}"
 """
\ No newline at end of file
@@ -26,9 +26,12 @@ from datetime import datetime
 import time
 import sys
 
+from spark_metrics_report import WriteMetricsReport
 
-def UpdateIcebergTaxiData(icebergWarehouse):
+
+def UpdateIcebergTaxiData(icebergWarehouse, metricsPath=None):
     print("UpdateIcebergTaxiData: icebergWarehouse:  ",icebergWarehouse)
+    print("UpdateIcebergTaxiData: metricsPath:  ",metricsPath)
 
     # ICEBERG SPECIFIC!
     # We need the ".config" options set for the default Iceberg catalog
@@ -65,20 +68,26 @@ def UpdateIcebergTaxiData(icebergWarehouse):
     query = "UPDATE local.default.green_taxi_trips SET iceberg_data = 'Iceberg was here!'"
     spark.sql(query)
 
+    # Not in the warehouse, a folder in the warehouse would be listed as a namespace by the hadoop catalog
+    if metricsPath is not None:
+        WriteMetricsReport(spark, metricsPath, "IcebergDataUpdates", {
+            "icebergWarehouse": icebergWarehouse})
+
     spark.stop()
 
 
 # Main entry point
-# convert_taxi_to_iceberg_data_updates gs://${processedBucket}/iceberg-warehouse
+# convert_taxi_to_iceberg_data_updates gs://${processedBucket}/iceberg-warehouse [metricsPath]
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: convert_taxi_to_parquet icebergWarehouse")
+    if len(sys.argv) != 2 and len(sys.argv) != 3:
+        print("Usage: convert_taxi_to_parquet icebergWarehouse [metricsPath]")
         sys.exit(-1)
 
     icebergWarehouse = sys.argv[1]
+    metricsPath = sys.argv[2] if len(sys.argv) == 3 else None
 
     print ("BEGIN: Main")
-    UpdateIcebergTaxiData(icebergWarehouse)
+    UpdateIcebergTaxiData(icebergWarehouse, metricsPath)
     print ("END: Main")
 
 
@@ -116,6 +125,7 @@ gcloud dataproc jobs submit pyspark  \
    --region="us-west2" \
    --project="${project}" \
    --jars ./dataproc/iceberg-spark-runtime-3.1_2.12-0.14.0.jar \
+   --py-files gs://${rawBucket}/pyspark-code/hadoop_fs_utils.py,gs://${rawBucket}/pyspark-code/spark_job_metrics.py,gs://${rawBucket}/pyspark-code/spark_metrics_report.py \
    gs://${rawBucket}/pyspark-code/convert_taxi_to_iceberg_data_updates.py \
    -- gs://${processedBucket}/iceberg-warehouse
 
@@ -135,6 +145,7 @@ gcloud beta dataproc batches submit pyspark \
     --batch="batch-002"  \
     gs://raw-data-analytics-demo-s3epuwhxbf/pyspark-code/convert_taxi_to_iceberg_data_updates.py \
     --jars gs://raw-data-analytics-demo-s3epuwhxbf/pyspark-code/iceberg-spark-runtime-3.1_2.12-0.14.0.jar \
+    --py-files gs://raw-data-analytics-demo-s3epuwhxbf/pyspark-code/hadoop_fs_utils.py,gs://raw-data-analytics-demo-s3epuwhxbf/pyspark-code/spark_job_metrics.py,gs://raw-data-analytics-demo-s3epuwhxbf/pyspark-code/spark_metrics_report.py \
     --subnet="bigspark-subnet" \
     --deps-bucket="gs://dataproc-data-analytics-demo-s3epuwhxbf" \
     --service-account="dataproc-service-account@data-analytics-demo-s3epuwhxbf.iam.gserviceaccount.com" \
@@ -21,27 +21,60 @@
 
 from pyspark.sql.dataframe import DataFrame
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import col, year, month
+from pyspark.sql.functions import broadcast, col, input_file_name, lit, year, month
 from pyspark.sql.types import StructType, StructField, StringType, IntegerType, DoubleType, TimestampType
+from pyspark import StorageLevel
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import argparse
+import re
 import time
 import sys
 
-
-def ConvertTaxiData(sourceYellow, sourceGreen, destination):
-    print("ConvertTaxiData: sourceYellow: ",sourceYellow)
-    print("ConvertTaxiData: sourceGreen:  ",sourceGreen)
-    print("ConvertTaxiData: destination:  ",destination)
-
-    spark = SparkSession \
-        .builder \
-        .appName("ConvertTaxiData") \
-        .getOrCreate()
-
-
-    ################################################################################################
-    # Yellow
-    ################################################################################################
+from spark_job_metrics import GetInputBytesForJobGroup
+from spark_metrics_report import WriteMetricsReport
+from output_file_sizing import GetRowCountsByPartition, RepartitionByTargetFileSize
+from taxi_schema_registry import ReadRawTaxiData, ReadRawTaxiDataInferred, ExplainRawSchemaError, TRIPS_TABLE_YEARS, LOOKUP_TABLES, \
+                                 LOOKUP_TABLE_TRIP_COLUMNS
+from raw_file_manifest import ListRawFiles, ReadManifest, ReadManifestPartitions, WriteManifest, GetFilesForPartitions, GetNewOrChangedFiles, \
+    GetDeletedFiles
+from parquet_layout import LAYOUTS, ApplyLayout, ConfigureParquetLayout, GetParquetLayout, GetParquetWriterOptions
+from parquet_writer_profiles import PROFILES, GetProfileWriterOptions
+from parquet_file_index import WriteFileIndex
+from hadoop_fs_utils import DeletePath, PathExists, WriteTextFile
+from resumable_units import TRIPS_TABLE_FORMATS, GetUnitPaths, GetFileIndexMarkerPath, GetRawFilePartitionsPath, GroupRawFilesByPartition, \
+                            GetUnitOptions, IsUnitCommitted, PrepareUnit, CommitUnit
+
+# How the Parquet, CSV and JSON copies of a trips table are produced
+#   rescan:  each format re-reads the raw files and repeats the cast/rename/filter (original behavior, 3 scans)
+#   persist: the normalized frame is persisted to the workers local disk (SSD) and fanned out to every format
+#   derive:  Parquet is written first and the CSV/JSON are derived from the Parquet output (no cache needed)
+WRITE_MODES = ["rescan", "persist", "derive"]
+
+# How the raw files are read
+#   declared: each year is read with its schema from taxi_schema_registry.py (no footer inference, airport_fee can be kept
+#             with --include-airport-fee)
+#   infer:    Spark infers the schema from the files (airport_fee cannot be read since its type changes)
+SCHEMA_MODES = ["declared", "infer"]
+
+# How the yellow, green and lookup table pipelines are run
+#   sequential: one after the other (original behavior)
+#   concurrent: from a thread pool, each pipeline in its own FAIR scheduler pool so their Spark jobs share the executors
+EXECUTION_MODES = ["sequential", "concurrent"]
+
+# What converts the files
+#   spark: the Spark job (original behavior)
+#   arrow: pyarrow on the driver / a single machine, for small inputs such as one new month (arrow_taxi_engine.py)
+#   auto:  arrow when the raw files (yellow + green) are at most --arrow-max-source-mb, otherwise spark
+ENGINES = ["spark", "arrow", "auto"]
+DEFAULT_ARROW_MAX_SOURCE_MB = 512
+
+
+################################################################################################
+# Yellow
+################################################################################################
+def ReadYellowTaxiData(spark, sourceYellow, schemaMode="declared", includeAirportFee=False):
     # Yellow Schema for 2019 / 2020 / 2021
     # 2021 VendorID,tpep_pickup_datetime,tpep_dropoff_datetime,passenger_count,trip_distance,RatecodeID,store_and_fwd_flag,PULocationID,DOLocationID,payment_type,fare_amount,extra,mta_tax,tip_amount,tolls_amount,improvement_surcharge,total_amount,congestion_surcharge
     # 2020 VendorID,tpep_pickup_datetime,tpep_dropoff_datetime,passenger_count,trip_distance,RatecodeID,store_and_fwd_flag,PULocationID,DOLocationID,payment_type,fare_amount,extra,mta_tax,tip_amount,tolls_amount,improvement_surcharge,total_amount,congestion_surcharge
@@ -66,7 +99,7 @@ def ConvertTaxiData(sourceYellow, sourceGreen, destination):
     RENAME: improvement_surcharge	FLOAT	NULLABLE		
     RENAME: total_amount	FLOAT	NULLABLE		
     RENAME: congestion_surcharge	FLOAT	NULLABLE		
-    NEW: airport_fee	INTEGER	NULLABLE		
+    NEW: airport_fee	INTEGER	NULLABLE (2019), FLOAT	NULLABLE (2020+)
     """
 
     """
@@ -88,11 +121,19 @@ def ConvertTaxiData(sourceYellow, sourceGreen, destination):
         StructField('Tolls_Amount', DoubleType(), True),
         StructField('Improvement_Surcharge', DoubleType(), True),
         StructField('Total_Amount', DoubleType(), True),
-        StructField('Congestion_Surcharge', DoubleType(), True)
+        StructField('Congestion_Surcharge', DoubleType(), True),
+        StructField('Airport_Fee', DoubleType(), True)
         ])
     """
 
-    df_source = spark.read.parquet(sourceYellow)
+    if schemaMode == "declared":
+        # airport_fee is read per year (INT for 2019 and FLOAT for 2020+) and upcast to FLOAT, only when included
+        df_source = ReadRawTaxiData(spark, "yellow", sourceYellow)
+    else:
+        # airport_fee: causes issues since the datatype id INT for 2019 and FLOAT for 2020+
+        df_source = ReadRawTaxiDataInferred(spark, sourceYellow) \
+            .drop("airport_fee") \
+            .withColumn("airport_fee", lit(None).cast(DoubleType()))
 
     # Change datatypes (FLOAT to INT)
     df_source = df_source \
@@ -100,9 +141,7 @@ def ConvertTaxiData(sourceYellow, sourceGreen, destination):
         .withColumn("NEW_Rate_Code_Id",col("RatecodeID").cast(IntegerType()))
 
     # Drop columns
-    # airport_fee: causes issues since the datatype id INT for 2019 and FLOAT for 2020+
     df_source = df_source \
-        .drop("airport_fee") \
         .drop("passenger_count") \
         .drop("RatecodeID")  
 
@@ -121,7 +160,8 @@ def ConvertTaxiData(sourceYellow, sourceGreen, destination):
         .withColumnRenamed("tolls_amount", "Tolls_Amount") \
         .withColumnRenamed("improvement_surcharge", "Improvement_Surcharge") \
         .withColumnRenamed("total_amount", "Total_Amount") \
-        .withColumnRenamed("congestion_surcharge", "Congestion_Surcharge")
+        .withColumnRenamed("congestion_surcharge", "Congestion_Surcharge") \
+        .withColumnRenamed("airport_fee", "Airport_Fee")
 
     df_new_column_order = df_rename.select( \
         'Vendor_Id', \
@@ -141,7 +181,8 @@ def ConvertTaxiData(sourceYellow, sourceGreen, destination):
         'Tolls_Amount', \
         'Improvement_Surcharge', \
         'Total_Amount', \
-        'Congestion_Surcharge' \
+        'Congestion_Surcharge', \
+        'Airport_Fee' \
         )
     """
     df_new_column_order = df_rename \
@@ -168,42 +209,19 @@ def ConvertTaxiData(sourceYellow, sourceGreen, destination):
     df_with_partition_cols = df_new_column_order \
         .withColumn("year",  year      (col("Pickup_DateTime"))) \
         .withColumn("month", month     (col("Pickup_DateTime"))) \
-        .filter(year(col("Pickup_DateTime")).isin (2019,2020,2021,2022))
+        .filter(year(col("Pickup_DateTime")).isin(*TRIPS_TABLE_YEARS))
 
-    # Write as Parquet
-    df_with_partition_cols \
-        .repartition(5) \
-        .coalesce(5) \
-        .write \
-        .mode("overwrite") \
-        .partitionBy("year","month") \
-        .parquet(destination + "yellow/trips_table/parquet")
-
-    # Write as CSV
-    df_with_partition_cols \
-        .repartition(5) \
-        .coalesce(5) \
-        .write \
-        .mode("overwrite") \
-        .partitionBy("year","month") \
-        .format("csv") \
-        .option('header',True) \
-        .save(destination + "yellow/trips_table/csv")
+    if not includeAirportFee:
+        # Not in the published yellow tables (nor the external table definitions), the column is not read
+        df_with_partition_cols = df_with_partition_cols.drop("Airport_Fee")
 
-    # Write as JSON
-    df_with_partition_cols \
-        .repartition(5) \
-        .coalesce(5) \
-        .write \
-        .mode("overwrite") \
-        .partitionBy("year","month") \
-        .format("json") \
-        .save(destination + "yellow/trips_table/json")
+    return df_with_partition_cols
 
 
-    ################################################################################################
-    # Green
-    ################################################################################################
+################################################################################################
+# Green
+################################################################################################
+def ReadGreenTaxiData(spark, sourceGreen, schemaMode="declared"):
     # 2021 VendorID,lpep_pickup_datetime,lpep_dropoff_datetime,store_and_fwd_flag,RatecodeID,PULocationID,DOLocationID,passenger_count,trip_distance,fare_amount,extra,mta_tax,tip_amount,tolls_amount,ehail_fee,improvement_surcharge,total_amount,payment_type,trip_type,congestion_surcharge
     # 2020 VendorID,lpep_pickup_datetime,lpep_dropoff_datetime,store_and_fwd_flag,RatecodeID,PULocationID,DOLocationID,passenger_count,trip_distance,fare_amount,extra,mta_tax,tip_amount,tolls_amount,ehail_fee,improvement_surcharge,total_amount,payment_type,trip_type,congestion_surcharge
     # 2019 VendorID,lpep_pickup_datetime,lpep_dropoff_datetime,store_and_fwd_flag,RatecodeID,PULocationID,DOLocationID,passenger_count,trip_distance,fare_amount,extra,mta_tax,tip_amount,tolls_amount,ehail_fee,improvement_surcharge,total_amount,payment_type,trip_type,congestion_surcharge
@@ -256,7 +274,10 @@ def ConvertTaxiData(sourceYellow, sourceGreen, destination):
         ])
     """
 
-    df_source = spark.read.parquet(sourceGreen)
+    if schemaMode == "declared":
+        df_source = ReadRawTaxiData(spark, "green", sourceGreen)
+    else:
+        df_source = ReadRawTaxiDataInferred(spark, sourceGreen)
     
     # Change datatypes (FLOAT to INT)
     df_source = df_source \
@@ -340,136 +361,562 @@ def ConvertTaxiData(sourceYellow, sourceGreen, destination):
     df_with_partition_cols = df_new_column_order \
         .withColumn("year",  year      (col("Pickup_DateTime"))) \
         .withColumn("month", month     (col("Pickup_DateTime"))) \
-        .filter(year(col("Pickup_DateTime")).isin (2019,2020,2021,2022))
+        .filter(year(col("Pickup_DateTime")).isin(*TRIPS_TABLE_YEARS))
+
+    return df_with_partition_cols
 
-    # Write as Parquet
-    df_with_partition_cols \
-        .repartition(5) \
-        .coalesce(5) \
+
+################################################################################################
+# Write the trips table as Parquet, CSV and JSON
+################################################################################################
+def FilterPartitions(df_with_partition_cols, partitions):
+    """Keeps the rows of the given [(year, month)] (a row filter: the raw files read are chosen by GetFilesForPartitions)"""
+    if partitions is None:
+        return df_with_partition_cols
+    partitionKeys = [partitionYear * 100 + partitionMonth for partitionYear, partitionMonth in partitions]
+    return df_with_partition_cols.filter((col("year") * 100 + col("month")).isin(partitionKeys))
+
+
+def ClearPartitions(spark, tablePath, partitions):
+    """Deletes the year=/month= folders of the [(year, month)] partitions in every format of the trips table.
+       A dynamic overwrite only replaces the partitions present in the data, so a partition no raw file has rows in
+       anymore (its file was deleted or replaced) has to be cleared."""
+    for partitionYear, partitionMonth in partitions:
+        for outputFormat in TRIPS_TABLE_FORMATS:
+            partitionPath = tablePath + "/" + outputFormat + "/year=" + str(partitionYear) + "/month=" + str(partitionMonth)
+            if DeletePath(spark, partitionPath):
+                print("ClearPartitions: deleted " + partitionPath)
+
+
+def SizeOutputFiles(spark, df_with_partition_cols, outputSizing, outputFormat):
+    if outputSizing is None:
+        # At most 5 files per year/month
+        return df_with_partition_cols \
+            .repartition(5) \
+            .coalesce(5)
+
+    rowCounts, bytesPerRow, targetFileSizeBytes = outputSizing
+    return RepartitionByTargetFileSize(spark, df_with_partition_cols, ["year","month"],
+                                       rowCounts, bytesPerRow, targetFileSizeBytes, outputFormat)
+
+
+def WriteTripsTableParquet(spark, df_with_partition_cols, tablePath, outputSizing, parquetLayout=None, parquetProfile=None, partitionOverwriteMode="static"):
+    df_sized = SizeOutputFiles(spark, df_with_partition_cols, outputSizing, "parquet")
+    ApplyLayout(df_sized, ["year","month"], parquetLayout) \
         .write \
         .mode("overwrite") \
+        .option("partitionOverwriteMode", partitionOverwriteMode) \
+        .options(**GetParquetWriterOptions(parquetLayout)) \
+        .options(**GetProfileWriterOptions(parquetProfile)) \
         .partitionBy("year","month") \
-        .parquet(destination + "green/trips_table/parquet")
+        .parquet(tablePath + "/parquet")
+
 
-    # Write as CSV
-    df_with_partition_cols \
-        .repartition(5) \
-        .coalesce(5) \
+def WriteTripsTableCSV(spark, df_with_partition_cols, tablePath, outputSizing, partitionOverwriteMode="static"):
+    SizeOutputFiles(spark, df_with_partition_cols, outputSizing, "csv") \
         .write \
         .mode("overwrite") \
+        .option("partitionOverwriteMode", partitionOverwriteMode) \
         .partitionBy("year","month") \
         .format("csv") \
         .option('header',True) \
-        .save(destination + "green/trips_table/csv")
+        .save(tablePath + "/csv")
 
-    # Write as JSON
-    df_with_partition_cols \
-        .repartition(5) \
-        .coalesce(5) \
+
+def WriteTripsTableJSON(spark, df_with_partition_cols, tablePath, outputSizing, partitionOverwriteMode="static"):
+    SizeOutputFiles(spark, df_with_partition_cols, outputSizing, "json") \
         .write \
         .mode("overwrite") \
+        .option("partitionOverwriteMode", partitionOverwriteMode) \
         .partitionBy("year","month") \
         .format("json") \
-        .save(destination + "green/trips_table/json")
-
-
-    ################################################################################################
-    # Create Common Tables 
-    ################################################################################################
-    # Vendor Table
-    vendor_df = spark.createDataFrame(
-        [
-            (1, "Creative Mobile Technologies"), 
-            (2, "VeriFone")
-        ],
-        ["Vendor_Id", "Vendor_Description"] 
-    )        
-
-    vendor_df \
-        .repartition(1) \
-        .coalesce(1) \
-        .write \
-        .mode("overwrite") \
-        .parquet(destination + "vendor_table/")
-
-    # Rate Code Table
-    rate_code_df = spark.createDataFrame(
-        [
-            (1, "Standard rate"), 
-            (2, "JFK"),
-            (3, "Newark"),
-            (4, "Nassau or Westchester"),
-            (5, "Negotiated fare"),
-            (6, "Group ride"),
-        ],
-        ["Rate_Code_Id", "Rate_Code_Description"] 
-    )        
-
-    rate_code_df \
-        .repartition(1) \
-        .coalesce(1) \
-        .write \
-        .mode("overwrite") \
-        .parquet(destination + "rate_code_table/")
-
-    # Payment Type Table
-    payment_type_df = spark.createDataFrame(
-        [
-            (1, "Credit card"), 
-            (2, "Cash"),
-            (3, "No charge"),
-            (4, "Dispute"),
-            (5, "Unknown"),
-            (6, "Voided trip"),
-        ],
-        ["Payment_Type_Id", "Payment_Type_Description"] 
-    )        
-
-    payment_type_df \
-        .repartition(1) \
-        .coalesce(1) \
-        .write \
-        .mode("overwrite") \
-        .parquet(destination + "payment_type_table/")
-
-    # Trip Type Table
-    trip_type_df = spark.createDataFrame(
-        [
-            (1, "Street-hail"),
-            (2, "Dispatch")
-        ],
-        ["Trip_Type_Id", "Trip_Type_Description"] 
-    )        
-
-    trip_type_df \
-        .repartition(1) \
-        .coalesce(1) \
-        .write \
-        .mode("overwrite") \
-        .parquet(destination + "trip_type_table/")
+        .save(tablePath + "/json")
+
+
+def WriteTripsTable(spark, df_with_partition_cols, tablePath, writeMode, jobGroup, sourceBytes, targetFileSizeBytes=None, partitions=None, parquetLayout=None, parquetProfile=None):
+    """Writes the normalized trips to <tablePath>/parquet, /csv and /json.
+       With a targetFileSizeBytes the number of files of each year/month is sized from its row count,
+       otherwise each year/month gets up to 5 files.
+       With partitions [(year, month)] only those partitions are written and replaced (dynamic partition overwrite).
+       The parquetLayout (see parquet_layout.py) sets the row order and row group size of the Parquet files,
+       the parquetProfile (see parquet_writer_profiles.py) the codec, bloom filters and page size.
+       Returns the bytes read from the raw source files and the bytes read by the CSV/JSON writes (Spark input metrics)."""
+    sc = spark.sparkContext
+    df_with_partition_cols = FilterPartitions(df_with_partition_cols, partitions)
+
+    # Dynamic: an overwrite only replaces the year=/month= partitions present in the data being written.
+    # A write option and not the session conf, so concurrent pipelines do not change each other's mode.
+    partitionOverwriteMode = "static" if partitions is None else "dynamic"
+
+    if writeMode == "persist":
+        # DISK_ONLY: the workers local disks hold the normalized data, not the executor memory
+        # The count fills the cache, this is the only scan of the raw files
+        df_with_partition_cols.persist(StorageLevel.DISK_ONLY)
+        sc.setJobGroup(jobGroup + "-source", "Persist " + tablePath)
+        print("WriteTripsTable: rows persisted: ", df_with_partition_cols.count())
+
+    outputSizing = None
+    if targetFileSizeBytes is not None:
+        # Only reads Pickup_DateTime from the raw files (or the cache)
+        sc.setJobGroup(jobGroup + "-sizing", "Row counts " + tablePath)
+        rowCounts = GetRowCountsByPartition(df_with_partition_cols, ["year","month"])
+        bytesPerRow = sourceBytes / max(1, sum(rowCounts.values()))
+        outputSizing = (rowCounts, bytesPerRow, targetFileSizeBytes)
+
+    sc.setJobGroup(jobGroup + "-parquet", "Write " + tablePath + "/parquet")
+    WriteTripsTableParquet(spark, df_with_partition_cols, tablePath, outputSizing, parquetLayout, parquetProfile, partitionOverwriteMode)
+
+    # Row count, size and min/max of every Parquet file in <tablePath>/parquet/_file_index.json
+    sc.setJobGroup(jobGroup + "-index", "File index " + tablePath + "/parquet")
+    WriteFileIndex(spark, tablePath + "/parquet", partitions)
+
+    if writeMode == "derive":
+        # Partition discovery adds year and month back from the year=/month= directories
+        df_formats = FilterPartitions(spark.read.parquet(tablePath + "/parquet"), partitions)
+    else:
+        df_formats = df_with_partition_cols
+
+    sc.setJobGroup(jobGroup + "-csv", "Write " + tablePath + "/csv")
+    WriteTripsTableCSV(spark, df_formats, tablePath, outputSizing, partitionOverwriteMode)
+
+    sc.setJobGroup(jobGroup + "-json", "Write " + tablePath + "/json")
+    WriteTripsTableJSON(spark, df_formats, tablePath, outputSizing, partitionOverwriteMode)
+
+    sc.setLocalProperty("spark.jobGroup.id", None)
+
+    if writeMode == "persist":
+        df_with_partition_cols.unpersist()
+
+    # rescan:  every write goes back to the raw files
+    # persist: the count reads the raw files, the writes read the local disk cache (Spark counts cache reads
+    #          as input as well, newer Spark versions also read the cache back once inside the count job)
+    # derive:  the Parquet write reads the raw files, the CSV/JSON writes read the processed Parquet
+    if writeMode == "persist":
+        sourceBytesRead = GetInputBytesForJobGroup(spark, jobGroup + "-source")
+    else:
+        sourceBytesRead = GetInputBytesForJobGroup(spark, jobGroup + "-parquet")
+
+    formatBytesRead = None
+    if sourceBytesRead is not None:
+        formatBytesRead = GetInputBytesForJobGroup(spark, jobGroup + "-csv") + \
+                          GetInputBytesForJobGroup(spark, jobGroup + "-json")
+        if writeMode == "rescan":
+            sourceBytesRead += formatBytesRead
+
+    return sourceBytesRead, formatBytesRead
+
+
+################################################################################################
+# Create Common Tables 
+################################################################################################
+def WriteLookupTables(spark, destination):
+    # Vendor, Rate Code, Payment Type and Trip Type tables (see taxi_schema_registry.py)
+    for tableName, (columns, rows) in LOOKUP_TABLES.items():
+        spark.createDataFrame(rows, columns) \
+            .repartition(1) \
+            .coalesce(1) \
+            .write \
+            .mode("overwrite") \
+            .parquet(destination + tableName + "/")
+
+
+def AddLookupDescriptions(spark, df_with_partition_cols):
+    """Denormalized trips: adds the description of every lookup table the trips reference (Vendor_Description, ...)
+       so the queries do not join the lookup tables back in.  The lookup tables have a handful of rows and are
+       broadcast to the tasks (no shuffle of the trips).  A description only has a few distinct values per row
+       group, Parquet stores it dictionary encoded (a few bytes per row group plus the small ids).
+       Ids without a description (e.g. Rate_Code_Id 99) get a null description."""
+    partitionCols = ["year", "month"]
+    tripColumns = [columnName for columnName in df_with_partition_cols.columns if columnName not in partitionCols]
+    df_denormalized = df_with_partition_cols
+    descriptionColumns = []
+    for tableName, (columns, rows) in LOOKUP_TABLES.items():
+        tripColumn = LOOKUP_TABLE_TRIP_COLUMNS[tableName]
+        if tripColumn not in tripColumns:
+            continue
+        keyColumn, descriptionColumn = columns
+        df_lookup = spark.createDataFrame(rows, columns).withColumnRenamed(keyColumn, "_lookup_key")
+        df_denormalized = df_denormalized \
+            .join(broadcast(df_lookup), col(tripColumn) == col("_lookup_key"), "left") \
+            .drop("_lookup_key")
+        descriptionColumns.append(descriptionColumn)
+
+    return df_denormalized.select(*(tripColumns + descriptionColumns + partitionCols))
+
+
+def GetPartitionsByFile(spark, readTaxiData, paths, schemaMode):
+    """Returns { path: [(year, month)] }, the partitions of the trips table that have rows of each raw file.
+       One Spark job that only reads Pickup_DateTime (a TLC file also holds a few trips of other months)."""
+    # input_file_name returns file:///tmp/..., a listing file:/tmp/...
+    pathsByName = {re.sub(r"^[a-z]+:/*", "", path): path for path in paths}
+    partitionsByFile = {path: [] for path in paths}
+    if len(paths) == 0:
+        return partitionsByFile
+    df_partitions = readTaxiData(spark, sorted(paths), schemaMode) \
+        .select(input_file_name().alias("path"), "year", "month") \
+        .distinct()
+    for row in df_partitions.collect():
+        partitionsByFile[pathsByName[re.sub(r"^[a-z]+:/*", "", row["path"])]].append((row["year"], row["month"]))
+    return partitionsByFile
+
+
+def GetRawFilePartitions(spark, readTaxiData, schemaMode, currentFiles, manifestFiles, manifestPartitions):
+    """Returns { path: [(year, month)] } for the current raw files: from the manifest for the unchanged files whose
+       partitions it records, read from the others (new, changed, or converted before the manifest had partitions)"""
+    partitionsByFile = {path: manifestPartitions[path] for path in currentFiles
+                        if manifestFiles.get(path) == currentFiles[path] and path in manifestPartitions}
+    filesToRead = sorted(path for path in currentFiles if path not in partitionsByFile)
+    print("GetRawFilePartitions: raw files read for their partitions: ", len(filesToRead), " of ", len(currentFiles))
+    partitionsByFile.update(GetPartitionsByFile(spark, readTaxiData, filesToRead, schemaMode))
+    return partitionsByFile
+
+
+def ConvertTripsTable(spark, color, source, readTaxiData, destination, writeMode, schemaMode, incremental,
+                      targetFileSizeBytes, parquetLayout, parquetProfile, denormalize=False):
+    """Converts the raw files of one color to its trips table (the yellow or green pipeline)"""
+    # The manifest records the raw files (path, size, generation) that have been converted
+    manifestPath = destination + "_manifests/" + color + "_raw_files.json"
+    tablePath = destination + color + "/trips_table"
+    currentFiles = ListRawFiles(spark, source)
+    filesToConvert = sorted(currentFiles)
+    partitions = None
+    partitionsByFile = None
+
+    if incremental:
+        manifestFiles = ReadManifest(spark, manifestPath)
+        manifestPartitions = ReadManifestPartitions(spark, manifestPath)
+        changedFiles = GetNewOrChangedFiles(currentFiles, manifestFiles)
+        deletedFiles = GetDeletedFiles(currentFiles, manifestFiles)
+        print("ConvertTaxiData: " + color + " new or changed raw files: ", len(changedFiles), " of ", len(currentFiles),
+              " deleted raw files: ", len(deletedFiles))
+        if len(changedFiles) == 0 and len(deletedFiles) == 0:
+            return
+        partitionsByFile = GetRawFilePartitions(spark, readTaxiData, schemaMode, currentFiles, manifestFiles, manifestPartitions)
+        if any(path in manifestFiles and path not in manifestPartitions for path in changedFiles + deletedFiles):
+            # The partitions a changed or deleted file had rows in are not known
+            print("ConvertTaxiData: " + color + " a changed or deleted raw file has no partitions in the manifest, converting all the files")
+        else:
+            # The partitions of the rows of the changed files, now and before they changed, and of the deleted files,
+            # rewritten with the rows of every raw file that has rows in them (a file also holds a few trips of other months)
+            partitions = set()
+            for path in changedFiles:
+                partitions.update(partitionsByFile[path])
+                partitions.update(manifestPartitions.get(path, []))
+            for path in deletedFiles:
+                partitions.update(manifestPartitions[path])
+            partitions = sorted(partitions)
+            filesToConvert = GetFilesForPartitions(partitionsByFile, partitions)
+
+            # The partitions no current raw file has rows in are not in the data written, cleared instead
+            currentPartitions = set()
+            for filePartitions in partitionsByFile.values():
+                currentPartitions.update(filePartitions)
+            emptyPartitions = [partition for partition in partitions if partition not in currentPartitions]
+            print("ConvertTaxiData: " + color + " partitions to rewrite: ", partitions, " raw files read: ", len(filesToConvert),
+                  " partitions to clear: ", emptyPartitions)
+            ClearPartitions(spark, tablePath, emptyPartitions)
+            if len(filesToConvert) == 0:
+                WriteFileIndex(spark, tablePath + "/parquet", emptyPartitions)
+                WriteManifest(spark, manifestPath, currentFiles, partitionsByFile)
+                return
+
+    sourceBytes = sum(currentFiles[path]["size"] for path in filesToConvert)
+
+    # Planning: listing the files, getting the schema (footer reads when inferred) and building the physical plan
+    startTime = time.time()
+    df_with_partition_cols = readTaxiData(spark, filesToConvert, schemaMode)
+    if denormalize:
+        df_with_partition_cols = AddLookupDescriptions(spark, df_with_partition_cols)
+    df_with_partition_cols._jdf.queryExecution().executedPlan()
+    print("ConvertTaxiData: " + color + " planning seconds: ", round(time.time() - startTime, 2))
+
+    sourceBytesRead, formatBytesRead = WriteTripsTable(spark, df_with_partition_cols, tablePath,
+                                                       writeMode, color, sourceBytes, targetFileSizeBytes, partitions,
+                                                       parquetLayout, parquetProfile)
+
+    # With a single pass the raw bytes read are close to the raw bytes on storage (one scan per color)
+    print("ConvertTaxiData: " + color + " raw source bytes on storage: ", sourceBytes)
+    print("ConvertTaxiData: " + color + " raw source bytes read:       ", sourceBytesRead)
+    print("ConvertTaxiData: " + color + " CSV/JSON write bytes read:   ", formatBytesRead)
+
+    # Only after all the formats are written, so a failed run converts the same files again
+    WriteManifest(spark, manifestPath, currentFiles, partitionsByFile)
+
+
+def WriteTripsTableUnit(spark, df_unit, stagingPath, outputFormat, outputSizing, parquetLayout=None, parquetProfile=None):
+    """Writes the rows of one year/month to a folder, without the year/month columns (the folder is the partition)"""
+    df_sized = SizeOutputFiles(spark, df_unit, outputSizing, outputFormat)
+    if outputFormat == "parquet":
+        df_sized = ApplyLayout(df_sized, ["year","month"], parquetLayout)
+    writer = df_sized.drop("year","month").write.mode("overwrite")
+
+    if outputFormat == "parquet":
+        writer \
+            .options(**GetParquetWriterOptions(parquetLayout)) \
+            .options(**GetProfileWriterOptions(parquetProfile)) \
+            .parquet(stagingPath)
+    elif outputFormat == "csv":
+        writer.option('header',True).csv(stagingPath)
+    else:
+        writer.json(stagingPath)
+
+
+def ConvertTripsTableResumable(spark, color, source, readTaxiData, destination, schemaMode, targetFileSizeBytes,
+                               parquetLayout, parquetProfile, denormalize=False, includeAirportFee=False):
+    """Converts the raw files of one color in (format, year, month) units (see resumable_units.py).
+       Units committed by a previous run from the same raw files with the same output options are skipped, so a
+       retried run only pays for the units that did not finish.  Each Parquet unit reads the raw files that have rows in its month (the file of the
+       month and the few trips of that month in the files of the next ones), the CSV/JSON units are derived from the
+       committed Parquet unit."""
+    sc = spark.sparkContext
+    tablePath = destination + color + "/trips_table"
+    fileIndexMarkerPath = GetFileIndexMarkerPath(destination, color)
+    rawFiles = ListRawFiles(spark, source)
+
+    # Only the raw files that are new or changed since the last run are read for their partitions
+    rawFilePartitionsPath = GetRawFilePartitionsPath(destination, color)
+    partitionsByFile = GetRawFilePartitions(spark, readTaxiData, schemaMode, rawFiles,
+                                            ReadManifest(spark, rawFilePartitionsPath), ReadManifestPartitions(spark, rawFilePartitionsPath))
+    WriteManifest(spark, rawFilePartitionsPath, rawFiles, partitionsByFile)
+    filesByPartition = GroupRawFilesByPartition(rawFiles, partitionsByFile)
+    unitOptions = GetUnitOptions(parquetLayout, parquetProfile, denormalize, includeAirportFee, targetFileSizeBytes, schemaMode)
+
+    committedUnits = 0
+    skippedUnits = 0
+    for (unitYear, unitMonth), sourceFiles in sorted(filesByPartition.items()):
+        if unitYear not in TRIPS_TABLE_YEARS:
+            continue
+        sourceBytes = sum(fileInfo["size"] for fileInfo in sourceFiles.values())
+        sourceRowCounts = None
+        for outputFormat in TRIPS_TABLE_FORMATS:
+            stagingPath, partitionPath, markerPath = GetUnitPaths(destination, color, outputFormat, unitYear, unitMonth)
+            if IsUnitCommitted(spark, markerPath, sourceFiles, unitOptions):
+                skippedUnits += 1
+                continue
+
+            sc.setJobGroup("{}-{}-{}-{:02d}".format(color, outputFormat, unitYear, unitMonth), "Write " + partitionPath)
+            df_source = readTaxiData(spark, sorted(sourceFiles), schemaMode)
+            outputSizing = None
+            if targetFileSizeBytes is not None:
+                if sourceRowCounts is None:
+                    # The source files also hold rows of other months: the bytes per row are over all their rows
+                    sourceRowCounts = GetRowCountsByPartition(df_source, ["year","month"])
+                outputSizing = ({(unitYear, unitMonth): sourceRowCounts.get((unitYear, unitMonth), 0)},
+                                sourceBytes / max(1, sum(sourceRowCounts.values())), targetFileSizeBytes)
+            if outputFormat == "parquet":
+                df_unit = FilterPartitions(df_source, [(unitYear, unitMonth)])
+                if denormalize:
+                    df_unit = AddLookupDescriptions(spark, df_unit)
+                # The file index is rebuilt once all the Parquet units are committed
+                DeletePath(spark, fileIndexMarkerPath)
+            else:
+                df_unit = spark.read.parquet(GetUnitPaths(destination, color, "parquet", unitYear, unitMonth)[1]) \
+                    .withColumn("year", lit(unitYear)) \
+                    .withColumn("month", lit(unitMonth))
+
+            PrepareUnit(spark, stagingPath)
+            WriteTripsTableUnit(spark, df_unit, stagingPath, outputFormat, outputSizing, parquetLayout, parquetProfile)
+            CommitUnit(spark, stagingPath, partitionPath, markerPath, sourceFiles, unitOptions)
+            committedUnits += 1
+            print("ConvertTaxiData: committed unit " + color + " " + outputFormat + " " + str(unitYear) + "-" + str(unitMonth))
+
+    if not PathExists(spark, fileIndexMarkerPath):
+        sc.setJobGroup(color + "-index", "File index " + tablePath + "/parquet")
+        WriteFileIndex(spark, tablePath + "/parquet")
+        WriteTextFile(spark, fileIndexMarkerPath, "{}")
+    sc.setLocalProperty("spark.jobGroup.id", None)
+
+    # The empty year= folders left by the moves
+    DeletePath(spark, destination + "_staging/" + color)
+
+    print("ConvertTaxiData: " + color + " units committed: ", committedUnits, " units already committed (skipped): ", skippedUnits)
+
+
+def RunPipeline(spark, pipelineName, pipeline, *args):
+    """Runs a pipeline with its Spark jobs in the FAIR scheduler pool of the same name, returns the wall time.
+       Scheduler pools are local properties of the calling thread (PySpark pinned thread mode, the default since Spark 3.2)."""
+    sc = spark.sparkContext
+    sc.setLocalProperty("spark.scheduler.pool", pipelineName)
+    startTime = time.time()
+    try:
+        pipeline(spark, *args)
+    except Exception as error:
+        # A raw file that does not match its declared schema: name the file and the column
+        schemaError = ExplainRawSchemaError(error)
+        if schemaError is not None:
+            raise schemaError from error
+        raise
+    finally:
+        sc.setLocalProperty("spark.scheduler.pool", None)
+    wallSeconds = time.time() - startTime
+    print("ConvertTaxiData: pipeline " + pipelineName + " wall seconds: ", round(wallSeconds, 2))
+    return wallSeconds
+
+
+def ChooseEngine(sourceYellow, sourceGreen, incremental, arrowMaxSourceMB):
+    """Returns arrow for small inputs, spark otherwise (or when pyarrow is not installed)"""
+    if incremental:
+        # The raw file manifest is Spark (Hadoop FileSystem) based
+        return "spark"
+    try:
+        from arrow_taxi_engine import GetSourceBytes
+    except ImportError:
+        print("ChooseEngine: pyarrow is not installed, using spark")
+        return "spark"
+
+    sourceBytes = GetSourceBytes(sourceYellow) + GetSourceBytes(sourceGreen)
+    engine = "arrow" if sourceBytes <= arrowMaxSourceMB * 1024 * 1024 else "spark"
+    print("ChooseEngine: raw source bytes: ", sourceBytes, " arrow max (MB): ", arrowMaxSourceMB, " engine: ", engine)
+    return engine
+
+
+def ConvertTaxiData(sourceYellow, sourceGreen, destination, writeMode="derive", targetFileSizeMB=None, schemaMode="declared", incremental=False,
+                    layout="none", layoutColumns=None, rowGroupSizeMB=None, parquetProfile="default", executionMode="sequential",
+                    engine="spark", arrowMaxSourceMB=DEFAULT_ARROW_MAX_SOURCE_MB, metricsPath=None, resumable=False,
+                    denormalize=False, includeAirportFee=False):
+    print("ConvertTaxiData: sourceYellow: ",sourceYellow)
+    print("ConvertTaxiData: sourceGreen:  ",sourceGreen)
+    print("ConvertTaxiData: destination:  ",destination)
+    print("ConvertTaxiData: writeMode:    ",writeMode)
+    print("ConvertTaxiData: targetFileSizeMB: ",targetFileSizeMB)
+    print("ConvertTaxiData: schemaMode:   ",schemaMode)
+    print("ConvertTaxiData: incremental:  ",incremental)
+    print("ConvertTaxiData: layout:       ",layout, layoutColumns)
+    print("ConvertTaxiData: rowGroupSizeMB: ",rowGroupSizeMB)
+    print("ConvertTaxiData: parquetProfile: ",parquetProfile)
+    print("ConvertTaxiData: executionMode: ",executionMode)
+    print("ConvertTaxiData: engine:       ",engine)
+    print("ConvertTaxiData: metricsPath:  ",metricsPath)
+    print("ConvertTaxiData: resumable:    ",resumable)
+    print("ConvertTaxiData: denormalize:  ",denormalize)
+    print("ConvertTaxiData: includeAirportFee: ",includeAirportFee)
+
+    if resumable and incremental:
+        raise ValueError("ConvertTaxiData: --resumable and --incremental cannot be combined (resumable skips the units of unchanged raw files)")
+
+    if engine == "auto":
+        engine = ChooseEngine(sourceYellow, sourceGreen, incremental, arrowMaxSourceMB)
+    if engine == "arrow":
+        if incremental or resumable or denormalize or includeAirportFee:
+            raise ValueError("ConvertTaxiData: --incremental, --resumable, --denormalize and --include-airport-fee are only supported by the spark engine")
+        # The Spark only options (write mode, file sizing, layout, profile, execution mode, metrics report) do not apply
+        from arrow_taxi_engine import ConvertTaxiDataArrow
+        ConvertTaxiDataArrow(sourceYellow, sourceGreen, destination)
+        return
+
+    targetFileSizeBytes = None
+    if targetFileSizeMB is not None:
+        targetFileSizeBytes = targetFileSizeMB * 1024 * 1024
+
+    # FAIR: the jobs of the concurrent pipelines share the executors instead of running first in, first out
+    spark = SparkSession \
+        .builder \
+        .appName("ConvertTaxiData") \
+        .config("spark.scheduler.mode", "FAIR" if executionMode == "concurrent" else "FIFO") \
+        .getOrCreate()
+
+    parquetLayout = GetParquetLayout(layout, layoutColumns, rowGroupSizeMB)
+    ConfigureParquetLayout(spark, parquetLayout)
+
+    pipelines = []
+    for color, source, readTaxiData in [("yellow", sourceYellow, partial(ReadYellowTaxiData, includeAirportFee=includeAirportFee)),
+                                        ("green",  sourceGreen,  ReadGreenTaxiData)]:
+        if resumable:
+            # The CSV/JSON units are always derived from the Parquet units (--write-mode does not apply)
+            pipelines.append((color, ConvertTripsTableResumable, (color, source, readTaxiData, destination, schemaMode,
+                                                                  targetFileSizeBytes, parquetLayout, parquetProfile, denormalize,
+                                                                  includeAirportFee and color == "yellow")))
+        else:
+            pipelines.append((color, ConvertTripsTable, (color, source, readTaxiData, destination, writeMode, schemaMode, incremental,
+                                                         targetFileSizeBytes, parquetLayout, parquetProfile, denormalize)))
+    pipelines.append(("lookup", WriteLookupTables, (destination,)))
+
+    startTime = time.time()
+    if executionMode == "concurrent":
+        with ThreadPoolExecutor(max_workers=len(pipelines)) as executor:
+            futures = [executor.submit(RunPipeline, spark, pipelineName, pipeline, *args) for pipelineName, pipeline, args in pipelines]
+            # Raises the error of a failed pipeline (after the others have finished)
+            pipelineSeconds = [future.result() for future in futures]
+    else:
+        pipelineSeconds = [RunPipeline(spark, pipelineName, pipeline, *args) for pipelineName, pipeline, args in pipelines]
+
+    # Sequential: the total is the sum of the pipelines, concurrent: close to the slowest pipeline
+    print("ConvertTaxiData: pipelines wall seconds (sum): ", round(sum(pipelineSeconds), 2))
+    print("ConvertTaxiData: total wall seconds:           ", round(time.time() - startTime, 2))
+
+    report = None
+    if metricsPath is not None:
+        report = WriteMetricsReport(spark, metricsPath, "ConvertTaxiData", {
+            "sourceYellow": sourceYellow, "sourceGreen": sourceGreen, "destination": destination, "writeMode": writeMode,
+            "targetFileSizeMB": targetFileSizeMB, "schemaMode": schemaMode, "incremental": incremental, "layout": layout,
+            "layoutColumns": layoutColumns, "rowGroupSizeMB": rowGroupSizeMB, "parquetProfile": parquetProfile,
+            "executionMode": executionMode, "resumable": resumable, "denormalize": denormalize, "includeAirportFee": includeAirportFee})
 
     spark.stop()
+    return report
 
 
 # Main entry point
 # convert_taxi_to_parquet gs://big-query-demo-09/test-taxi/yellow gs://big-query-demo-09/test-taxi/green gs://big-query-demo-09/test-taxi-output
+# convert_taxi_to_parquet gs://big-query-demo-09/test-taxi/yellow gs://big-query-demo-09/test-taxi/green gs://big-query-demo-09/test-taxi-output --write-mode persist --target-file-size-mb 256
+# convert_taxi_to_parquet gs://big-query-demo-09/test-taxi/yellow gs://big-query-demo-09/test-taxi/green gs://big-query-demo-09/test-taxi-output --incremental
+# convert_taxi_to_parquet gs://big-query-demo-09/test-taxi/yellow gs://big-query-demo-09/test-taxi/green gs://big-query-demo-09/test-taxi-output --layout zorder --layout-columns PULocationID,DOLocationID
+# convert_taxi_to_parquet gs://big-query-demo-09/test-taxi/yellow gs://big-query-demo-09/test-taxi/green gs://big-query-demo-09/test-taxi-output --parquet-profile zstd-lookup
+# convert_taxi_to_parquet gs://big-query-demo-09/test-taxi/yellow gs://big-query-demo-09/test-taxi/green gs://big-query-demo-09/test-taxi-output --execution-mode concurrent
+# convert_taxi_to_parquet gs://big-query-demo-09/test-taxi/yellow/2022/*.parquet gs://big-query-demo-09/test-taxi/green/2022/*.parquet gs://big-query-demo-09/test-taxi-output --engine auto
+# convert_taxi_to_parquet gs://big-query-demo-09/test-taxi/yellow/*/*.parquet gs://big-query-demo-09/test-taxi/green/*/*.parquet gs://big-query-demo-09/test-taxi-output --resumable
+# convert_taxi_to_parquet gs://big-query-demo-09/test-taxi/yellow gs://big-query-demo-09/test-taxi/green gs://big-query-demo-09/test-taxi-output --denormalize
+# convert_taxi_to_parquet gs://big-query-demo-09/test-taxi/yellow gs://big-query-demo-09/test-taxi/green gs://big-query-demo-09/test-taxi-output --metrics-path gs://big-query-demo-09/job-metrics/
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: convert_taxi_to_parquet sourceYellow sourceGreen destination")
-        sys.exit(-1)
-
-    sourceYellow = sys.argv[1]
-    sourceGreen  = sys.argv[2]
-    destination  = sys.argv[3]
+    parser = argparse.ArgumentParser(prog="convert_taxi_to_parquet")
+    parser.add_argument("sourceYellow")
+    parser.add_argument("sourceGreen")
+    parser.add_argument("destination")
+    parser.add_argument("--write-mode", dest="writeMode", choices=WRITE_MODES, default="derive",
+                        help="How the CSV/JSON copies are produced (default: derive them from the Parquet output)")
+    parser.add_argument("--schema-mode", dest="schemaMode", choices=SCHEMA_MODES, default="declared",
+                        help="Read the raw files with the declared schemas or infer the schema (default: declared)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only convert the raw files that are new or changed since the last run (see the _manifests folder)")
+    parser.add_argument("--resumable", action="store_true",
+                        help="Convert in (color, format, year, month) units committed one by one, a rerun skips the committed units (see the _commits folder)")
+    parser.add_argument("--layout", choices=LAYOUTS, default="none",
+                        help="Row order of the Parquet files within each year/month, for row group skipping (default: none)")
+    parser.add_argument("--layout-columns", dest="layoutColumns", default=None, type=lambda value: value.split(","),
+                        help="Comma separated sort or Z-order columns (default: Pickup_DateTime,PULocationID for sort, PULocationID,DOLocationID for zorder)")
+    parser.add_argument("--row-group-size-mb", dest="rowGroupSizeMB", type=int, default=None,
+                        help="Parquet row group size (default: 32 with a layout, otherwise the Parquet default of 128)")
+    parser.add_argument("--parquet-profile", dest="parquetProfile", choices=sorted(PROFILES), default="default",
+                        help="Parquet writer profile: codec, bloom filters, page size (default: Spark defaults)")
+    parser.add_argument("--execution-mode", dest="executionMode", choices=EXECUTION_MODES, default="sequential",
+                        help="Run the yellow, green and lookup table pipelines one after the other or concurrently (default: sequential)")
+    parser.add_argument("--engine", choices=ENGINES, default="spark",
+                        help="Convert with Spark, with pyarrow on a single machine, or pick by the raw size (default: spark)")
+    parser.add_argument("--arrow-max-source-mb", dest="arrowMaxSourceMB", type=int, default=DEFAULT_ARROW_MAX_SOURCE_MB,
+                        help="Largest raw size (yellow + green) converted with pyarrow by --engine auto (default: 512)")
+    parser.add_argument("--target-file-size-mb", dest="targetFileSizeMB", type=int, default=None,
+                        help="Size the files of each year/month to this size (default: up to 5 files per year/month)")
+    parser.add_argument("--denormalize", action="store_true",
+                        help="Add the lookup table descriptions (Vendor_Description, ...) to the trips tables, a run that turns it on or off must convert all the files")
+    parser.add_argument("--include-airport-fee", dest="includeAirportFee", action="store_true",
+                        help="Add Airport_Fee to the yellow trips tables (not declared by the external tables of sp_create_taxi_external_tables.sql, "
+                             "a run that turns it on or off must convert all the files)")
+    parser.add_argument("--metrics-path", dest="metricsPath", default=None,
+                        help="Folder (or .json file) of the metrics report of the run, read from the Spark REST API at the end (default: no report)")
+    args = parser.parse_args()
 
     print ("BEGIN: Main")
-    ConvertTaxiData(sourceYellow, sourceGreen, destination)
+    ConvertTaxiData(args.sourceYellow, args.sourceGreen, args.destination, args.writeMode, args.targetFileSizeMB, args.schemaMode, args.incremental,
+                    args.layout, args.layoutColumns, args.rowGroupSizeMB, args.parquetProfile,
+                    args.executionMode, args.engine, args.arrowMaxSourceMB, args.metricsPath, args.resumable, args.denormalize,
+                    args.includeAirportFee)
     print ("END: Main")
 
 # Sample run 
 # gcloud dataproc jobs submit pyspark  \
 #    --cluster "testcluster" \
 #    --region="us-west2" \
+#    --py-files gs://big-query-demo-09/pyspark-code/hadoop_fs_utils.py,gs://big-query-demo-09/pyspark-code/spark_job_metrics.py,gs://big-query-demo-09/pyspark-code/output_file_sizing.py,gs://big-query-demo-09/pyspark-code/taxi_schema_registry.py,gs://big-query-demo-09/pyspark-code/raw_file_manifest.py,gs://big-query-demo-09/pyspark-code/parquet_layout.py,gs://big-query-demo-09/pyspark-code/parquet_writer_profiles.py,gs://big-query-demo-09/pyspark-code/arrow_taxi_engine.py,gs://big-query-demo-09/pyspark-code/parquet_file_index.py,gs://big-query-demo-09/pyspark-code/spark_metrics_report.py,gs://big-query-demo-09/pyspark-code/resumable_units.py \
 #    gs://big-query-demo-09/pyspark-code/convert_taxi_to_parquet.py \
 #    -- gs://big-query-demo-09/test-taxi/yellow/*/*.parquet \
 #       gs://big-query-demo-09/test-taxi/green/*/*.parquet \
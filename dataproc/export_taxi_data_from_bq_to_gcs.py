@@ -20,96 +20,545 @@
 #          This uses dataproc serverless spark
 #          The data is exported partitioned by each minute (inefficient on purpose)
 #          The goal is to generate a lot of small files (antipattern) to demo BQ performance on small files
+#          Each month is a query that BigQuery materializes in a temporary table (the driver waits, the executors
+#          are idle) before Spark reads and writes it.  --max-concurrent-exports N exports N months at the same time
+#          from a thread pool, so the materialization of a month overlaps the writes of the others.
+#          --read-mode table: no query, one read of the table through the BigQuery Storage Read API with the
+#          PartitionDate range of the years and the columns pushed down (only those partitions and columns are
+#          read, the EXTRACT of the queries is not a partition filter), then one write partitioned by
+#          year/month/day/hour/minute.  --read-streams sets the read parallelism (one Spark partition per stream).
+#          --partition-granularity adaptive: each month is partitioned by day/hour/minute, day/hour or day, the finest
+#          whose median file is at least --min-file-size-mb, estimated from the row counts of a sample of the month
+#          (one file per folder, a month without sampled rows is partitioned by day).  The sample is one more scan, of
+#          the Pickup_DateTime column only; in table mode each granularity is then one write that reads only the
+#          PartitionDate partitions of its months, so the other columns of a month are still read once.
+#          The layout of each month is recorded in _partition_layout.json for the readers:
+#            { "months": { "2021-01": { "granularity": "hour", "partitionColumns": ["day", "hour"], ... } } }
+#          Resume: an exported month gets a year=/month=/_EXPORTED.json marker with its row count and the row count and
+#          last modified time of its PartitionDate partition (INFORMATION_SCHEMA.PARTITIONS).  A rerun skips the months
+#          whose marker matches the source partition (and granularity), so a failed batch only redoes the missing
+#          months.  --force exports every month.
+#          --source-parquet: reads a Parquet copy of taxi_trips instead of BigQuery (ParquetSource, same reads as
+#          BigQuerySource), to run and benchmark the write side without a BigQuery project.
+#          --shuffle-by-partition: the rows are shuffled by their folder (year/month/day/hour/minute) before the write, so
+#          each folder is written by one task: at most one file per folder instead of one per task that has rows of the
+#          minute (the read partitions are not sorted by Pickup_DateTime, every task touches most of the minutes).
+#          A folder over --max-file-size-mb is rolled into files of about that size (maxRecordsPerFile estimated with
+#          --bytes-per-row).  Adaptive months are always written this way.
 
 from pyspark.sql.dataframe import DataFrame
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import col, year, month, dayofmonth, hour, minute
+from pyspark.sql.functions import col, date_format, year, month, dayofmonth, hour, minute
 from pyspark.sql.types import StructType, StructField, StringType, IntegerType, DoubleType, TimestampType
+from pyspark.sql.utils import AnalysisException
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import argparse
 import time
 import sys
 
-
-def ExportTaxiData(project_id, taxi_dataset_id, temporaryGcsBucket, destination):
+from hadoop_fs_utils import DeletePath, GetFileSystem, PathExists, ReadTextFile, WriteTextFile
+from spark_metrics_report import WriteMetricsReport
+import json
+
+EXPORT_YEARS = [2021, 2020, 2019]
+
+# query: a query per month (materialized in a temporary table), table: one read of the table (Storage Read API)
+READ_MODES = ["query", "table"]
+
+# Columns read by --read-mode table (the columns of the query's SELECT *)
+TAXI_TRIPS_COLUMNS = ["TaxiCompany", "Vendor_Id", "Pickup_DateTime", "Dropoff_DateTime", "Store_And_Forward", "Rate_Code_Id",
+                      "PULocationID", "DOLocationID", "Passenger_Count", "Trip_Distance", "Fare_Amount", "Surcharge", "MTA_Tax",
+                      "Tip_Amount", "Tolls_Amount", "Improvement_Surcharge", "Total_Amount", "Payment_Type_Id",
+                      "Congestion_Surcharge", "Trip_Type", "Ehail_Fee", "PartitionDate"]
+
+# Folders below year=/month= of each granularity, finest first
+PARTITION_GRANULARITIES = {
+    "minute": ["day", "hour", "minute"],
+    "hour":   ["day", "hour"],
+    "day":    ["day"]
+}
+# minute: the original (a lot of small files on purpose), adaptive: chosen per month
+GRANULARITY_MODES = ["minute", "hour", "day", "adaptive"]
+
+DEFAULT_MIN_FILE_SIZE_MB = 16
+
+# Snappy Parquet bytes of a taxi trip row, turns the sampled row counts into file sizes
+DEFAULT_PARQUET_BYTES_PER_ROW = 30
+
+# Share of the rows of a month counted (by minute) to choose its granularity
+DEFAULT_LAYOUT_SAMPLE_FRACTION = 0.1
+
+# Layout of each month, next to the year= folders
+PARTITION_LAYOUT_FILE = "_partition_layout.json"
+
+# Marker of an exported month, in its month= folder (deleted with the folder when the month is exported again)
+EXPORT_MARKER_FILE = "_EXPORTED.json"
+
+# --shuffle-by-partition: files of a folder are rolled at about this size (a folder is written by a single task)
+DEFAULT_MAX_FILE_SIZE_MB = 256
+
+# Months exported at the same time: 1 is the original one month after the other.  Each month holds a BigQuery
+# query (temporary table) and a Spark write, more than a few mostly add pressure on the BigQuery slots.
+DEFAULT_MAX_CONCURRENT_EXPORTS = 1
+
+
+def GetTablePath(destination):
+    return destination + "/processed/taxi-trips-query-acceleration/"
+
+
+def GetMonthPath(tablePath, monthName):
+    """Folder of a month ("2021-01": year=2021/month=1)"""
+    return tablePath + "year=" + str(int(monthName[:4])) + "/month=" + str(int(monthName[5:]))
+
+
+################################################################################################
+# Sources: the same reads from BigQuery or, to run and benchmark the export without BigQuery, from a
+# local (or gs://) Parquet copy of taxi_trips
+################################################################################################
+class BigQuerySource:
+    """The taxi_trips table of BigQuery (spark-bigquery connector)"""
+
+    def __init__(self, project_id, taxi_dataset_id, temporaryGcsBucket):
+        self.project_id = project_id
+        self.taxi_dataset_id = taxi_dataset_id
+        self.temporaryGcsBucket = temporaryGcsBucket
+
+    def Configure(self, spark):
+        # Use the Cloud Storage bucket for temporary BigQuery export data used by the connector.
+        spark.conf.set('temporaryGcsBucket', self.temporaryGcsBucket)
+
+        # Session settings, once for all the months (the months of the thread pool share the session)
+        spark.conf.set("viewsEnabled","true")
+        spark.conf.set("materializationProject",self.project_id)
+        spark.conf.set("materializationDataset",self.taxi_dataset_id)
+
+    def GetPartitions(self, spark):
+        """Returns { "2021-01": { "rows": ..., "lastModified": ... } } of the PartitionDate partitions of taxi_trips
+           (a PartitionDate is the first day of its month)"""
+        sql = "SELECT partition_id, total_rows, last_modified_time " + \
+                "FROM `" + self.project_id + "." + self.taxi_dataset_id + ".INFORMATION_SCHEMA.PARTITIONS` " + \
+               "WHERE table_name = 'taxi_trips' AND partition_id NOT IN ('__NULL__', '__UNPARTITIONED__');"
+        sourcePartitions = {}
+        for row in spark.read.format("bigquery").option("query", sql).load().collect():
+            monthName = row["partition_id"][:4] + "-" + row["partition_id"][4:6]
+            sourcePartition = sourcePartitions.setdefault(monthName, {"rows": 0, "lastModified": ""})
+            sourcePartition["rows"] += row["total_rows"]
+            sourcePartition["lastModified"] = max(sourcePartition["lastModified"], row["last_modified_time"].isoformat())
+        return sourcePartitions
+
+    def ReadMonth(self, spark, data_year, data_month):
+        # Sample Code: https://cloud.google.com/dataproc/docs/tutorials/bigquery-connector-spark-example#pyspark
+        # To use SQL to BQ
+        sql = "SELECT * " + \
+                "FROM `" + self.project_id + "." + self.taxi_dataset_id + ".taxi_trips` " + \
+               "WHERE EXTRACT(YEAR  FROM Pickup_DateTime) = " + str(data_year)  + " " + \
+                 "AND EXTRACT(MONTH FROM Pickup_DateTime) = " + str(data_month) + ";"
+        print ("SQL: ", sql)
+        return spark.read.format("bigquery").option("query", sql).load()
+
+    def ReadTable(self, spark, monthNames, readStreams=None):
+        """One read session for the PartitionDate partitions of the months"""
+        # PartitionDate is the first day of the month of Pickup_DateTime
+        if len(monthNames) == 12 * len(EXPORT_YEARS):
+            partitionFilter = "PartitionDate >= '{}-01-01' AND PartitionDate < '{}-01-01'".format(min(EXPORT_YEARS), max(EXPORT_YEARS) + 1)
+        else:
+            # The months left by a previous run
+            partitionFilter = "PartitionDate IN ({})".format(", ".join("'" + monthName + "-01'" for monthName in monthNames))
+        print ("Reading Table, filter: " + partitionFilter)
+        reader = spark.read.format("bigquery") \
+            .option("table", self.project_id + "." + self.taxi_dataset_id + ".taxi_trips") \
+            .option("filter", partitionFilter)
+        if readStreams is not None:
+            reader = reader.option("maxParallelism", readStreams)
+        # The select is pushed down as the columns of the read session
+        return reader.load().select(*TAXI_TRIPS_COLUMNS)
+
+
+class ParquetSource:
+    """A Parquet copy of taxi_trips (the columns of TAXI_TRIPS_COLUMNS, e.g. written by benchmarks/benchmark_export_taxi_data.py),
+       read with the same interface as BigQuerySource.  No materialization or read session: only the write side is measured."""
+
+    def __init__(self, path):
+        self.path = path.rstrip("/")
+
+    def Configure(self, spark):
+        pass
+
+    def GetPartitions(self, spark):
+        """The rows of each month, the last modified time of the newest file for every month"""
+        fs, hadoopPath = GetFileSystem(spark, self.path)
+        lastModified = 0
+        iterator = fs.listFiles(hadoopPath, True)
+        while iterator.hasNext():
+            lastModified = max(lastModified, iterator.next().getModificationTime())
+        lastModified = datetime.utcfromtimestamp(lastModified / 1000.0).isoformat()
+        rows = spark.read.parquet(self.path).groupBy(date_format("PartitionDate", "yyyy-MM").alias("month")).count().collect()
+        return {row["month"]: {"rows": row["count"], "lastModified": lastModified} for row in rows}
+
+    def ReadMonth(self, spark, data_year, data_month):
+        return spark.read.parquet(self.path).where(col("PartitionDate") == datetime(data_year, data_month, 1).date())
+
+    def ReadTable(self, spark, monthNames, readStreams=None):
+        """readStreams: at most this many read partitions (coalesce)"""
+        df_taxi_trips = spark.read.parquet(self.path) \
+            .where(col("PartitionDate").isin([datetime.strptime(monthName, "%Y-%m").date() for monthName in monthNames])) \
+            .select(*TAXI_TRIPS_COLUMNS)
+        if readStreams is not None:
+            df_taxi_trips = df_taxi_trips.coalesce(readStreams)
+        return df_taxi_trips
+
+
+def IsExported(spark, tablePath, monthName, sourcePartition, partitionLayout):
+    """True when the marker of the month was written from the same source partition with the same granularity mode"""
+    markerPath = GetMonthPath(tablePath, monthName) + "/" + EXPORT_MARKER_FILE
+    if not PathExists(spark, markerPath):
+        return False
+    marker = json.loads(ReadTextFile(spark, markerPath))
+    return marker["sourceRows"] == sourcePartition["rows"] and marker["sourceLastModified"] == sourcePartition["lastModified"] and \
+        marker["granularityMode"] == partitionLayout[0]
+
+
+def WriteExportMarker(spark, tablePath, monthName, sourcePartition, partitionLayout, monthLayout):
+    """Writes the marker of an exported month when its files have the rows of the source partition"""
+    monthPath = GetMonthPath(tablePath, monthName)
+    try:
+        rows = spark.read.parquet(monthPath).count()
+    except AnalysisException:
+        # No rows, no Parquet files
+        rows = 0
+    if rows != sourcePartition["rows"]:
+        print("ExportTaxiData: {} exported {} rows, the source partition has {}: no marker, exported again by the next run".format(
+            monthName, rows, sourcePartition["rows"]))
+        return
+    WriteTextFile(spark, monthPath + "/" + EXPORT_MARKER_FILE, json.dumps({
+        "month": monthName, "rows": rows, "sourceRows": sourcePartition["rows"], "sourceLastModified": sourcePartition["lastModified"],
+        "granularityMode": partitionLayout[0], "partitionColumns": monthLayout["partitionColumns"],
+        "exported": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")}, indent=1, sort_keys=True))
+
+
+def ClearExportedMonth(spark, tablePath, monthName):
+    """Deletes the marker of the month, then its folder: a month left half deleted or half written by a failed run has no
+       marker and is exported again by the next run"""
+    monthPath = GetMonthPath(tablePath, monthName)
+    DeletePath(spark, monthPath + "/" + EXPORT_MARKER_FILE)
+    DeletePath(spark, monthPath)
+
+
+def GetPartitionLayout(granularity="minute", minFileSizeMB=DEFAULT_MIN_FILE_SIZE_MB, bytesPerRow=DEFAULT_PARQUET_BYTES_PER_ROW,
+                       sampleFraction=DEFAULT_LAYOUT_SAMPLE_FRACTION, shuffleByPartition=False, maxFileSizeMB=DEFAULT_MAX_FILE_SIZE_MB):
+    """Returns the (granularity, minimum file bytes, bytes per row, sample fraction, shuffle by partition, maximum file bytes)
+       passed to the exports"""
+    return (granularity, int(minFileSizeMB * 1024 * 1024), bytesPerRow, sampleFraction, shuffleByPartition, int(maxFileSizeMB * 1024 * 1024))
+
+
+def WritePartitioned(df, partitionCols, partitionLayout, outputPath, append=False):
+    """Writes df partitioned by partitionCols.  Shuffled by partition (--shuffle-by-partition or adaptive): each folder is
+       written by one task, in files of at most the maximum file bytes.  Otherwise each task writes a file in every folder
+       it has rows of.
+       append: the caller deleted the folders written to (no dynamic partition overwrite: its .spark-staging folder is
+       renamed folder by folder, tens of thousands of minute folders a month on GCS)."""
+    granularity, minFileBytes, bytesPerRow, sampleFraction, shuffleByPartition, maxFileBytes = partitionLayout
+    shuffled = shuffleByPartition or granularity == "adaptive"
+    if shuffled:
+        # A shuffle partition holds whole folders, the write sorts its task by folder: one open file at a time
+        df = df.repartition(*partitionCols)
+    writer = df.write.mode("append" if append else "overwrite")
+    if shuffled:
+        writer = writer.option("maxRecordsPerFile", max(1, int(maxFileBytes / bytesPerRow)))
+    writer \
+        .partitionBy(*partitionCols) \
+        .parquet(outputPath)
+
+
+def GetMinuteRowCounts(df_taxi_trips, sampleFraction):
+    """Returns { (year, month): { (day, hour, minute): estimated rows } } from a sample of the rows (only Pickup_DateTime is read)"""
+    df_sample = df_taxi_trips.select("Pickup_DateTime")
+    if sampleFraction < 1:
+        df_sample = df_sample.sample(fraction=sampleFraction, seed=42)
+    minuteRowCounts = {}
+    for row in AddPartitionColumns(df_sample).groupBy("year", "month", "day", "hour", "minute").count().collect():
+        minuteRowCounts.setdefault((row["year"], row["month"]), {})[(row["day"], row["hour"], row["minute"])] = row["count"] / sampleFraction
+    return minuteRowCounts
+
+
+def ChooseGranularity(minuteRowCounts, bytesPerRow, minFileBytes):
+    """Returns the layout of a month: the finest granularity whose median folder (one file) is at least minFileBytes, day otherwise"""
+    for granularity in ["minute", "hour", "day"]:
+        depth = len(PARTITION_GRANULARITIES[granularity])
+        folderRows = {}
+        for minuteKey, rows in minuteRowCounts.items():
+            folderRows[minuteKey[:depth]] = folderRows.get(minuteKey[:depth], 0) + rows
+        fileBytes = sorted(rows * bytesPerRow for rows in folderRows.values())
+        medianFileBytes = int(fileBytes[len(fileBytes) // 2]) if len(fileBytes) > 0 else 0
+        if medianFileBytes >= minFileBytes or granularity == "day":
+            return {"granularity": granularity, "partitionColumns": PARTITION_GRANULARITIES[granularity],
+                    "folders": len(folderRows), "estimatedMedianFileBytes": medianFileBytes}
+
+
+def WritePartitionLayouts(spark, tablePath, monthLayouts, partitionLayout):
+    """Adds the layouts of the exported months to the layout file of the table (the other months are kept)"""
+    granularity, minFileBytes, bytesPerRow, sampleFraction, shuffleByPartition, maxFileBytes = partitionLayout
+    layoutPath = tablePath + PARTITION_LAYOUT_FILE
+    layouts = json.loads(ReadTextFile(spark, layoutPath)) if PathExists(spark, layoutPath) else {"months": {}}
+    layouts["months"].update(monthLayouts)
+    layouts.update({"granularityMode": granularity, "minFileSizeMB": round(minFileBytes / 1024.0 / 1024, 3), "bytesPerRow": bytesPerRow,
+                    "shuffleByPartition": shuffleByPartition or granularity == "adaptive",
+                    "maxFileSizeMB": round(maxFileBytes / 1024.0 / 1024, 3), "updated": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")})
+    WriteTextFile(spark, layoutPath, json.dumps(layouts, indent=1, sort_keys=True))
+    for monthName in sorted(monthLayouts):
+        if "folders" in monthLayouts[monthName]:
+            print("ExportTaxiData: {} partitioned by {:18s} folders: {}  estimated median file bytes: {}".format(
+                monthName, "/".join(monthLayouts[monthName]["partitionColumns"]), monthLayouts[monthName]["folders"],
+                monthLayouts[monthName]["estimatedMedianFileBytes"]))
+    print("ExportTaxiData: partition layouts: " + layoutPath)
+
+
+def ExportMonth(spark, source, destination, data_year, data_month, partitionLayout):
+    """Queries one month and writes it partitioned by day/hour/minute (or the granularity of the layout),
+       returns (month, wall seconds, layout of the month).
+       The Spark jobs run in a FAIR scheduler pool of the month (a local property of the calling thread)."""
+    granularity, minFileBytes, bytesPerRow, sampleFraction, shuffleByPartition, maxFileBytes = partitionLayout
+    monthName = str(data_year) + "-" + str(data_month).zfill(2)
+    spark.sparkContext.setLocalProperty("spark.scheduler.pool", monthName)
+    startTime = time.time()
+    try:
+        print ("BEGIN: Querying Table " + monthName)
+        df_taxi_trips = source.ReadMonth(spark, data_year, data_month)
+        print ("END: Querying Table " + monthName)
+
+        # Returns too much data to process with our limited demo core CPU quota
+        # Load data from BigQuery taxi_trips table
+        """
+        print ("BEGIN: Querying Table")
+        df_taxi_trips = spark.read.format('bigquery') \
+            .option('table', project_id + ':' + taxi_dataset_id + '.taxi_trips') \
+            .load()
+        print ("END: Querying Table")
+        """
+
+        df_taxi_trips_partitioned = AddPartitionColumns(df_taxi_trips)
+        if granularity == "adaptive":
+            minuteRowCounts = GetMinuteRowCounts(df_taxi_trips, sampleFraction).get((data_year, data_month), {})
+            # One file per folder (WritePartitioned), the size the layout was chosen for
+            monthLayout = ChooseGranularity(minuteRowCounts, bytesPerRow, minFileBytes)
+        else:
+            monthLayout = {"granularity": granularity, "partitionColumns": PARTITION_GRANULARITIES[granularity]}
+
+        # Write as Parquet
+        print ("BEGIN: Writing Data to GCS " + monthName)
+        outputPath = GetMonthPath(GetTablePath(destination), monthName) + "/"
+        DeletePath(spark, outputPath + EXPORT_MARKER_FILE)
+        WritePartitioned(df_taxi_trips_partitioned, monthLayout["partitionColumns"], partitionLayout, outputPath)
+        print ("END: Writing Data to GCS " + monthName)
+    finally:
+        spark.sparkContext.setLocalProperty("spark.scheduler.pool", None)
+
+    wallSeconds = time.time() - startTime
+    print("ExportTaxiData: month " + monthName + " wall seconds: ", round(wallSeconds, 2))
+    return monthName, wallSeconds, monthLayout
+
+
+def AddPartitionColumns(df_taxi_trips):
+    return df_taxi_trips \
+        .withColumn("year",   year       (col("Pickup_DateTime"))) \
+        .withColumn("month",  month      (col("Pickup_DateTime"))) \
+        .withColumn("day",    dayofmonth (col("Pickup_DateTime"))) \
+        .withColumn("hour",   hour       (col("Pickup_DateTime"))) \
+        .withColumn("minute", minute     (col("Pickup_DateTime")))
+
+
+def ExportTable(spark, source, destination, months, partitionLayout, readStreams=None):
+    """Reads the PartitionDate partitions of the years in one scan and writes them partitioned by year/month/day/hour/minute
+       (or the granularity of the layout), returns { month: layout }.
+       Adaptive: the layouts come from a sample of the Pickup_DateTime column of the months (one more scan, of that column
+       only), then one write per granularity, each reads only the PartitionDate partitions of its months.
+       Only the year=/month= folders of the exported months are replaced, like the per-month queries: they are deleted
+       first, then the writes append to the table."""
+    granularity, minFileBytes, bytesPerRow, sampleFraction, shuffleByPartition, maxFileBytes = partitionLayout
+    monthNames = [str(data_year) + "-" + str(data_month).zfill(2) for data_year, data_month in months]
+    print ("BEGIN: Reading Table")
+    df_taxi_trips = source.ReadTable(spark, monthNames, readStreams)
+    print ("END: Reading Table, read partitions: ", df_taxi_trips.rdd.getNumPartitions())
+
+    monthLayouts = {}
+    if granularity == "adaptive":
+        minuteRowCountsByMonth = GetMinuteRowCounts(df_taxi_trips, sampleFraction)
+        # Every exported month gets a layout: a month without rows in the sample is partitioned by day
+        for data_year, data_month in months:
+            monthLayouts[str(data_year) + "-" + str(data_month).zfill(2)] = ChooseGranularity(
+                minuteRowCountsByMonth.get((data_year, data_month), {}), bytesPerRow, minFileBytes)
+    else:
+        monthLayouts = {monthName: {"granularity": granularity, "partitionColumns": PARTITION_GRANULARITIES[granularity]}
+                        for monthName in monthNames}
+
+    # The folders of the months are replaced, not merged: a month whose granularity changed keeps no files of the previous layout
+    tablePath = GetTablePath(destination)
+    for monthName in monthNames:
+        ClearExportedMonth(spark, tablePath, monthName)
+
+    for writeGranularity in sorted(set(monthLayout["granularity"] for monthLayout in monthLayouts.values())):
+        partitionCols = ["year", "month"] + PARTITION_GRANULARITIES[writeGranularity]
+        df_write = AddPartitionColumns(df_taxi_trips)
+        if granularity == "adaptive":
+            # Pushed down to the read session with the PartitionDate filter
+            partitionDates = [monthName + "-01" for monthName, monthLayout in monthLayouts.items() if monthLayout["granularity"] == writeGranularity]
+            df_write = df_write \
+                .where(col("PartitionDate").isin([datetime.strptime(partitionDate, "%Y-%m-%d").date() for partitionDate in partitionDates]))
+
+        print ("BEGIN: Writing Data to GCS, partitioned by " + "/".join(partitionCols))
+        WritePartitioned(df_write, partitionCols, partitionLayout, tablePath, append=True)
+        print ("END: Writing Data to GCS")
+    return monthLayouts
+
+
+def ExportTaxiData(project_id, taxi_dataset_id, temporaryGcsBucket, destination, metricsPath=None,
+                   maxConcurrentExports=DEFAULT_MAX_CONCURRENT_EXPORTS, readMode="query", readStreams=None, partitionLayout=None, force=False,
+                   source=None):
+    """Exports the months of taxi_trips from the source (BigQuery by default), returns the metrics report (None without metricsPath)"""
+    if partitionLayout is None:
+        partitionLayout = GetPartitionLayout()
+    if source is None:
+        source = BigQuerySource(project_id, taxi_dataset_id, temporaryGcsBucket)
+
+    # FAIR: the jobs of the concurrent months share the executors instead of running first in, first out
     spark = SparkSession \
         .builder \
         .appName("export_taxi_data_from_bq_to_gcs") \
+        .config("spark.scheduler.mode", "FAIR" if maxConcurrentExports > 1 else "FIFO") \
         .getOrCreate()
 
-    # Use the Cloud Storage bucket for temporary BigQuery export data used by the connector.
-    bucket = "[bucket]"
-    spark.conf.set('temporaryGcsBucket', temporaryGcsBucket)
- 
-    years = [2021, 2020, 2019]
-    for data_year in years:
-        print("data_year: ", data_year)
+    source.Configure(spark)
+
+    startTime = time.time()
+    # Before the reads: a partition modified during the export does not match its marker on the next run
+    tablePath = GetTablePath(destination)
+    sourcePartitions = source.GetPartitions(spark)
+    months = []
+    skippedMonths = []
+    for data_year in EXPORT_YEARS:
         for data_month in range(1, 13):
-            print("data_month: ", data_month)
-
-            # Sample Code: https://cloud.google.com/dataproc/docs/tutorials/bigquery-connector-spark-example#pyspark
-            # To use SQL to BQ
-            spark.conf.set("viewsEnabled","true")
-            spark.conf.set("materializationProject",project_id)
-            spark.conf.set("materializationDataset",taxi_dataset_id)
-            print ("BEGIN: Querying Table")
-            sql = "SELECT * " + \
-                    "FROM `" + project_id + "." + taxi_dataset_id + ".taxi_trips` " + \
-                   "WHERE EXTRACT(YEAR  FROM Pickup_DateTime) = " + str(data_year)  + " " + \
-                     "AND EXTRACT(MONTH FROM Pickup_DateTime) = " + str(data_month) + ";"
-            print ("SQL: ", sql)
-            df_taxi_trips = spark.read.format("bigquery").option("query", sql).load()
-            print ("END: Querying Table")
-     
-            # Returns too much data to process with our limited demo core CPU quota
-            # Load data from BigQuery taxi_trips table
-            """
-            print ("BEGIN: Querying Table")
-            df_taxi_trips = spark.read.format('bigquery') \
-                .option('table', project_id + ':' + taxi_dataset_id + '.taxi_trips') \
-                .load()
-            print ("END: Querying Table")
-            """
-
-            print ("BEGIN: Adding partition columns to dataframe")
-            df_taxi_trips_partitioned = df_taxi_trips \
-                .withColumn("year",   year       (col("Pickup_DateTime"))) \
-                .withColumn("month",  month      (col("Pickup_DateTime"))) \
-                .withColumn("day",    dayofmonth (col("Pickup_DateTime"))) \
-                .withColumn("hour",   hour       (col("Pickup_DateTime"))) \
-                .withColumn("minute", minute     (col("Pickup_DateTime"))) 
-            print ("END: Adding partition columns to dataframe")
-
-            # Write as Parquet
-            print ("BEGIN: Writing Data to GCS")
-            outputPath = destination + "/processed/taxi-trips-query-acceleration/year=" + str(data_year)  + "/month=" + str(data_month) + "/"
-            df_taxi_trips_partitioned \
-                .write \
-                .mode("overwrite") \
-                .partitionBy("day","hour","minute") \
-                .parquet(outputPath)
-            print ("END: Writing Data to GCS")
-                
+            monthName = str(data_year) + "-" + str(data_month).zfill(2)
+            sourcePartition = sourcePartitions.get(monthName, {"rows": 0, "lastModified": None})
+            if not force and IsExported(spark, tablePath, monthName, sourcePartition, partitionLayout):
+                skippedMonths.append(monthName)
+            else:
+                months.append((data_year, data_month))
+    print("ExportTaxiData: months already exported (skipped): ", len(skippedMonths), " months to export: ", len(months))
+
+    if len(months) == 0:
+        monthLayouts = {}
+        monthSeconds = []
+    elif readMode == "table":
+        monthLayouts = ExportTable(spark, source, destination, months, partitionLayout, readStreams)
+        monthSeconds = []
+    else:
+        if maxConcurrentExports > 1:
+            with ThreadPoolExecutor(max_workers=maxConcurrentExports) as executor:
+                futures = [executor.submit(ExportMonth, spark, source, destination, data_year, data_month, partitionLayout)
+                           for data_year, data_month in months]
+                # Raises the error of a failed month (after the others have finished)
+                monthResults = [future.result() for future in futures]
+        else:
+            monthResults = [ExportMonth(spark, source, destination, data_year, data_month, partitionLayout)
+                            for data_year, data_month in months]
+        monthSeconds = [(monthName, wallSeconds) for monthName, wallSeconds, monthLayout in monthResults]
+        monthLayouts = {monthName: monthLayout for monthName, wallSeconds, monthLayout in monthResults}
+    for data_year, data_month in months:
+        monthName = str(data_year) + "-" + str(data_month).zfill(2)
+        WriteExportMarker(spark, tablePath, monthName, sourcePartitions.get(monthName, {"rows": 0, "lastModified": None}), partitionLayout,
+                          monthLayouts.get(monthName, {"partitionColumns": []}))
+    totalSeconds = time.time() - startTime
+
+    WritePartitionLayouts(spark, tablePath, monthLayouts, partitionLayout)
+
+    # No per month time for the table read
+    for monthName, wallSeconds in sorted(monthSeconds):
+        print("ExportTaxiData: {} seconds: {:8.2f}".format(monthName, wallSeconds))
+    # Sequential: the total is the sum of the months, concurrent: about the sum / maxConcurrentExports
+    print("ExportTaxiData: months wall seconds (sum): ", round(sum(wallSeconds for monthName, wallSeconds in monthSeconds), 2))
+    print("ExportTaxiData: total wall seconds:        ", round(totalSeconds, 2))
+
+    report = None
+    if metricsPath is not None:
+        report = WriteMetricsReport(spark, metricsPath, "ExportTaxiData", {
+            "project_id": project_id, "taxi_dataset_id": taxi_dataset_id, "destination": destination,
+            "maxConcurrentExports": maxConcurrentExports, "readMode": readMode, "readStreams": readStreams,
+            "partitionGranularity": partitionLayout[0], "minFileSizeMB": round(partitionLayout[1] / 1024.0 / 1024, 3),
+            "shuffleByPartition": partitionLayout[4], "maxFileSizeMB": round(partitionLayout[5] / 1024.0 / 1024, 3),
+            "force": force, "skippedMonths": skippedMonths, "monthSeconds": dict(monthSeconds), "totalSeconds": round(totalSeconds, 2),
+            "source": type(source).__name__})
+
     spark.stop()
+    return report
 
 
 # Main entry point
+# export_taxi_data_from_bq_to_gcs ${project} taxi_dataset ${dataproceTempBucketName} "gs://${dataproceTempBucketName}/taxi-export"
+# export_taxi_data_from_bq_to_gcs ${project} taxi_dataset ${dataproceTempBucketName} "gs://${dataproceTempBucketName}/taxi-export" --max-concurrent-exports 4
+# export_taxi_data_from_bq_to_gcs ${project} taxi_dataset ${dataproceTempBucketName} "gs://${dataproceTempBucketName}/taxi-export" --read-mode table --read-streams 200
+# export_taxi_data_from_bq_to_gcs ${project} taxi_dataset ${dataproceTempBucketName} "gs://${dataproceTempBucketName}/taxi-export" --partition-granularity adaptive --min-file-size-mb 32
+# export_taxi_data_from_bq_to_gcs ${project} taxi_dataset ${dataproceTempBucketName} "gs://${dataproceTempBucketName}/taxi-export" --shuffle-by-partition --max-file-size-mb 128
 if __name__ == "__main__":
-    if len(sys.argv) != 5:
-        print("Usage: export_taxi_data_from_bq_to_gcs project_id taxi_dataset_id temporaryGcsBucket destination")
-        sys.exit(-1)
-
-    project_id         = sys.argv[1]
-    taxi_dataset_id    = sys.argv[2]
-    temporaryGcsBucket = sys.argv[3]
-    destination        = sys.argv[4]
-
-    print ("project_id: ", project_id)
-    print ("taxi_dataset_id: ", taxi_dataset_id)
-    print ("temporaryGcsBucket: ", temporaryGcsBucket)
-    print ("destination: ", destination)
+    parser = argparse.ArgumentParser(prog="export_taxi_data_from_bq_to_gcs")
+    parser.add_argument("project_id")
+    parser.add_argument("taxi_dataset_id")
+    parser.add_argument("temporaryGcsBucket")
+    parser.add_argument("destination")
+    parser.add_argument("metricsPath", nargs="?", default=None)
+    parser.add_argument("--max-concurrent-exports", dest="maxConcurrentExports", type=int, default=DEFAULT_MAX_CONCURRENT_EXPORTS,
+                        help="Months exported at the same time from a thread pool (default: 1, one month after the other)")
+    parser.add_argument("--read-mode", dest="readMode", choices=READ_MODES, default="query",
+                        help="A query per month, or one read of the table with a PartitionDate filter (default: query)")
+    parser.add_argument("--read-streams", dest="readStreams", type=int, default=None,
+                        help="--read-mode table: maximum number of read streams (Spark partitions) of the read session (default: chosen by BigQuery)")
+    parser.add_argument("--partition-granularity", dest="partitionGranularity", choices=GRANULARITY_MODES, default="minute",
+                        help="Folders below year=/month=: day/hour/minute, day/hour, day, or adaptive: the finest whose files are "
+                             "at least --min-file-size-mb, per month (default: minute)")
+    parser.add_argument("--min-file-size-mb", dest="minFileSizeMB", type=float, default=DEFAULT_MIN_FILE_SIZE_MB,
+                        help="--partition-granularity adaptive: minimum median file size (default: 16)")
+    parser.add_argument("--bytes-per-row", dest="bytesPerRow", type=float, default=DEFAULT_PARQUET_BYTES_PER_ROW,
+                        help="--partition-granularity adaptive and --max-file-size-mb: Parquet bytes of a row used to estimate the file sizes (default: 30)")
+    parser.add_argument("--layout-sample-fraction", dest="layoutSampleFraction", type=float, default=DEFAULT_LAYOUT_SAMPLE_FRACTION,
+                        help="--partition-granularity adaptive: share of the rows of a month counted by minute (default: 0.1)")
+    parser.add_argument("--shuffle-by-partition", dest="shuffleByPartition", action="store_true",
+                        help="Shuffle the rows by folder before the write: at most one file per folder (up to --max-file-size-mb) "
+                             "instead of one per task (always on for --partition-granularity adaptive)")
+    parser.add_argument("--max-file-size-mb", dest="maxFileSizeMB", type=float, default=DEFAULT_MAX_FILE_SIZE_MB,
+                        help="--shuffle-by-partition: the files of a larger folder are rolled at about this size (default: 256)")
+    parser.add_argument("--force", action="store_true",
+                        help="Export every month, including the months whose _EXPORTED.json marker matches the source partition")
+    parser.add_argument("--source-parquet", dest="sourceParquet", default=None,
+                        help="Read a Parquet copy of taxi_trips instead of BigQuery (project_id, taxi_dataset_id and temporaryGcsBucket are not used)")
+    args = parser.parse_args()
+    if args.maxConcurrentExports < 1:
+        parser.error("--max-concurrent-exports must be at least 1")
+    if not 0 < args.layoutSampleFraction <= 1:
+        parser.error("--layout-sample-fraction must be in (0, 1]")
+    if args.maxFileSizeMB <= 0:
+        parser.error("--max-file-size-mb must be positive")
+    if args.readMode == "table" and args.maxConcurrentExports > 1:
+        parser.error("--max-concurrent-exports only applies to --read-mode query")
+
+    print ("project_id: ", args.project_id)
+    print ("taxi_dataset_id: ", args.taxi_dataset_id)
+    print ("temporaryGcsBucket: ", args.temporaryGcsBucket)
+    print ("destination: ", args.destination)
+    print ("metricsPath: ", args.metricsPath)
+    print ("maxConcurrentExports: ", args.maxConcurrentExports)
+    print ("readMode: ", args.readMode)
+    print ("readStreams: ", args.readStreams)
+    print ("partitionGranularity: ", args.partitionGranularity, args.minFileSizeMB, args.bytesPerRow, args.layoutSampleFraction)
+    print ("shuffleByPartition: ", args.shuffleByPartition, args.maxFileSizeMB)
+    print ("force: ", args.force)
+    print ("sourceParquet: ", args.sourceParquet)
 
     print ("BEGIN: Main")
-    ExportTaxiData(project_id, taxi_dataset_id, temporaryGcsBucket, destination)
+    ExportTaxiData(args.project_id, args.taxi_dataset_id, args.temporaryGcsBucket, args.destination, args.metricsPath,
+                   args.maxConcurrentExports, args.readMode, args.readStreams,
+                   GetPartitionLayout(args.partitionGranularity, args.minFileSizeMB, args.bytesPerRow, args.layoutSampleFraction,
+                                      args.shuffleByPartition, args.maxFileSizeMB), args.force,
+                   None if args.sourceParquet is None else ParquetSource(args.sourceParquet))
     print ("END: Main")
 
 
@@ -144,8 +593,9 @@ gcloud dataproc jobs submit pyspark  \
    --region="us-west2" \
    --project="${project}" \
    --jars gs://${rawBucket}/pyspark-code/spark-bigquery-with-dependencies_2.12-0.26.0.jar \
+   --py-files gs://${rawBucket}/pyspark-code/hadoop_fs_utils.py,gs://${rawBucket}/pyspark-code/spark_job_metrics.py,gs://${rawBucket}/pyspark-code/spark_metrics_report.py \
    gs://${rawBucket}/pyspark-code/export_taxi_data_from_bq_to_gcs.py \
-   -- ${project} taxi_dataset ${dataproceTempBucketName} "gs://${dataproceTempBucketName}/taxi-export"
+   -- ${project} taxi_dataset ${dataproceTempBucketName} "gs://${dataproceTempBucketName}/taxi-export" --max-concurrent-exports 4
 
 # Write to local HDFS "/tmp/taxi-export" (you have to SSH to the machine and then distcp the files to a bucket)
 # To SSH you need a firewall rule to open traffic
@@ -155,6 +605,7 @@ gcloud dataproc jobs submit pyspark  \
    --region="us-west2" \
    --project="${project}" \
    --jars gs://${rawBucket}/pyspark-code/spark-bigquery-with-dependencies_2.12-0.26.0.jar \
+   --py-files gs://${rawBucket}/pyspark-code/hadoop_fs_utils.py,gs://${rawBucket}/pyspark-code/spark_job_metrics.py,gs://${rawBucket}/pyspark-code/spark_metrics_report.py \
    gs://${rawBucket}/pyspark-code/export_taxi_data_from_bq_to_gcs.py \
    -- ${project} taxi_dataset ${dataproceTempBucketName} /tmp/taxi-export
 
@@ -203,6 +654,7 @@ gcloud beta dataproc batches submit pyspark \
     --batch="batch-015"  \
     gs://raw-data-analytics-demo-4s42tmb9uw/pyspark-code/export_taxi_data_from_bq_to_gcs.py \
     --jars gs://raw-data-analytics-demo-4s42tmb9uw/pyspark-code/spark-bigquery-with-dependencies_2.12-0.26.0.jar \
+    --py-files gs://raw-data-analytics-demo-4s42tmb9uw/pyspark-code/hadoop_fs_utils.py,gs://raw-data-analytics-demo-4s42tmb9uw/pyspark-code/spark_job_metrics.py,gs://raw-data-analytics-demo-4s42tmb9uw/pyspark-code/spark_metrics_report.py \
     --subnet="bigspark-subnet" \
     --deps-bucket="gs://dataproc-data-analytics-demo-4s42tmb9uw" \
     --service-account="dataproc-service-account@data-analytics-demo-4s42tmb9uw.iam.gserviceaccount.com" \
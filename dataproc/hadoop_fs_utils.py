@@ -0,0 +1,95 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Small helpers around the Hadoop FileSystem API (through the Spark JVM gateway).
+#          The same code works for gs:// (GCS connector on Dataproc), hdfs:// and local paths.
+#          Ship this file with the job: --py-files gs://${rawBucket}/pyspark-code/hadoop_fs_utils.py
+
+
+def GetFileSystem(spark, path):
+    jvm = spark.sparkContext._jvm
+    hadoopConf = spark.sparkContext._jsc.hadoopConfiguration()
+    hadoopPath = jvm.org.apache.hadoop.fs.Path(path)
+    return hadoopPath.getFileSystem(hadoopConf), hadoopPath
+
+
+def GetPathSizeBytes(spark, path):
+    """Returns the total number of bytes stored under a path or glob (e.g. gs://bucket/yellow/*/*.parquet)"""
+    fs, hadoopPath = GetFileSystem(spark, path)
+    statuses = fs.globStatus(hadoopPath)
+    if statuses is None:
+        return 0
+
+    totalBytes = 0
+    for status in statuses:
+        if status.isFile():
+            totalBytes += status.getLen()
+        else:
+            totalBytes += fs.getContentSummary(status.getPath()).getLength()
+    return totalBytes
+
+
+def PathExists(spark, path):
+    fs, hadoopPath = GetFileSystem(spark, path)
+    return fs.exists(hadoopPath)
+
+
+def ReadTextFile(spark, path):
+    """Returns the content of a (small) text file or None if it does not exist"""
+    fs, hadoopPath = GetFileSystem(spark, path)
+    if not fs.exists(hadoopPath):
+        return None
+    inputStream = fs.open(hadoopPath)
+    try:
+        return spark.sparkContext._jvm.org.apache.commons.io.IOUtils.toString(inputStream, "UTF-8")
+    finally:
+        inputStream.close()
+
+
+def WriteTextFile(spark, path, text):
+    """Creates or overwrites a (small) text file"""
+    fs, hadoopPath = GetFileSystem(spark, path)
+    outputStream = fs.create(hadoopPath, True)
+    try:
+        outputStream.write(bytearray(text.encode("utf-8")))
+    finally:
+        outputStream.close()
+
+
+def DeletePath(spark, path):
+    """Deletes a file or a folder (recursively), returns False if it did not exist"""
+    fs, hadoopPath = GetFileSystem(spark, path)
+    return fs.delete(hadoopPath, True)
+
+
+def RenamePath(spark, sourcePath, destinationPath):
+    """Moves a file or a folder, the parent of the destination is created.
+       Atomic on HDFS, a copy and delete of every object on GCS."""
+    fs, hadoopSourcePath = GetFileSystem(spark, sourcePath)
+    _, hadoopDestinationPath = GetFileSystem(spark, destinationPath)
+    fs.mkdirs(hadoopDestinationPath.getParent())
+    if not fs.rename(hadoopSourcePath, hadoopDestinationPath):
+        raise IOError("RenamePath: cannot rename " + sourcePath + " to " + destinationPath)
+
+
+def CopyFile(spark, sourcePath, destinationPath):
+    """Copies a file as bytes (also between file systems), an existing destination is overwritten"""
+    jvm = spark.sparkContext._jvm
+    sourceFs, hadoopSourcePath = GetFileSystem(spark, sourcePath)
+    destinationFs, hadoopDestinationPath = GetFileSystem(spark, destinationPath)
+    if not jvm.org.apache.hadoop.fs.FileUtil.copy(sourceFs, hadoopSourcePath, destinationFs, hadoopDestinationPath,
+                                                  False, True, spark.sparkContext._jsc.hadoopConfiguration()):
+        raise IOError("CopyFile: cannot copy " + sourcePath + " to " + destinationPath)
@@ -0,0 +1,96 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Sizes the output files of a partitioned write (e.g. partitionBy("year","month")).
+#          Instead of a fixed .repartition(5).coalesce(5), the number of files of each partition
+#          is computed from its row count and a target file size.  Each output file gets its own
+#          Spark partition so a single shuffle produces right-sized files in every partition.
+#          Ship this file with the job: --py-files gs://${rawBucket}/pyspark-code/output_file_sizing.py
+
+from pyspark.sql.functions import broadcast, col, expr, lit, pmod, xxhash64
+import math
+
+DEFAULT_TARGET_FILE_SIZE_MB = 256
+
+# Approximate size of a row in each output format compared to the (Snappy) Parquet source.
+# CSV/JSON are written uncompressed and JSON repeats the field names in every row.
+FORMAT_SIZE_FACTOR = {
+    "parquet": 1.0,
+    "csv":     6.0,
+    "json":    25.0
+}
+
+
+def GetRowCountsByPartition(df, partitionCols):
+    """Returns { (partition values): row count } for the output partitions, e.g. { (2021, 1): 1369769 }"""
+    rowCounts = {}
+    for row in df.groupBy(*partitionCols).count().collect():
+        rowCounts[tuple(row[partitionCol] for partitionCol in partitionCols)] = row["count"]
+    return rowCounts
+
+
+def ComputeFileCounts(rowCounts, bytesPerRow, targetFileSizeBytes):
+    """Returns { (partition values): number of output files } so each file is close to the target size"""
+    fileCounts = {}
+    for partitionValues, rowCount in rowCounts.items():
+        fileCounts[partitionValues] = max(1, int(math.ceil(rowCount * bytesPerRow / targetFileSizeBytes)))
+    return fileCounts
+
+
+def GetHashPartitionKeys(spark, numPartitions):
+    """Returns a list where item N is a value that hash partitioning (repartition(numPartitions, col))
+       sends to Spark partition N.  This is used to pin each output file to its own partition."""
+    keys = {}
+    searchSize = numPartitions * 32
+    while len(keys) < numPartitions:
+        df_keys = spark.range(0, searchSize) \
+            .withColumn("partition", pmod(expr("hash(id)"), lit(numPartitions))) \
+            .groupBy("partition") \
+            .agg(expr("min(id)").alias("key"))
+        keys = {row["partition"]: row["key"] for row in df_keys.collect()}
+        searchSize = searchSize * 4
+    return [keys[partition] for partition in range(numPartitions)]
+
+
+def RepartitionByFileCounts(spark, df, partitionCols, fileCounts):
+    """Shuffles the data so that every output file is a Spark partition.
+       The rows of a partition (e.g. year=2021/month=1) are spread over its files with a hash of the row."""
+    fileRows = []
+    fileOffset = 0
+    for partitionValues in sorted(fileCounts):
+        fileRows.append(partitionValues + (fileOffset, fileCounts[partitionValues]))
+        fileOffset += fileCounts[partitionValues]
+    numFiles = fileOffset
+
+    df_files = spark.createDataFrame(fileRows, partitionCols + ["_file_offset", "_file_count"])
+    df_keys = spark.createDataFrame(list(enumerate(GetHashPartitionKeys(spark, numFiles))), ["_file_id", "_partition_key"])
+
+    dataCols = [col(column) for column in df.columns]
+
+    return df \
+        .join(broadcast(df_files), partitionCols) \
+        .withColumn("_file_id", col("_file_offset") + pmod(xxhash64(*dataCols), col("_file_count"))) \
+        .join(broadcast(df_keys), "_file_id") \
+        .repartition(numFiles, "_partition_key") \
+        .select(*df.columns)
+
+
+def RepartitionByTargetFileSize(spark, df, partitionCols, rowCounts, bytesPerRow, targetFileSizeBytes, outputFormat="parquet"):
+    fileCounts = ComputeFileCounts(rowCounts, bytesPerRow * FORMAT_SIZE_FACTOR[outputFormat], targetFileSizeBytes)
+    print("RepartitionByTargetFileSize: " + outputFormat + " files: ", sum(fileCounts.values()),
+          " partitions: ", len(fileCounts),
+          " target file size (MB): ", targetFileSizeBytes // (1024 * 1024))
+    return RepartitionByFileCounts(spark, df, partitionCols, fileCounts)
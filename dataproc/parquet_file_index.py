@@ -0,0 +1,219 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Sidecar index of the files of a year=/month= partitioned Parquet table (e.g. <color>/trips_table/parquet).
+#          The index is one small JSON file at the table root with the row count, size and min/max of a few
+#          columns of every file, so planners and tools can find the files relevant to a filter with a single
+#          read instead of listing the bucket and reading every Parquet footer.
+#          _file_index.json is not matched by the *.parquet external table uris and is skipped by Spark (leading _).
+#          {
+#            "version": 1,
+#            "columns": ["Pickup_DateTime", "PULocationID", "DOLocationID", "Total_Amount"],
+#            "files": [ { "path": "year=2021/month=1/part-00000-...parquet", "rows": 1369769, "bytes": 25712392,
+#                         "min": { "Pickup_DateTime": "2021-01-01T00:00:00.000000Z", "PULocationID": 1, ... },
+#                         "max": { ... } } ]
+#          }
+#          Ship this file with the job: --py-files gs://${rawBucket}/pyspark-code/parquet_file_index.py
+
+import datetime
+import json
+import re
+
+from pyspark.sql.functions import col, expr, input_file_name
+from pyspark.sql.types import TimestampType
+
+from hadoop_fs_utils import GetFileSystem, ReadTextFile, WriteTextFile
+
+FILE_INDEX_NAME = "_file_index.json"
+FILE_INDEX_VERSION = 1
+
+# Columns the queries filter on
+FILE_INDEX_COLUMNS = ["Pickup_DateTime", "PULocationID", "DOLocationID", "Total_Amount"]
+
+# Timestamps are stored as UTC strings in a fixed format, so they compare like the timestamps
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+PARTITION_FILE_PATTERN = re.compile(r"(year=(\d+)/month=(\d+)/[^/]+)$")
+
+
+def FormatIndexValue(value):
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value.strftime(TIMESTAMP_FORMAT)
+    return value
+
+
+def GetRelativePath(path):
+    """Returns year=Y/month=M/<file name> for a path of a partitioned table or None"""
+    match = PARTITION_FILE_PATTERN.search(path)
+    return None if match is None else match.group(1)
+
+
+def GetPartition(relativePath):
+    match = PARTITION_FILE_PATTERN.search(relativePath)
+    return (int(match.group(2)), int(match.group(3)))
+
+
+################################################################################################
+# Writing the index
+################################################################################################
+def ListParquetFileSizes(spark, tablePath):
+    """Returns { year=Y/month=M/<file name>: bytes } for the Parquet files of the table"""
+    fs, hadoopPath = GetFileSystem(spark, tablePath.rstrip("/") + "/year=*/month=*/*.parquet")
+    sizes = {}
+    for status in (fs.globStatus(hadoopPath) or []):
+        relativePath = GetRelativePath(status.getPath().toString())
+        if status.isFile() and relativePath is not None:
+            sizes[relativePath] = status.getLen()
+    return sizes
+
+
+def ComputeFileStatistics(spark, tablePath, partitions=None, indexColumns=FILE_INDEX_COLUMNS):
+    """Returns the index entries of the files of the table (or of the [(year, month)] partitions).
+       One Spark job that only reads the index columns (the sizes come from one listing of the table)."""
+    df = spark.read.parquet(tablePath)
+    if partitions is not None:
+        partitionKeys = [partitionYear * 100 + partitionMonth for partitionYear, partitionMonth in partitions]
+        df = df.filter((col("year") * 100 + col("month")).isin(partitionKeys))
+
+    # Timestamps as microseconds since the epoch, independent of the session time zone
+    aggregations = [expr("count(1)").alias("rows")]
+    timestampColumns = set()
+    for columnName in indexColumns:
+        if isinstance(df.schema[columnName].dataType, TimestampType):
+            timestampColumns.add(columnName)
+            aggregations.append(expr("unix_micros(min(`{0}`))".format(columnName)).alias("min_" + columnName))
+            aggregations.append(expr("unix_micros(max(`{0}`))".format(columnName)).alias("max_" + columnName))
+        else:
+            aggregations.append(expr("min(`{0}`)".format(columnName)).alias("min_" + columnName))
+            aggregations.append(expr("max(`{0}`)".format(columnName)).alias("max_" + columnName))
+
+    statistics = {}
+    for row in df.groupBy(input_file_name().alias("path")).agg(*aggregations).collect():
+        statistics[GetRelativePath(row["path"])] = row
+
+    def IndexValue(columnName, value):
+        if value is not None and columnName in timestampColumns:
+            value = datetime.datetime(1970, 1, 1) + datetime.timedelta(microseconds=value)
+        return FormatIndexValue(value)
+
+    entries = []
+    for relativePath, fileBytes in sorted(ListParquetFileSizes(spark, tablePath).items()):
+        if partitions is not None and GetPartition(relativePath) not in partitions:
+            continue
+        row = statistics.get(relativePath)
+        entries.append({
+            "path":  relativePath,
+            "rows":  0 if row is None else row["rows"],
+            "bytes": fileBytes,
+            "min":   {} if row is None else {columnName: IndexValue(columnName, row["min_" + columnName]) for columnName in indexColumns},
+            "max":   {} if row is None else {columnName: IndexValue(columnName, row["max_" + columnName]) for columnName in indexColumns}
+        })
+    return entries
+
+
+def MergeFileIndex(existingEntries, newEntries, partitions):
+    """Replaces the entries of the rewritten partitions (all of them when partitions is None)"""
+    if partitions is None:
+        return newEntries
+    keptEntries = [entry for entry in existingEntries if GetPartition(entry["path"]) not in partitions]
+    return sorted(keptEntries + newEntries, key=lambda entry: entry["path"])
+
+
+def FileIndexToJson(entries, indexColumns=FILE_INDEX_COLUMNS):
+    return json.dumps({"version": FILE_INDEX_VERSION, "columns": indexColumns, "files": entries}, separators=(",", ":"))
+
+
+def WriteFileIndex(spark, tablePath, partitions=None):
+    """Writes <tablePath>/_file_index.json after a write of the table.
+       With partitions [(year, month)] (dynamic overwrite) only their entries are replaced."""
+    indexPath = tablePath.rstrip("/") + "/" + FILE_INDEX_NAME
+    existingEntries = []
+    if partitions is not None:
+        existingEntries = ParseFileIndex(ReadTextFile(spark, indexPath))
+    entries = MergeFileIndex(existingEntries, ComputeFileStatistics(spark, tablePath, partitions), partitions)
+    WriteTextFile(spark, indexPath, FileIndexToJson(entries))
+    print("WriteFileIndex: " + indexPath + " files: ", len(entries))
+
+
+################################################################################################
+# Reading the index
+################################################################################################
+def ParseFileIndex(text):
+    """Returns the entries of an index ([] when there is no index)"""
+    if text is None:
+        return []
+    fileIndex = json.loads(text)
+    if fileIndex.get("version") != FILE_INDEX_VERSION:
+        raise ValueError("ParseFileIndex: unsupported file index version " + str(fileIndex.get("version")))
+    return fileIndex["files"]
+
+
+def ReadFileIndex(tablePath, spark=None):
+    """Reads the index of a table with Spark (Hadoop FileSystem) or, without a SparkSession, with pyarrow.
+       Returns None when the table has no index."""
+    indexPath = tablePath.rstrip("/") + "/" + FILE_INDEX_NAME
+    if spark is not None:
+        text = ReadTextFile(spark, indexPath)
+        return None if text is None else ParseFileIndex(text)
+
+    import pyarrow.fs
+    fs, path = pyarrow.fs.FileSystem.from_uri(indexPath)
+    if fs.get_file_info(path).type == pyarrow.fs.FileType.NotFound:
+        return None
+    with fs.open_input_stream(path) as inputStream:
+        return ParseFileIndex(inputStream.read().decode("utf-8"))
+
+
+def MayContainRows(entry, predicate):
+    """predicate: { column: (low, high) } with inclusive bounds (None for an open bound).
+       year and month are matched against the partition of the file."""
+    if entry["rows"] == 0:
+        return False
+    fileYear, fileMonth = GetPartition(entry["path"])
+    for columnName, (low, high) in predicate.items():
+        if columnName == "year" or columnName == "month":
+            minValue = maxValue = fileYear if columnName == "year" else fileMonth
+        elif columnName in entry["min"]:
+            minValue, maxValue = entry["min"][columnName], entry["max"][columnName]
+            if minValue is None:
+                # Only nulls in the file
+                return False
+        else:
+            # Not indexed: cannot rule the file out
+            continue
+        if low is not None and maxValue < FormatIndexValue(low):
+            return False
+        if high is not None and minValue > FormatIndexValue(high):
+            return False
+    return True
+
+
+def GetFilesForPredicate(tablePath, predicate, fileIndex=None, spark=None):
+    """Returns the paths of the files that may contain rows matching the predicate, e.g.
+       GetFilesForPredicate("gs://bucket/processed/taxi-data/yellow/trips_table/parquet",
+                            { "Pickup_DateTime": (datetime.datetime(2021, 1, 15), datetime.datetime(2021, 1, 16)),
+                              "PULocationID": (132, 132) })
+       No listing and no footer reads: only the index is read (or passed in).  Naive datetimes are UTC.
+       The paths of the index are relative to the table root, the index and the files stay there (a compaction
+       replaces the files folder by folder and updates the index), so a passed index is joined to the same root."""
+    tableRoot = tablePath.rstrip("/")
+    if fileIndex is None:
+        fileIndex = ReadFileIndex(tableRoot, spark)
+        if fileIndex is None:
+            raise FileNotFoundError("GetFilesForPredicate: no " + FILE_INDEX_NAME + " in " + tableRoot)
+    return [tableRoot + "/" + entry["path"] for entry in fileIndex if MayContainRows(entry, predicate)]
@@ -0,0 +1,174 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Row order and row group size of the processed Parquet files.
+#          Each row group has min/max statistics per column.  Readers (Spark, BigQuery/BigLake external
+#          tables) skip the row groups whose min/max cannot match a filter, which only works when the
+#          rows are clustered on the filtered columns.  Files are written in arbitrary order otherwise.
+#          GetOverlapMetrics measures how well the rows are clustered: the share of the row groups whose min/max
+#          ranges overlap on a column (with no overlap, an equality filter reads at most a row group or two).
+#          Ship this file with the job: --py-files gs://${rawBucket}/pyspark-code/parquet_layout.py
+
+import bisect
+
+from pyspark.sql.functions import expr
+
+# Row order within each output file
+#   none:   as produced by the shuffle (original behavior)
+#   sort:   sorted by the partition columns then the sort columns (e.g. Pickup_DateTime, PULocationID)
+#   zorder: sorted by the partition columns then a Z-order (interleaved bits) of the Z-order columns,
+#           so filters on either column skip row groups, not just filters on the first column
+LAYOUTS = ["none", "sort", "zorder"]
+
+DEFAULT_SORT_COLUMNS = ["Pickup_DateTime", "PULocationID"]
+DEFAULT_ZORDER_COLUMNS = ["PULocationID", "DOLocationID"]
+
+# Parquet defaults to 128 MB row groups, so a 256 MB file only has 2 row groups to skip.
+# Smaller row groups give finer skipping at the cost of a larger footer and more reads per file.
+DEFAULT_ROW_GROUP_SIZE_MB = 32
+
+# Bits used per Z-order column: the values are integers (e.g. taxi zone ids 1..265) below 2^16
+ZORDER_BITS = 16
+
+
+def ZOrderValue(zorderColumns, bits=ZORDER_BITS):
+    """Returns a column that interleaves the bits of the (integer) Z-order columns:
+       bit i of column c goes to bit i * len(zorderColumns) + c"""
+    terms = []
+    for bit in range(bits):
+        for columnIndex, zorderColumn in enumerate(zorderColumns):
+            columnValue = "pmod(cast(`{}` as bigint), {})".format(zorderColumn, 1 << bits)
+            terms.append("shiftleft(shiftright({}, {}) & 1, {})".format(columnValue, bit, bit * len(zorderColumns) + columnIndex))
+    return expr(" | ".join(terms))
+
+
+def ApplyLayout(df, partitionCols, parquetLayout):
+    """Sorts the rows within each Spark partition (output file).  The partition columns come first so the
+       sort also satisfies the ordering the partitioned file writer needs (no second sort)."""
+    if parquetLayout is None or parquetLayout[0] == "none":
+        return df
+    layout, layoutColumns, rowGroupSizeBytes = parquetLayout
+
+    if layout == "sort":
+        return df.sortWithinPartitions(*(partitionCols + layoutColumns))
+
+    return df \
+        .withColumn("_zorder", ZOrderValue(layoutColumns)) \
+        .sortWithinPartitions(*(partitionCols + ["_zorder"])) \
+        .drop("_zorder")
+
+
+def RangePartitionByLayout(df, numberOfPartitions, parquetLayout):
+    """Range partitions the rows on the layout columns (or their Z-order) into numberOfPartitions and sorts each
+       partition, so the files do not overlap each other either"""
+    layout, layoutColumns, rowGroupSizeBytes = parquetLayout
+    if layout == "none":
+        return df.repartition(numberOfPartitions)
+
+    if layout == "sort":
+        return df \
+            .repartitionByRange(numberOfPartitions, *layoutColumns) \
+            .sortWithinPartitions(*layoutColumns)
+
+    return df \
+        .withColumn("_zorder", ZOrderValue(layoutColumns)) \
+        .repartitionByRange(numberOfPartitions, "_zorder") \
+        .sortWithinPartitions("_zorder") \
+        .drop("_zorder")
+
+
+def GetParquetLayout(layout, layoutColumns=None, rowGroupSizeMB=None):
+    """Returns the (layout, columns, row group size in bytes) passed to the writers or None for the default layout"""
+    if layout == "none":
+        if rowGroupSizeMB is None:
+            return None
+        return ("none", [], int(rowGroupSizeMB * 1024 * 1024))
+
+    if layoutColumns is None:
+        layoutColumns = DEFAULT_SORT_COLUMNS if layout == "sort" else DEFAULT_ZORDER_COLUMNS
+    if rowGroupSizeMB is None:
+        rowGroupSizeMB = DEFAULT_ROW_GROUP_SIZE_MB
+    return (layout, layoutColumns, int(rowGroupSizeMB * 1024 * 1024))
+
+
+def ConfigureParquetLayout(spark, parquetLayout):
+    """Spark writes timestamps as INT96 by default which has no min/max statistics, so row groups
+       could not be skipped on Pickup_DateTime.  TIMESTAMP_MICROS is read as TIMESTAMP by BigQuery."""
+    if parquetLayout is not None and parquetLayout[0] != "none":
+        spark.conf.set("spark.sql.parquet.outputTimestampType", "TIMESTAMP_MICROS")
+
+
+def GetParquetWriterOptions(parquetLayout):
+    """Returns the options of the Parquet writer (e.g. .options(**GetParquetWriterOptions(parquetLayout)))"""
+    if parquetLayout is None:
+        return {}
+    return {"parquet.block.size": str(parquetLayout[2])}
+
+
+def GetFooterWriterSettings(footer):
+    """Returns (spark.sql.parquet.outputTimestampType, compression codec) a file was written with, from its footer
+       (parquet-mr ParquetMetadata): INT96, TIMESTAMP_MICROS or TIMESTAMP_MILLIS (None without timestamp columns)
+       and the codec of its first column chunk, e.g. snappy (None without row groups)."""
+    timestampType = None
+    columns = footer.getFileMetaData().getSchema().getColumns()
+    for index in range(columns.size()):
+        primitiveType = columns.get(index).getPrimitiveType()
+        annotation = primitiveType.getLogicalTypeAnnotation()
+        if primitiveType.getPrimitiveTypeName().name() == "INT96":
+            timestampType = "INT96"
+        elif annotation is not None and annotation.toString().startswith("TIMESTAMP(MICROS"):
+            timestampType = "TIMESTAMP_MICROS"
+        elif annotation is not None and annotation.toString().startswith("TIMESTAMP(MILLIS"):
+            timestampType = "TIMESTAMP_MILLIS"
+
+    codec = None
+    blocks = footer.getBlocks()
+    if blocks.size() > 0 and blocks.get(0).getColumns().size() > 0:
+        codec = blocks.get(0).getColumns().get(0).getCodec().name().lower()
+    return timestampType, codec
+
+
+################################################################################################
+# Row group overlap (from the footers, see parquet_row_group_stitcher.ReadFooter)
+################################################################################################
+def GetRowGroupRanges(footers, columns):
+    """Returns { column: [(min, max)] } of the row groups of the footers (parquet-mr ParquetMetadata).
+       A row group without statistics (INT96 timestamps, all nulls) has no range."""
+    ranges = {column: [] for column in columns}
+    for footer in footers:
+        blocks = footer.getBlocks()
+        for blockIndex in range(blocks.size()):
+            columnChunks = blocks.get(blockIndex).getColumns()
+            for chunkIndex in range(columnChunks.size()):
+                columnChunk = columnChunks.get(chunkIndex)
+                column = columnChunk.getPath().toDotString()
+                statistics = columnChunk.getStatistics()
+                if column in ranges and statistics is not None and statistics.hasNonNullValue():
+                    ranges[column].append((statistics.genericGetMin(), statistics.genericGetMax()))
+    return ranges
+
+
+def GetOverlapMetrics(ranges):
+    """Returns (row groups, share of the row group pairs whose ranges overlap, average number of other row groups
+       each one overlaps), sorted bounds so it stays fast with thousands of row groups"""
+    if len(ranges) < 2:
+        return len(ranges), 0.0, 0.0
+    minValues = sorted(minValue for minValue, maxValue in ranges)
+    maxValues = sorted(maxValue for minValue, maxValue in ranges)
+    # Row groups starting at or before the end of a row group, minus those ending before its start, minus itself
+    overlaps = [bisect.bisect_right(minValues, maxValue) - bisect.bisect_left(maxValues, minValue) - 1 for minValue, maxValue in ranges]
+    pairs = len(ranges) * (len(ranges) - 1) / 2
+    return len(ranges), sum(overlaps) / 2 / pairs, sum(overlaps) / float(len(ranges))
@@ -0,0 +1,78 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Named Parquet writer profiles (codec, dictionary encoding, bloom filters, page size).
+#          The options are passed to the Spark Parquet writer and from there to parquet-mr (ParquetOutputFormat).
+#          parquet-mr always writes the column index / offset index (page level min/max), a smaller page
+#          size makes it finer so point lookups read fewer pages of the row groups that are not skipped.
+#          Compare the profiles with benchmarks/benchmark_parquet_writer_profiles.py.
+#          Ship this file with the job: --py-files gs://${rawBucket}/pyspark-code/parquet_writer_profiles.py
+
+# The ID columns the queries filter on (sql-scripts/taxi_dataset/sp_demo_bigquery_queries.sql).
+# Vendor_Id and Payment_Type_Id only have a handful of values, min/max and the dictionary already cover those.
+BLOOM_FILTER_COLUMNS = {
+    "PULocationID": 265,    # taxi zones, value = expected number of distinct values in a row group
+    "DOLocationID": 265
+}
+
+# Small pages for a finer page index (the parquet-mr default is 1 MB)
+LOOKUP_PAGE_SIZE_BYTES = 128 * 1024
+
+
+def BloomFilterOptions(bloomFilterColumns, dictionaryEncoding):
+    options = {}
+    for columnName, expectedDistinctValues in bloomFilterColumns.items():
+        options["parquet.bloom.filter.enabled#" + columnName] = "true"
+        options["parquet.bloom.filter.expected.ndv#" + columnName] = str(expectedDistinctValues)
+        options["parquet.enable.dictionary#" + columnName] = str(dictionaryEncoding).lower()
+    return options
+
+
+def LookupOptions(compression, dictionaryEncoding):
+    options = {
+        "compression": compression,
+        "parquet.enable.dictionary": "true",
+        "parquet.page.size": str(LOOKUP_PAGE_SIZE_BYTES)
+    }
+    options.update(BloomFilterOptions(BLOOM_FILTER_COLUMNS, dictionaryEncoding))
+    return options
+
+
+# parquet-mr does not write the bloom filter of a column chunk that is entirely dictionary encoded, the
+# dictionary is an exact filter already.  With ~265 zones the location ids stay dictionary encoded, so the
+# bloom filters of zstd-lookup are only written when a chunk falls back to plain encoding (e.g. large row groups).
+# zstd-bloom turns off the dictionary of those columns so the bloom filters are always written (larger columns).
+#
+# default:     Spark defaults (Snappy, dictionary encoding, 1 MB pages, no bloom filters)
+# zstd:        ZSTD instead of Snappy, smaller files for slightly more CPU when writing/reading
+# zstd-lookup: ZSTD + small pages for the page index + bloom filters on the location ids (dictionary kept)
+# zstd-bloom:  ZSTD + small pages for the page index + bloom filters on the location ids (dictionary off)
+PROFILES = {
+    "default":     {},
+    "zstd":        {"compression": "zstd", "parquet.enable.dictionary": "true"},
+    "zstd-lookup": LookupOptions("zstd", True),
+    "zstd-bloom":  LookupOptions("zstd", False)
+}
+
+
+def GetProfileWriterOptions(profileName):
+    """Returns the options of the Parquet writer for a profile (e.g. .options(**GetProfileWriterOptions("zstd")))"""
+    if profileName is None:
+        return {}
+    if profileName not in PROFILES:
+        raise ValueError("GetProfileWriterOptions: unknown Parquet writer profile " + profileName +
+                         " (profiles: " + ", ".join(PROFILES) + ")")
+    return PROFILES[profileName]
@@ -0,0 +1,113 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Manifest of the raw files that have been converted (path, size and generation).
+#          An incremental run compares the current raw files with the manifest in both directions (new or changed
+#          files, and deleted files that are only in the manifest) and only rewrites the partitions they touch.
+#          The manifest is a small JSON file:
+#          { "files": { "gs://.../yellow_tripdata_2022-04.parquet": { "size": 55682369, "generation": 1660000000000000 } },
+#            "partitions": { "gs://.../yellow_tripdata_2022-04.parquet": [[2022, 3], [2022, 4]] } }
+#          "partitions" are the year/month partitions of the trips table that have rows of each file (by pickup date,
+#          a TLC file also holds a few trips of other months), so the partitions a changed file touches are rewritten
+#          with the rows of every file that has rows in them, and a partition no current file has rows in is cleared.
+#          Ship this file with the job: --py-files gs://${rawBucket}/pyspark-code/raw_file_manifest.py
+
+import json
+import re
+
+from hadoop_fs_utils import GetFileSystem, ReadTextFile, WriteTextFile
+
+
+def GetGcsGenerations(source):
+    """Returns { gs:// path: object generation } for the objects under the static prefix of a glob.
+       Returns None when the google-cloud-storage library is not installed."""
+    try:
+        from google.cloud import storage
+    except ImportError:
+        return None
+
+    bucketName, _, objectPattern = source[len("gs://"):].partition("/")
+    prefix = re.split(r"[*?\[{]", objectPattern, 1)[0]
+    client = storage.Client()
+    generations = {}
+    for blob in client.list_blobs(bucketName, prefix=prefix):
+        generations["gs://" + bucketName + "/" + blob.name] = blob.generation
+    return generations
+
+
+def ListRawFiles(spark, source):
+    """Returns { path: { "size": bytes, "generation": n } } for the files matching a glob.
+       The generation is the GCS object generation, or the modification time for other file systems."""
+    fs, hadoopPath = GetFileSystem(spark, source)
+    statuses = fs.globStatus(hadoopPath)
+    generations = None
+    if source.startswith("gs://"):
+        generations = GetGcsGenerations(source)
+
+    files = {}
+    for status in (statuses or []):
+        if not status.isFile():
+            continue
+        path = status.getPath().toString()
+        generation = status.getModificationTime()
+        if generations is not None and path in generations:
+            generation = generations[path]
+        files[path] = { "size": status.getLen(), "generation": generation }
+    return files
+
+
+def ReadManifest(spark, manifestPath):
+    """Returns the files of the manifest ({} when there is no manifest yet)"""
+    text = ReadTextFile(spark, manifestPath)
+    if text is None:
+        return {}
+    return json.loads(text)["files"]
+
+
+def ReadManifestPartitions(spark, manifestPath):
+    """Returns { path: [(year, month)] } of the manifest ({} when there is no manifest or it has no partitions)"""
+    text = ReadTextFile(spark, manifestPath)
+    if text is None:
+        return {}
+    partitionsByFile = json.loads(text).get("partitions", {})
+    return {path: [tuple(partition) for partition in partitions] for path, partitions in partitionsByFile.items()}
+
+
+def WriteManifest(spark, manifestPath, files, partitionsByFile=None):
+    manifest = { "files": files }
+    if partitionsByFile is not None:
+        manifest["partitions"] = {path: sorted(partitions) for path, partitions in partitionsByFile.items()}
+    WriteTextFile(spark, manifestPath, json.dumps(manifest, indent=1, sort_keys=True))
+
+
+def GetFilesForPartitions(partitionsByFile, partitions):
+    """Returns the paths that have rows in any of the [(year, month)] partitions"""
+    partitions = set(partitions)
+    return sorted(path for path, filePartitions in partitionsByFile.items() if partitions.intersection(filePartitions))
+
+
+def GetNewOrChangedFiles(currentFiles, manifestFiles):
+    """Returns the paths that are not in the manifest or whose size/generation changed"""
+    changedFiles = []
+    for path, fileInfo in sorted(currentFiles.items()):
+        if manifestFiles.get(path) != fileInfo:
+            changedFiles.append(path)
+    return changedFiles
+
+
+def GetDeletedFiles(currentFiles, manifestFiles):
+    """Returns the paths of the manifest that are no longer in the current raw files"""
+    return sorted(path for path in manifestFiles if path not in currentFiles)
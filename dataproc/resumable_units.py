@@ -0,0 +1,105 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Units of work of a resumable conversion, one per (color, format, year, month).
+#          A unit is written to a staging folder, moved to its year=/month= folder of the trips table and then
+#          committed with a small marker file that records the raw files (path, size, generation) it was built from:
+#          every raw file with rows in the year/month (a TLC file also holds a few trips of other months), from
+#          <destination>_commits/<color>/_raw_file_partitions.json (raw_file_manifest.py format), and the output
+#          options it was written with (layout, Parquet profile, denormalize, Airport_Fee, file size, schema mode).
+#          A restarted run skips the units whose marker matches the current raw files and options, a unit that failed
+#          at any step (no marker) or was written with other options is written again from scratch.
+#            <destination>_staging/<color>/<format>/year=2021/month=1/      (deleted by the move)
+#            <destination><color>/trips_table/<format>/year=2021/month=1/
+#            <destination>_commits/<color>/<format>/year=2021/month=1.json
+#          Ship this file with the job: --py-files gs://${rawBucket}/pyspark-code/resumable_units.py
+
+import datetime
+import json
+
+from hadoop_fs_utils import DeletePath, ReadTextFile, RenamePath, WriteTextFile
+
+TRIPS_TABLE_FORMATS = ["parquet", "csv", "json"]
+
+
+def GetUnitPaths(destination, color, outputFormat, unitYear, unitMonth):
+    """Returns the staging folder, the partition folder and the commit marker of a unit"""
+    partition = "year=" + str(unitYear) + "/month=" + str(unitMonth)
+    stagingPath = destination + "_staging/" + color + "/" + outputFormat + "/" + partition
+    partitionPath = destination + color + "/trips_table/" + outputFormat + "/" + partition
+    markerPath = destination + "_commits/" + color + "/" + outputFormat + "/" + partition + ".json"
+    return stagingPath, partitionPath, markerPath
+
+
+def GetFileIndexMarkerPath(destination, color):
+    """Marker of the _file_index.json of the Parquet trips table, removed when a Parquet unit is committed"""
+    return destination + "_commits/" + color + "/parquet/_file_index.json"
+
+
+def GetRawFilePartitionsPath(destination, color):
+    """The raw files and the year/month partitions each has rows in, read once and kept for the restarted runs"""
+    return destination + "_commits/" + color + "/_raw_file_partitions.json"
+
+
+def GroupRawFilesByPartition(rawFiles, partitionsByFile):
+    """Returns { (year, month): { path: { size, generation } } } for the files of ListRawFiles, a file is in every
+       partition it has rows in ({ path: [(year, month)] })"""
+    filesByPartition = {}
+    for path, fileInfo in rawFiles.items():
+        for partition in partitionsByFile[path]:
+            filesByPartition.setdefault(tuple(partition), {})[path] = fileInfo
+    return filesByPartition
+
+
+def GetUnitOptions(parquetLayout, parquetProfile, denormalize, includeAirportFee, targetFileSizeBytes, schemaMode):
+    """Returns the output options recorded in the unit markers, as they read back from the marker JSON"""
+    return json.loads(json.dumps({
+        "layout": parquetLayout,
+        "parquetProfile": parquetProfile,
+        "denormalize": denormalize,
+        "includeAirportFee": includeAirportFee,
+        "targetFileSizeBytes": targetFileSizeBytes,
+        "schemaMode": schemaMode
+    }))
+
+
+def IsUnitCommitted(spark, markerPath, sourceFiles, unitOptions):
+    """True when the unit was committed from the same raw files with the same output options
+       (a changed raw file or option makes the unit run again)"""
+    text = ReadTextFile(spark, markerPath)
+    if text is None:
+        return False
+    marker = json.loads(text)
+    return marker["sourceFiles"] == sourceFiles and marker.get("options") == unitOptions
+
+
+def PrepareUnit(spark, stagingPath):
+    """Removes what a failed attempt left in the staging folder"""
+    DeletePath(spark, stagingPath)
+
+
+def CommitUnit(spark, stagingPath, partitionPath, markerPath, sourceFiles, unitOptions):
+    """Replaces the partition folder with the staging folder and writes the marker.
+       The marker is written last: a crash before it leaves the unit uncommitted and it is redone."""
+    # Spark's job marker, the partition folders of the partitioned writes do not have one
+    DeletePath(spark, stagingPath + "/_SUCCESS")
+    DeletePath(spark, partitionPath)
+    RenamePath(spark, stagingPath, partitionPath)
+    WriteTextFile(spark, markerPath, json.dumps({
+        "sourceFiles": sourceFiles,
+        "options": unitOptions,
+        "committed": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    }, indent=1, sort_keys=True))
@@ -0,0 +1,71 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Reads job/stage metrics for the current Spark application from the driver's
+#          monitoring REST API (http://<driver>:4040/api/v1/...).
+#          Jobs are grouped with sc.setJobGroup() so the metrics of one write can be isolated.
+#          Ship this file with the job: --py-files gs://${rawBucket}/pyspark-code/spark_job_metrics.py
+
+import json
+import time
+import urllib.request
+
+
+def GetRestApiJson(spark, relativeUrl):
+    sc = spark.sparkContext
+    url = sc.uiWebUrl + "/api/v1/applications/" + sc.applicationId + relativeUrl
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def GetStageIdsForJobGroup(spark, jobGroup):
+    statusTracker = spark.sparkContext.statusTracker()
+    stageIds = []
+    for jobId in statusTracker.getJobIdsForGroup(jobGroup):
+        jobInfo = statusTracker.getJobInfo(jobId)
+        if jobInfo is not None:
+            stageIds.extend(jobInfo.stageIds)
+    return sorted(set(stageIds))
+
+
+def GetStageMetrics(spark, stageIds, waitSeconds=10):
+    """Returns the REST API stage data (last attempt) for each stage that actually ran.
+       Stages skipped by Spark (e.g. shuffle output reused) are not returned.
+       The status store is updated asynchronously, so wait a little for the final numbers."""
+    deadline = time.time() + waitSeconds
+    while True:
+        stages = []
+        pending = False
+        for stageId in stageIds:
+            attempts = GetRestApiJson(spark, "/stages/" + str(stageId))
+            attempt = max(attempts, key=lambda stageAttempt: stageAttempt["attemptId"])
+            if attempt["status"] == "SKIPPED":
+                continue
+            if attempt["status"] in ("ACTIVE", "PENDING"):
+                pending = True
+            stages.append(attempt)
+        if not pending or time.time() > deadline:
+            return stages
+        time.sleep(1)
+
+
+def GetInputBytesForJobGroup(spark, jobGroup):
+    """Returns the bytes read from storage (Hadoop input metrics) by all the jobs of a job group"""
+    if spark.sparkContext.uiWebUrl is None:
+        print("GetInputBytesForJobGroup: Spark UI is disabled, input bytes are not available")
+        return None
+    stages = GetStageMetrics(spark, GetStageIdsForJobGroup(spark, jobGroup))
+    return sum(stage["inputBytes"] for stage in stages)
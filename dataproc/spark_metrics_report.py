@@ -0,0 +1,250 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Writes the metrics of every SQL execution of a job as one JSON report at the end of the job, so the
+#          Dataproc jobs can be compared run over run.  The metrics are read once, after the job, from the driver's
+#          monitoring REST API (spark_job_metrics.py): nothing is registered on the listener bus while the job runs
+#          (a Python SparkListener is called through py4j for every event, e.g. each task end).
+#          The jobs write a report only with --metrics-path.
+#          For each write: duration, input/output bytes and records, shuffle bytes, spill and the task skew of
+#          its slowest stage, and the peak memory of the executors over the run.
+#          The REST API only keeps the last spark.ui.retainedJobs / spark.ui.retainedStages (1000) jobs and stages and
+#          the last spark.sql.ui.retainedExecutions (1000) SQL executions, the older ones are not in the report.
+#          One report per run: <metricsPath>/<job>-<UTC time>.json
+#          {
+#            "version": 1, "job": "ConvertTaxiData", "applicationId": "...", "startTime": "...", "wallSeconds": 512.3,
+#            "parameters": { "destination": "gs://...", ... },
+#            "writes": [ { "executionId": 3, "description": "...", "jobGroup": "yellow-parquet",
+#                          "command": "InsertIntoHadoopFsRelationCommand", "outputPath": "gs://...", "status": "succeeded",
+#                          "durationSeconds": 41.2, "stages": 2, "tasks": 210, "inputBytes": ..., "inputRecords": ...,
+#                          "outputBytes": ..., "outputRecords": ..., "shuffleReadBytes": ..., "shuffleWriteBytes": ...,
+#                          "memoryBytesSpilled": ..., "diskBytesSpilled": ..., "executorCpuSeconds": ...,
+#                          "taskSkew": { "stageId": 7, "tasks": 200, "medianTaskSeconds": 1.9, "maxTaskSeconds": 8.4, "ratio": 4.42 } } ],
+#            "totals": { "executions": 12, "stages": 30, "tasks": 900, "inputBytes": ..., ... },
+#            "peakExecutorMemory": { "JVMHeapMemory": ..., "OnHeapExecutionMemory": ..., ... }
+#          }
+#          Ship this file with the job: --py-files gs://${rawBucket}/pyspark-code/spark_metrics_report.py
+#          (and gs://${rawBucket}/pyspark-code/spark_job_metrics.py)
+
+import datetime
+import json
+import re
+import time
+
+from py4j.protocol import Py4JError
+
+from hadoop_fs_utils import WriteTextFile
+from spark_job_metrics import GetRestApiJson
+
+METRICS_REPORT_VERSION = 1
+
+STAGE_METRICS = ["inputBytes", "inputRecords", "outputBytes", "outputRecords",
+                 "shuffleReadBytes", "shuffleWriteBytes", "memoryBytesSpilled", "diskBytesSpilled", "executorCpuSeconds"]
+
+# Executor metrics, the peak of each over all the executors of the run is reported (bytes)
+EXECUTOR_MEMORY_METRICS = ["JVMHeapMemory", "JVMOffHeapMemory", "OnHeapExecutionMemory", "OffHeapExecutionMemory",
+                           "OnHeapStorageMemory", "OffHeapStorageMemory", "ProcessTreeJVMRSSMemory"]
+
+# Nodes of the physical plans that write data: file sources (parquet/csv/json), Hive and DataSource V2 (Iceberg)
+WRITE_COMMANDS = ["InsertIntoHadoopFsRelationCommand", "InsertIntoHiveTable", "SaveIntoDataSourceCommand",
+                  "CreateDataSourceTableAsSelectCommand", "AppendData", "OverwriteByExpression",
+                  "OverwritePartitionsDynamic", "ReplaceData", "WriteDelta", "DeleteFromTable", "UpdateTable",
+                  "MergeIntoTable", "CreateTableAsSelect", "AtomicCreateTableAsSelect", "ReplaceTableAsSelect",
+                  "AtomicReplaceTableAsSelect"]
+
+# Lines of the plan tree: "+- Execute InsertIntoHadoopFsRelationCommand (4)", "AppendDataExec (3)", "*(1) Project ..."
+PLAN_NODE_PATTERN = re.compile(r"^[\s:|+\-]*(?:\*\s*(?:\(\d+\)\s*)?)?(?:Execute )?(\w+)")
+OUTPUT_PATH_PATTERN = re.compile(r"InsertIntoHadoopFsRelationCommand[^\n]*\n(?:Input[^\n]*\n)?Arguments: ([^,\s]+),|InsertIntoHadoopFsRelationCommand ([^,\s]+),")
+
+# Status of the SQL executions in the REST API: status of the writes in the report
+EXECUTION_STATUS = {"RUNNING": "running", "COMPLETED": "succeeded", "FAILED": "failed"}
+
+# The REST API returns 20 SQL executions by default
+MAX_SQL_EXECUTIONS = 100000
+
+
+def ParsePhysicalPlan(planDescription):
+    """Returns (write command of the plan, or its root node when it does not write, output path of a file source write or None).
+       The write is not always the root, e.g. AdaptiveSparkPlan +- Execute InsertIntoHadoopFsRelationCommand."""
+    nodes = []
+    for line in planDescription.split("== Physical Plan ==")[-1].strip().split("\n"):
+        if line.strip() == "":
+            # End of the tree, the details of the nodes follow
+            break
+        match = PLAN_NODE_PATTERN.match(line)
+        if match is not None:
+            node = match.group(1)
+            nodes.append(node[:-len("Exec")] if node.endswith("Exec") else node)
+
+    writeCommands = [node for node in nodes if node in WRITE_COMMANDS]
+    command = writeCommands[0] if len(writeCommands) > 0 else nodes[0] if len(nodes) > 0 else None
+
+    outputPath = None
+    match = OUTPUT_PATH_PATTERN.search(planDescription)
+    if match is not None:
+        outputPath = match.group(1) or match.group(2)
+    return command, outputPath
+
+
+def FormatTime(epochMillis):
+    return datetime.datetime.utcfromtimestamp(epochMillis / 1000.0).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def WaitForListenerBus(spark, waitSeconds=30):
+    """Waits for the listener bus to deliver the pending events to the status store (e.g. the stage metrics of the last job)"""
+    try:
+        spark.sparkContext._jsc.sc().listenerBus().waitUntilEmpty(waitSeconds * 1000)
+    except Py4JError as e:
+        print("WaitForListenerBus: events still pending after " + str(waitSeconds) + " seconds: " + str(e))
+
+
+def GetStageMetrics(spark):
+    """Returns { stageId: { "attemptId": last attempt that ran, "tasks": ..., metric: value } } summed over the attempts of
+       each stage.  Skipped stages (shuffle output reused) and stages not run yet are not returned."""
+    stageMetrics = {}
+    for stage in GetRestApiJson(spark, "/stages?details=false"):
+        if stage["status"] in ("SKIPPED", "PENDING"):
+            continue
+        metrics = stageMetrics.setdefault(stage["stageId"], {"attemptId": stage["attemptId"], "tasks": 0})
+        metrics["attemptId"] = max(metrics["attemptId"], stage["attemptId"])
+        metrics["tasks"] += stage["numTasks"]
+        for metricName in STAGE_METRICS:
+            value = stage["executorCpuTime"] / 1000000000.0 if metricName == "executorCpuSeconds" else stage[metricName]
+            metrics[metricName] = metrics.get(metricName, 0) + value
+    return stageMetrics
+
+
+def GetJobs(spark):
+    """Returns { jobId: (job group or None, [stageId]) }"""
+    return {job["jobId"]: (job.get("jobGroup"), job["stageIds"]) for job in GetRestApiJson(spark, "/jobs")}
+
+
+def SumStageMetrics(stageMetrics, stageIds):
+    totals = {"stages": 0, "tasks": 0}
+    totals.update({metricName: 0 for metricName in STAGE_METRICS})
+    for stageId in stageIds:
+        metrics = stageMetrics.get(stageId)
+        if metrics is None:
+            # Skipped (shuffle output reused) or not run
+            continue
+        totals["stages"] += 1
+        totals["tasks"] += metrics["tasks"]
+        for metricName in STAGE_METRICS:
+            totals[metricName] += metrics[metricName]
+    totals["executorCpuSeconds"] = round(totals["executorCpuSeconds"], 3)
+    return totals
+
+
+def GetTaskSkew(spark, stageMetrics, stageIds):
+    """Task durations of the stage with the slowest task (the one that sets the duration of the write), from the
+       task summary of the last attempt of each stage (successful tasks)"""
+    slowestStage = None
+    for stageId in stageIds:
+        if stageId not in stageMetrics:
+            continue
+        taskSummary = GetRestApiJson(spark, "/stages/{}/{}/taskSummary?quantiles=0.5,1.0".format(stageId, stageMetrics[stageId]["attemptId"]))
+        medianTaskSeconds, maxTaskSeconds = [milliseconds / 1000.0 for milliseconds in taskSummary["duration"]]
+        if slowestStage is None or maxTaskSeconds > slowestStage[2]:
+            slowestStage = (stageId, medianTaskSeconds, maxTaskSeconds)
+    if slowestStage is None:
+        return None
+    stageId, medianTaskSeconds, maxTaskSeconds = slowestStage
+    return {
+        "stageId":           stageId,
+        "tasks":             stageMetrics[stageId]["tasks"],
+        "medianTaskSeconds": round(medianTaskSeconds, 3),
+        "maxTaskSeconds":    round(maxTaskSeconds, 3),
+        "ratio":             None if medianTaskSeconds == 0 else round(maxTaskSeconds / medianTaskSeconds, 2)
+    }
+
+
+def GetPeakExecutorMemory(spark):
+    """Peak of each executor memory metric over all the executors of the run (the removed ones too)"""
+    peakMemory = {}
+    for executor in GetRestApiJson(spark, "/allexecutors"):
+        for metricName, value in (executor.get("peakMemoryMetrics") or {}).items():
+            if metricName in EXECUTOR_MEMORY_METRICS:
+                peakMemory[metricName] = max(peakMemory.get(metricName, 0), value)
+    return peakMemory
+
+
+def GetMetricsReport(spark, jobName, parameters=None):
+    WaitForListenerBus(spark)
+    startTime = GetRestApiJson(spark, "")["attempts"][0]["startTimeEpoch"] / 1000.0
+    stageMetrics = GetStageMetrics(spark)
+    jobs = GetJobs(spark)
+    executions = GetRestApiJson(spark, "/sql?details=false&length=" + str(MAX_SQL_EXECUTIONS))
+
+    writes = []
+    for execution in sorted(executions, key=lambda execution: execution["id"]):
+        command, outputPath = ParsePhysicalPlan(execution["planDescription"])
+        if command not in WRITE_COMMANDS:
+            continue
+        jobIds = sorted(execution["successJobIds"] + execution["failedJobIds"] + execution["runningJobIds"])
+        jobGroups = [jobs[jobId][0] for jobId in jobIds if jobId in jobs and jobs[jobId][0] is not None]
+        stageIds = sorted(set(stageId for jobId in jobIds if jobId in jobs for stageId in jobs[jobId][1]))
+        status = EXECUTION_STATUS.get(execution["status"], execution["status"].lower())
+        write = {
+            "executionId": execution["id"],
+            "description": execution["description"],
+            "jobGroup":    jobGroups[0] if len(jobGroups) > 0 else None,
+            "command":     command,
+            "outputPath":  outputPath,
+            "status":      status,
+            "durationSeconds": None if status == "running" else execution["duration"] / 1000.0,
+            "taskSkew":    GetTaskSkew(spark, stageMetrics, stageIds)
+        }
+        write.update(SumStageMetrics(stageMetrics, stageIds))
+        writes.append(write)
+
+    totals = {"executions": len(executions), "writes": len(writes)}
+    totals.update(SumStageMetrics(stageMetrics, stageMetrics))
+
+    return {
+        "version":       METRICS_REPORT_VERSION,
+        "job":           jobName,
+        "applicationId": spark.sparkContext.applicationId,
+        "startTime":     FormatTime(startTime * 1000),
+        "wallSeconds":   round(time.time() - startTime, 3),
+        "parameters":    parameters or {},
+        "writes":        writes,
+        "totals":        totals,
+        "peakExecutorMemory": GetPeakExecutorMemory(spark)
+    }
+
+
+def WriteMetricsReport(spark, metricsPath, jobName, parameters=None):
+    """Writes the report of the job, call before spark.stop().
+       metricsPath: a .json file or a directory (local, hdfs:// or gs://) for <jobName>-<UTC time>.json
+       Returns the report, None when the Spark UI (and its REST API) is disabled."""
+    if spark.sparkContext.uiWebUrl is None:
+        print("WriteMetricsReport: Spark UI is disabled, no metrics report")
+        return None
+    report = GetMetricsReport(spark, jobName, parameters)
+
+    for write in report["writes"]:
+        print("WriteMetricsReport: {} {} seconds: {} input bytes: {} output bytes: {} output records: {} shuffle bytes: {} spill bytes: {} task skew: {}".format(
+            write["command"], write["outputPath"] or write["description"], write["durationSeconds"], write["inputBytes"],
+            write["outputBytes"], write["outputRecords"], write["shuffleWriteBytes"], write["diskBytesSpilled"],
+            None if write["taskSkew"] is None else write["taskSkew"]["ratio"]))
+
+    print("WriteMetricsReport: peak executor memory: " + str(report["peakExecutorMemory"]))
+
+    if not metricsPath.endswith(".json"):
+        metricsPath = metricsPath.rstrip("/") + "/" + jobName + "-" + datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S") + ".json"
+    WriteTextFile(spark, metricsPath, json.dumps(report, indent=1, sort_keys=True))
+    print("WriteMetricsReport: " + metricsPath)
+    return report
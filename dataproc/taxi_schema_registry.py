@@ -0,0 +1,300 @@
+####################################################################################
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+####################################################################################
+
+# Summary: Declared schemas of the raw NYC taxi Parquet files (as downloaded from the TLC site).
+#          Reading with a declared schema skips the footer reads Spark does to infer the schema,
+#          and lets each year be read with its own column types.  Columns whose type changed
+#          between years (e.g. airport_fee INT in 2019, FLOAT in 2020+) are upcast to one type.
+#          A raw file whose types differ from the schema declared for its year fails the read: ExplainRawSchemaError
+#          turns the Spark error into one that names the file and the column.
+#          Ship this file with the job: --py-files gs://${rawBucket}/pyspark-code/taxi_schema_registry.py
+
+from pyspark.sql.functions import col
+from pyspark.sql.types import StructType, StructField, StringType, IntegerType, LongType, DoubleType, TimestampType
+import re
+
+from hadoop_fs_utils import GetFileSystem
+
+
+def YellowRawSchema(airportFeeType):
+    return StructType([
+        StructField('VendorID', LongType(), True),
+        StructField('tpep_pickup_datetime', TimestampType(), True),
+        StructField('tpep_dropoff_datetime', TimestampType(), True),
+        StructField('passenger_count', DoubleType(), True),
+        StructField('trip_distance', DoubleType(), True),
+        StructField('RatecodeID', DoubleType(), True),
+        StructField('store_and_fwd_flag', StringType(), True),
+        StructField('PULocationID', LongType(), True),
+        StructField('DOLocationID', LongType(), True),
+        StructField('payment_type', LongType(), True),
+        StructField('fare_amount', DoubleType(), True),
+        StructField('extra', DoubleType(), True),
+        StructField('mta_tax', DoubleType(), True),
+        StructField('tip_amount', DoubleType(), True),
+        StructField('tolls_amount', DoubleType(), True),
+        StructField('improvement_surcharge', DoubleType(), True),
+        StructField('total_amount', DoubleType(), True),
+        StructField('congestion_surcharge', DoubleType(), True),
+        StructField('airport_fee', airportFeeType, True)
+        ])
+
+
+def GreenRawSchema():
+    return StructType([
+        StructField('VendorID', LongType(), True),
+        StructField('lpep_pickup_datetime', TimestampType(), True),
+        StructField('lpep_dropoff_datetime', TimestampType(), True),
+        StructField('store_and_fwd_flag', StringType(), True),
+        StructField('RatecodeID', DoubleType(), True),
+        StructField('PULocationID', LongType(), True),
+        StructField('DOLocationID', LongType(), True),
+        StructField('passenger_count', DoubleType(), True),
+        StructField('trip_distance', DoubleType(), True),
+        StructField('fare_amount', DoubleType(), True),
+        StructField('extra', DoubleType(), True),
+        StructField('mta_tax', DoubleType(), True),
+        StructField('tip_amount', DoubleType(), True),
+        StructField('tolls_amount', DoubleType(), True),
+        StructField('ehail_fee', DoubleType(), True),
+        StructField('improvement_surcharge', DoubleType(), True),
+        StructField('total_amount', DoubleType(), True),
+        StructField('payment_type', DoubleType(), True),
+        StructField('trip_type', DoubleType(), True),
+        StructField('congestion_surcharge', DoubleType(), True)
+        ])
+
+
+# Schema of the raw files by the first year it applies to
+RAW_SCHEMAS = {
+    "yellow": {
+        2019: YellowRawSchema(IntegerType()),
+        2020: YellowRawSchema(DoubleType())
+    },
+    "green": {
+        2019: GreenRawSchema()
+    }
+}
+
+# Columns whose type changed between years and the type they are upcast to
+DRIFTING_COLUMNS = {
+    "yellow": {
+        "airport_fee": DoubleType()
+    },
+    "green": {
+    }
+}
+
+# Years kept in the trips tables (by pickup date)
+TRIPS_TABLE_YEARS = [2019, 2020, 2021, 2022]
+
+# Columns of the trips tables: (output column, raw column, output type as a Spark SQL type name).
+# Spark renames/casts in convert_taxi_to_parquet.py, the Arrow engine (arrow_taxi_engine.py) applies this list
+# (see GetTripsTableColumns).
+TRIPS_TABLE_COLUMNS = {
+    "yellow": [
+        ("Vendor_Id",             "VendorID",              "bigint"),
+        ("Pickup_DateTime",       "tpep_pickup_datetime",  "timestamp"),
+        ("Dropoff_DateTime",      "tpep_dropoff_datetime", "timestamp"),
+        ("Passenger_Count",       "passenger_count",       "int"),
+        ("Trip_Distance",         "trip_distance",         "double"),
+        ("Rate_Code_Id",          "RatecodeID",            "int"),
+        ("Store_And_Forward",     "store_and_fwd_flag",    "string"),
+        ("PULocationID",          "PULocationID",          "bigint"),
+        ("DOLocationID",          "DOLocationID",          "bigint"),
+        ("Payment_Type_Id",       "payment_type",          "bigint"),
+        ("Fare_Amount",           "fare_amount",           "double"),
+        ("Surcharge",             "extra",                 "double"),
+        ("MTA_Tax",               "mta_tax",               "double"),
+        ("Tip_Amount",            "tip_amount",            "double"),
+        ("Tolls_Amount",          "tolls_amount",          "double"),
+        ("Improvement_Surcharge", "improvement_surcharge", "double"),
+        ("Total_Amount",          "total_amount",          "double"),
+        ("Congestion_Surcharge",  "congestion_surcharge",  "double"),
+        ("Airport_Fee",           "airport_fee",           "double")
+    ],
+    "green": [
+        ("Vendor_Id",             "VendorID",              "bigint"),
+        ("Pickup_DateTime",       "lpep_pickup_datetime",  "timestamp"),
+        ("Dropoff_DateTime",      "lpep_dropoff_datetime", "timestamp"),
+        ("Store_And_Forward",     "store_and_fwd_flag",    "string"),
+        ("Rate_Code_Id",          "RatecodeID",            "int"),
+        ("PULocationID",          "PULocationID",          "bigint"),
+        ("DOLocationID",          "DOLocationID",          "bigint"),
+        ("Passenger_Count",       "passenger_count",       "int"),
+        ("Trip_Distance",         "trip_distance",         "double"),
+        ("Fare_Amount",           "fare_amount",           "double"),
+        ("Surcharge",             "extra",                 "double"),
+        ("MTA_Tax",               "mta_tax",               "double"),
+        ("Tip_Amount",            "tip_amount",            "double"),
+        ("Tolls_Amount",          "tolls_amount",          "double"),
+        ("Ehail_Fee",             "ehail_fee",             "double"),
+        ("Improvement_Surcharge", "improvement_surcharge", "double"),
+        ("Total_Amount",          "total_amount",          "double"),
+        ("Payment_Type_Id",       "payment_type",          "int"),
+        ("Trip_Type",             "trip_type",             "double"),
+        ("Congestion_Surcharge",  "congestion_surcharge",  "double")
+    ]
+}
+
+# Columns read from the raw files but not in the published trips tables (nor the external table definitions)
+# unless asked for, e.g. ConvertTaxiData --include-airport-fee
+OPTIONAL_TRIPS_TABLE_COLUMNS = {
+    "yellow": ["Airport_Fee"],
+    "green":  []
+}
+
+# Lookup tables written next to the trips tables: { table folder: ([columns], [rows]) }
+LOOKUP_TABLES = {
+    "vendor_table": (
+        ["Vendor_Id", "Vendor_Description"],
+        [
+            (1, "Creative Mobile Technologies"),
+            (2, "VeriFone")
+        ]),
+    "rate_code_table": (
+        ["Rate_Code_Id", "Rate_Code_Description"],
+        [
+            (1, "Standard rate"),
+            (2, "JFK"),
+            (3, "Newark"),
+            (4, "Nassau or Westchester"),
+            (5, "Negotiated fare"),
+            (6, "Group ride")
+        ]),
+    "payment_type_table": (
+        ["Payment_Type_Id", "Payment_Type_Description"],
+        [
+            (1, "Credit card"),
+            (2, "Cash"),
+            (3, "No charge"),
+            (4, "Dispute"),
+            (5, "Unknown"),
+            (6, "Voided trip")
+        ]),
+    "trip_type_table": (
+        ["Trip_Type_Id", "Trip_Type_Description"],
+        [
+            (1, "Street-hail"),
+            (2, "Dispatch")
+        ])
+}
+
+# Column of the trips tables that references each lookup table (the first column of the lookup table is its key)
+LOOKUP_TABLE_TRIP_COLUMNS = {
+    "vendor_table":       "Vendor_Id",
+    "rate_code_table":    "Rate_Code_Id",
+    "payment_type_table": "Payment_Type_Id",
+    "trip_type_table":    "Trip_Type"    # green only
+}
+
+# The TLC files are named <color>_tripdata_<year>-<month>.parquet and downloaded to <color>/<year>/
+FILE_NAME_YEAR_MONTH_PATTERN = re.compile(r"_(\d{4})-(\d{2})\.parquet$")
+DIRECTORY_YEAR_PATTERN = re.compile(r"/(\d{4})/[^/]+$")
+
+# Error of the Spark Parquet reader when the type of a column in a file is not the declared one
+SCHEMA_COLUMN_CONVERT_ERROR_PATTERN = re.compile(
+    r"Parquet column cannot be converted in file (\S+)\. Column: \[([^\]]+)\], Expected: (\S+), Found: ([^.\s]+)")
+
+
+def GetTripsTableColumns(color, includeOptionalColumns=False):
+    """Returns the TRIPS_TABLE_COLUMNS of a color, without the OPTIONAL_TRIPS_TABLE_COLUMNS unless included"""
+    return [column for column in TRIPS_TABLE_COLUMNS[color]
+            if includeOptionalColumns or column[0] not in OPTIONAL_TRIPS_TABLE_COLUMNS[color]]
+
+
+def GetRawSchema(color, dataYear):
+    """Returns the declared schema for a year (the latest schema declared on or before the year)"""
+    schemas = RAW_SCHEMAS[color]
+    declaredYears = [declaredYear for declaredYear in sorted(schemas) if dataYear is not None and declaredYear <= dataYear]
+    if len(declaredYears) == 0:
+        # Unknown year (file not named like the TLC files): use the latest schema
+        declaredYears = sorted(schemas)
+    return schemas[declaredYears[-1]]
+
+
+def GetYearMonthFromPath(path):
+    """Returns (year, month) from a TLC file name or None"""
+    match = FILE_NAME_YEAR_MONTH_PATTERN.search(path)
+    if match is None:
+        return None
+    return (int(match.group(1)), int(match.group(2)))
+
+
+def GetYearFromPath(path):
+    match = FILE_NAME_YEAR_MONTH_PATTERN.search(path)
+    if match is None:
+        match = DIRECTORY_YEAR_PATTERN.search(path)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def ListRawFilesByYear(spark, source):
+    """Lists the files of a glob (e.g. gs://bucket/raw/taxi-data/yellow/*/*.parquet) grouped by year.
+       The source can also be a list of file paths.  This is a listing only, no Parquet footers are read."""
+    filesByYear = {}
+    if isinstance(source, list):
+        paths = source
+    else:
+        fs, hadoopPath = GetFileSystem(spark, source)
+        statuses = fs.globStatus(hadoopPath)
+        paths = [status.getPath().toString() for status in (statuses or []) if status.isFile()]
+    for path in paths:
+        filesByYear.setdefault(GetYearFromPath(path), []).append(path)
+    return filesByYear
+
+
+def ReadRawTaxiData(spark, color, source):
+    """Reads the raw files (glob or list of file paths) of a color, each year with its declared schema,
+       and upcasts the drifting columns"""
+    filesByYear = ListRawFilesByYear(spark, source)
+    if len(filesByYear) == 0:
+        raise FileNotFoundError("ReadRawTaxiData: no files found for " + source)
+
+    df_union = None
+    for dataYear in sorted(filesByYear, key=lambda fileYear: -1 if fileYear is None else fileYear):
+        df_year = spark.read \
+            .schema(GetRawSchema(color, dataYear)) \
+            .parquet(*filesByYear[dataYear])
+
+        for columnName, dataType in DRIFTING_COLUMNS[color].items():
+            df_year = df_year.withColumn(columnName, col(columnName).cast(dataType))
+
+        if df_union is None:
+            df_union = df_year
+        else:
+            df_union = df_union.unionByName(df_year)
+
+    return df_union
+
+
+def ExplainRawSchemaError(error):
+    """Returns a ValueError naming the raw file and column when the error is a declared schema mismatch, otherwise None"""
+    match = SCHEMA_COLUMN_CONVERT_ERROR_PATTERN.search(str(error))
+    if match is None:
+        return None
+    path, columnName, declaredType, fileType = match.groups()
+    return ValueError("ReadRawTaxiData: the raw file {} has the column {} as {}, the schema declared for the year {} reads it as {}.  "
+                      "Add a schema for this year to RAW_SCHEMAS in taxi_schema_registry.py, or convert with --schema-mode infer".format(
+                          path, columnName, fileType, GetYearFromPath(path), declaredType))
+
+
+def ReadRawTaxiDataInferred(spark, source):
+    """Reads the raw files (glob or list of file paths) with Spark schema inference"""
+    if isinstance(source, list):
+        return spark.read.parquet(*source)
+    return spark.read.parquet(source)
@@ -473,7 +473,7 @@ else
     gcloud auth activate-service-account "${var.deployment_service_account_name}" --key-file="$${GOOGLE_APPLICATION_CREDENTIALS}" --project="${var.project_id}"
     gcloud config set account "${var.deployment_service_account_name}"
 fi  
-gsutil cp ../dataproc/* gs://raw-${local.local_storage_bucket}/pyspark-code/
+gsutil cp ../dataproc/*.py gs://raw-${local.local_storage_bucket}/pyspark-code/
 EOF
   }
   depends_on = [